@@ -0,0 +1,168 @@
+"""
+Бенчмарк индексов векторного поиска: полнота, задержка и память.
+
+Для каждой конфигурации индекса из сетки строится индекс по матрице
+эмбеддингов и выполняются одиночные запросы, как в приложении. Выводятся
+recall@k относительно точного поиска, перцентили задержки запроса, время
+построения и размер индекса в памяти. Запросами служат векторы фрагментов
+корпуса с небольшим шумом либо, если задан ``--queries-path``, матрица
+эмбеддингов реальных запросов.
+
+Пример запуска из корня репозитория:
+
+    python benchmarks/ann_indexes.py --embeddings-path embeddings.npy \
+        --k 5 --queries 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from base.config import DenseIndexTypeChoice  # noqa: E402
+from chats.adapters.dense_indexes import (  # noqa: E402
+    DenseIndex,
+    DenseIndexParams,
+)
+
+
+def default_grid(n: int, dim: int) -> list[tuple[dict, list[dict]]]:
+    """
+    Сетка конфигураций по умолчанию.
+
+    Каждый элемент - параметры построения и список параметров поиска,
+    которые проверяются на одном построенном индексе.
+    """
+    nlist = max(1, int(4 * np.sqrt(n)))
+    pq_m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+    return [
+        ({"index_type": DenseIndexTypeChoice.FLAT}, [{}]),
+        (
+            {"index_type": DenseIndexTypeChoice.HNSW, "hnsw_m": 32},
+            [{"hnsw_ef_search": ef} for ef in (16, 32, 64, 128, 256)],
+        ),
+        (
+            {"index_type": DenseIndexTypeChoice.IVF_FLAT, "ivf_nlist": nlist},
+            [{"ivf_nprobe": nprobe} for nprobe in (1, 4, 16, 64)],
+        ),
+        (
+            {
+                "index_type": DenseIndexTypeChoice.IVF_PQ,
+                "ivf_nlist": nlist,
+                "pq_m": pq_m,
+            },
+            [{"ivf_nprobe": nprobe} for nprobe in (4, 16, 64)],
+        ),
+        ({"index_type": DenseIndexTypeChoice.SQ8}, [{}]),
+        (
+            {"index_type": DenseIndexTypeChoice.BINARY},
+            [{"binary_rerank_factor": factor} for factor in (1, 10, 50)],
+        ),
+    ]
+
+
+def sample_queries(
+    embeddings: np.ndarray, n_queries: int, noise: float
+) -> np.ndarray:
+    """Формирование запросов из зашумленных векторов корпуса."""
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(embeddings), min(n_queries, len(embeddings)))
+    queries = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    """Средняя доля точных соседей среди найденных."""
+    return float(
+        np.mean(
+            [
+                len(np.intersect1d(row, truth)) / len(truth)
+                for row, truth in zip(found, expected)
+            ]
+        )
+    )
+
+
+def measure(
+    dense_index: DenseIndex, queries: np.ndarray, k: int
+) -> tuple[np.ndarray, dict]:
+    """Одиночные запросы к индексу с замером задержек."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        started_at = time.perf_counter()
+        _, ids = dense_index.search(query[None], k)
+        latencies[i] = time.perf_counter() - started_at
+        found[i] = ids[0]
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return found, {
+        "latency_p50_ms": round(float(p50), 3),
+        "latency_p99_ms": round(float(p99), 3),
+        "qps": round(len(queries) / float(latencies.sum()), 1),
+    }
+
+
+def main() -> None:
+    """Точка входа бенчмарка."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--embeddings-path", required=True)
+    parser.add_argument("--queries-path")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--grid",
+        help=(
+            "JSON-список пар [параметры построения, [параметры поиска]] "
+            "вместо сетки по умолчанию."
+        ),
+    )
+    args = parser.parse_args()
+
+    embeddings = np.load(args.embeddings_path, mmap_mode="r")
+    if args.queries_path:
+        queries = np.load(args.queries_path).astype(np.float32)
+    else:
+        queries = sample_queries(embeddings, args.queries, args.noise)
+    grid = (
+        json.loads(args.grid)
+        if args.grid
+        else default_grid(*embeddings.shape)
+    )
+
+    exact = DenseIndex.build(embeddings, DenseIndexParams())
+    _, expected = exact.search(queries, args.k)
+
+    for build_params, search_grid in grid:
+        params = DenseIndexParams(**build_params)
+        started_at = time.perf_counter()
+        dense_index = DenseIndex.build(embeddings, params)
+        build_seconds = time.perf_counter() - started_at
+        memory_mb = dense_index.memory_bytes() / 2**20
+        for search_params in search_grid:
+            dense_index.set_search_params(
+                params.model_copy(update=search_params)
+            )
+            found, latency = measure(dense_index, queries, args.k)
+            row = {
+                **dense_index.params.model_dump(
+                    mode="json", include={"index_type", *build_params}
+                ),
+                **search_params,
+                f"recall@{args.k}": round(recall_at_k(found, expected), 4),
+                **latency,
+                "build_seconds": round(build_seconds, 3),
+                "memory_mb": round(memory_mb, 1),
+            }
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
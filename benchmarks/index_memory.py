@@ -0,0 +1,175 @@
+"""
+Бенчмарк памяти BM25 индекса в зависимости от числа воркеров.
+
+Запускает N процессов, имитирующих воркеры uvicorn, каждый загружает
+индекс и выполняет поисковые запросы. Для каждого числа воркеров
+выводятся RSS, PSS и USS на воркер: при загрузке pickle растет USS
+(частная копия), при mmap-индексе страницы делятся и растет только RSS.
+Режим mmap_compacted добавляет в индекс --delta-docs документов
+несколькими дельта-сегментами, удаляет часть из них и выполняет фоновое
+уплотнение, как воркер после применения журнала изменений: USS должен
+расти только на размер изменений, а база оставаться общей.
+
+Пример запуска из корня репозитория:
+
+    python benchmarks/index_memory.py --bm25-path bm_25_retriever.pkl \
+        --mmap-dir bm_25_index --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from chats.adapters.indexes import SegmentedBM25Index  # noqa: E402
+
+# Число дельта-сегментов, которыми добавляются документы до уплотнения.
+DELTA_BATCHES = 4
+
+
+def read_memory_kb() -> dict[str, int]:
+    """Чтение RSS, PSS и USS текущего процесса из /proc."""
+    memory = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                memory[name] = int(value.split()[0])
+    return {
+        "rss": memory["Rss"],
+        "pss": memory["Pss"],
+        "uss": memory["Private_Clean"] + memory["Private_Dirty"],
+    }
+
+
+def apply_deltas(
+    index: SegmentedBM25Index, queries: list[str], n_docs: int
+) -> None:
+    """Добавление, удаление документов и уплотнение дельта-сегментов."""
+    chunk_ids = []
+    for batch in range(DELTA_BATCHES):
+        chunk_ids += index.add_documents(
+            [
+                Document(
+                    page_content=queries[i % len(queries)],
+                    metadata={"source": f"delta{batch}"},
+                )
+                for i in range(n_docs // DELTA_BATCHES)
+            ]
+        )
+    index.remove_chunks(chunk_ids[::10])
+    index.compact()
+
+
+def worker(
+    mode: str,
+    path: str,
+    queries: list[str],
+    delta_docs: int,
+    barrier: multiprocessing.Barrier,
+    results: multiprocessing.Queue,
+) -> None:
+    """Процесс-воркер: загрузка индекса, поиск и замер памяти."""
+    if mode == "pickle":
+        with open(path, "rb") as f:
+            retriever = pickle.load(f)
+        for query in queries:
+            retriever.vectorizer.get_top_n(
+                retriever.preprocess_func(query), retriever.docs, n=5
+            )
+    else:
+        index = SegmentedBM25Index.from_directory(path)
+        if mode == "mmap_compacted":
+            apply_deltas(index, queries, delta_docs)
+        for query in queries:
+            index.search(query, 5)
+    # Замер после того, как все воркеры загрузили индекс, чтобы PSS
+    # учитывал разделение страниц между ними.
+    barrier.wait()
+    results.put(read_memory_kb())
+    barrier.wait()
+
+
+def sample_queries(index_dir: str, n_queries: int) -> list[str]:
+    """Формирование запросов из случайных термов словаря."""
+    index = SegmentedBM25Index.from_directory(index_dir)
+    terms = list(index.snapshot.segments[0].terms())
+    rng = random.Random(0)
+    return [
+        " ".join(rng.sample(terms, min(3, len(terms))))
+        for _ in range(n_queries)
+    ]
+
+
+def run(
+    mode: str,
+    path: str,
+    n_workers: int,
+    queries: list[str],
+    delta_docs: int,
+) -> dict:
+    """Замер памяти для заданного числа воркеров."""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(n_workers)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=worker,
+            args=(mode, path, queries, delta_docs, barrier, results),
+        )
+        for _ in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "mode": mode,
+        "workers": n_workers,
+        "rss_per_worker_mb": round(
+            sum(m["rss"] for m in measurements) / n_workers / 1024, 1
+        ),
+        "pss_per_worker_mb": round(
+            sum(m["pss"] for m in measurements) / n_workers / 1024, 1
+        ),
+        "uss_per_worker_mb": round(
+            sum(m["uss"] for m in measurements) / n_workers / 1024, 1
+        ),
+        "total_pss_mb": round(sum(m["pss"] for m in measurements) / 1024, 1),
+    }
+
+
+def main() -> None:
+    """Точка входа бенчмарка."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bm25-path", required=True)
+    parser.add_argument("--mmap-dir", required=True)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--delta-docs", type=int, default=1000)
+    args = parser.parse_args()
+
+    queries = sample_queries(args.mmap_dir, args.queries)
+    rows = [
+        run(mode, path, n_workers, queries, args.delta_docs)
+        for mode, path in (
+            ("pickle", args.bm25_path),
+            ("mmap", args.mmap_dir),
+            ("mmap_compacted", args.mmap_dir),
+        )
+        for n_workers in args.workers
+    ]
+    for row in rows:
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
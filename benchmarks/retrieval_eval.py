@@ -0,0 +1,267 @@
+"""
+Оценка ретриверов RAG-системы: качество, скорость и память.
+
+Для каждого типа ретривера из RetrieverTypeChoice репозиторий создается
+так же, как в приложении, по путям и параметрам из переменных окружения
+и .env. Каждый ретривер оценивается в отдельном процессе, чтобы замеры
+памяти не включали индексы других ретриверов. По размеченному файлу
+запросов считаются recall@k и MRR, по одиночным последовательным
+запросам - перцентили задержки, по одновременным запросам и пакетам -
+пропускная способность. Память - RSS и USS процесса после загрузки
+индекса и после запросов.
+
+Размеченный файл - JSON Lines со строками вида
+
+    {"query": "Как оформить возврат?", "relevant_chunk_ids": [12, 40]}
+
+Результат выводится строкой JSON на ретривер и, если задан --output,
+дописывается в файл JSON Lines для сравнения запусков во времени.
+
+Пример запуска из корня репозитория:
+
+    python benchmarks/retrieval_eval.py --labels eval/queries.jsonl \
+        --k 1 5 10 --concurrency 16 --output eval/results.jsonl
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from base.config import RetrieverTypeChoice  # noqa: E402
+from chats.adapters.repositories import RAGAbstractsRepository  # noqa: E402
+from chats.adapters.retrievers import create_rag_repository  # noqa: E402
+from index_memory import read_memory_kb  # noqa: E402
+
+
+def load_labels(path: str) -> list[tuple[str, set[int]]]:
+    """Чтение размеченных запросов и идентификаторов их фрагментов."""
+    labels = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                labels.append((row["query"], set(row["relevant_chunk_ids"])))
+    return labels
+
+
+def quality(
+    rankings: list[list[int | None]],
+    labels: list[tuple[str, set[int]]],
+    ks: list[int],
+) -> dict:
+    """recall@k для каждого k и MRR по выдачам длины max(ks)."""
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks = []
+    for ranking, (_, relevant) in zip(rankings, labels):
+        for k in ks:
+            found = relevant.intersection(ranking[:k])
+            recalls[k].append(len(found) / len(relevant) if relevant else 0)
+        reciprocal_ranks.append(
+            next(
+                (
+                    1 / rank
+                    for rank, chunk_id in enumerate(ranking, start=1)
+                    if chunk_id in relevant
+                ),
+                0.0,
+            )
+        )
+    return {
+        **{
+            f"recall@{k}": round(float(np.mean(values)), 4)
+            for k, values in recalls.items()
+        },
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+    }
+
+
+async def measure_sequential(
+    repository: RAGAbstractsRepository, queries: list[str], n_docs: int
+) -> tuple[list[list[int | None]], dict]:
+    """Выдачи и перцентили задержки одиночных последовательных запросов."""
+    rankings = []
+    seconds = []
+    for query in queries:
+        started_at = time.perf_counter()
+        chunks = await repository.get_relevant_chunks(query, n_docs)
+        seconds.append(time.perf_counter() - started_at)
+        rankings.append([chunk.chunk_id for chunk in chunks])
+    latencies = np.array(seconds) * 1000
+    return rankings, {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+    }
+
+
+async def measure_concurrent(
+    repository: RAGAbstractsRepository,
+    queries: list[str],
+    n_docs: int,
+    concurrency: int,
+) -> float:
+    """Запросов в секунду при concurrency одновременных запросах."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(query: str) -> None:
+        async with semaphore:
+            await repository.get_relevant_chunks(query, n_docs)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run(query) for query in queries))
+    return len(queries) / (time.perf_counter() - started_at)
+
+
+async def measure_batched(
+    repository: RAGAbstractsRepository,
+    queries: list[str],
+    n_docs: int,
+    batch_size: int,
+) -> float:
+    """Запросов в секунду при пакетном поиске по batch_size запросов."""
+    started_at = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        await repository.get_relevant_chunks_batch(
+            queries[start:start + batch_size], n_docs
+        )
+    return len(queries) / (time.perf_counter() - started_at)
+
+
+async def evaluate(
+    retriever_type: RetrieverTypeChoice,
+    labels: list[tuple[str, set[int]]],
+    args: argparse.Namespace,
+) -> dict:
+    """Оценка одного ретривера в текущем процессе."""
+    memory_before = read_memory_kb()
+    started_at = time.perf_counter()
+    repository = create_rag_repository(retriever_type)
+    queries = [query for query, _ in labels]
+    n_docs = max(args.k)
+    # Первый запрос загружает ленивые части индекса и модели.
+    await repository.get_relevant_chunks(queries[0], n_docs)
+    build_seconds = time.perf_counter() - started_at
+    memory_loaded = read_memory_kb()
+
+    rankings, latency = await measure_sequential(repository, queries, n_docs)
+    load_queries = queries * args.repeat
+    result = {
+        **quality(rankings, labels, args.k),
+        **latency,
+        "concurrency": args.concurrency,
+        "concurrent_qps": round(
+            await measure_concurrent(
+                repository, load_queries, n_docs, args.concurrency
+            ),
+            1,
+        ),
+    }
+    if args.batch_size:
+        result["batch_size"] = args.batch_size
+        result["batch_qps"] = round(
+            await measure_batched(
+                repository, load_queries, n_docs, args.batch_size
+            ),
+            1,
+        )
+    memory_after = read_memory_kb()
+    return {
+        **result,
+        "build_seconds": round(build_seconds, 2),
+        "index_rss_mb": round(
+            (memory_loaded["rss"] - memory_before["rss"]) / 1024, 1
+        ),
+        "index_uss_mb": round(
+            (memory_loaded["uss"] - memory_before["uss"]) / 1024, 1
+        ),
+        "rss_mb": round(memory_after["rss"] / 1024, 1),
+        "uss_mb": round(memory_after["uss"] / 1024, 1),
+    }
+
+
+def worker(
+    retriever_type: RetrieverTypeChoice,
+    labels: list[tuple[str, set[int]]],
+    args: argparse.Namespace,
+    results: multiprocessing.Queue,
+) -> None:
+    """Процесс оценки ретривера; ошибка загрузки попадает в результат."""
+    if not args.embedding_cache:
+        # Кэш эмбеддингов запросов отвечал бы на повторы из кэша.
+        os.environ["EMBEDDING_CACHE_SIZE"] = "0"
+    try:
+        results.put(asyncio.run(evaluate(retriever_type, labels, args)))
+    except Exception as exc:
+        results.put({"error": repr(exc)})
+
+
+def git_revision() -> str | None:
+    """Текущий коммит репозитория для сопоставления запусков."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """Точка входа оценки."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--labels", required=True)
+    parser.add_argument(
+        "--retrievers",
+        nargs="+",
+        type=RetrieverTypeChoice,
+        default=list(RetrieverTypeChoice),
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument("--embedding-cache", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "labels": os.path.basename(args.labels),
+        "queries": len(labels),
+    }
+    context = multiprocessing.get_context("spawn")
+    for retriever_type in args.retrievers:
+        results = context.Queue()
+        process = context.Process(
+            target=worker, args=(retriever_type, labels, args, results)
+        )
+        process.start()
+        result = results.get()
+        process.join()
+        line = json.dumps(
+            {**run, "retriever": retriever_type.value, **result},
+            ensure_ascii=False,
+        )
+        print(line, flush=True)
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
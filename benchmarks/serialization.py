@@ -0,0 +1,143 @@
+"""
+Бенчмарк сериализации истории чата в ответ API.
+
+Сравнивается путь ORM-объекты -> модели pydantic -> проверка по
+response_model и jsonable_encoder, который FastAPI выполняет для
+возвращаемых моделей, с прямой сериализацией строк БД через orjson.
+Строки и ORM-объекты строятся в памяти, поэтому замеряется только
+сериализация без запроса к БД. Для каждого способа выводятся время на
+ответ, сообщения в секунду и размер ответа; ответы всех способов
+сверяются между собой.
+
+Пример запуска из корня репозитория:
+
+    python benchmarks/serialization.py --messages 10000 --repeat 10
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from base.utils import dump_json_rows  # noqa: E402
+from chats.adapters.orm import MessageORM  # noqa: E402
+from chats.adapters.repositories import MESSAGE_FIELDS  # noqa: E402
+from chats.domain.models import Message  # noqa: E402
+from users.adapters.orm import UserORM  # noqa: E402, F401
+
+WORDS = (
+    "модель ответ документ запрос контекст индекс поиск фрагмент история "
+    "сообщение пользователь система данные время результат"
+).split()
+
+
+def make_rows(n_messages: int, content_chars: int) -> list[tuple]:
+    """Строки сообщений чата в порядке полей MESSAGE_FIELDS."""
+    random.seed(0)
+    started_at = datetime(2026, 1, 1, 12, 0, 0, 123456)
+    rows = []
+    for i in range(n_messages):
+        content = ""
+        while len(content) < content_chars:
+            content += random.choice(WORDS) + " "
+        rows.append(
+            (
+                i + 1,
+                1,
+                started_at + timedelta(seconds=i),
+                "user" if i % 2 == 0 else "assistant",
+                content.strip(),
+            )
+        )
+    return rows
+
+
+def serialize_models(rows: list[tuple]) -> Callable[[], bytes]:
+    """
+    Путь через ORM-объекты и модели pydantic.
+
+    Повторяет репозиторий (Message(**orm.__dict__)) и FastAPI: проверку
+    по response_model, jsonable_encoder и json.dumps из JSONResponse.
+    """
+    objects = [
+        MessageORM(**dict(zip(MESSAGE_FIELDS, row))) for row in rows
+    ]
+    response_adapter = TypeAdapter(list[Message])
+
+    def run() -> bytes:
+        messages = [Message(**message.__dict__) for message in objects]
+        validated = response_adapter.validate_python(
+            [message.model_dump() for message in messages]
+        )
+        return json.dumps(
+            jsonable_encoder(validated),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode()
+
+    return run
+
+
+def serialize_rows(rows: list[tuple]) -> Callable[[], bytes]:
+    """Прямая сериализация строк БД через orjson."""
+    return lambda: dump_json_rows(rows, MESSAGE_FIELDS)
+
+
+def measure(run: Callable[[], bytes], repeat: int) -> tuple[bytes, list]:
+    """Ответ и времена его построения по повторам."""
+    body = run()
+    seconds = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started_at)
+    return body, seconds
+
+
+def main() -> None:
+    """Точка входа бенчмарка."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--content-chars", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = make_rows(args.messages, args.content_chars)
+    bodies = {}
+    for name, factory in (
+        ("orm_pydantic", serialize_models),
+        ("rows_orjson", serialize_rows),
+    ):
+        body, seconds = measure(factory(rows), args.repeat)
+        bodies[name] = body
+        median = statistics.median(seconds)
+        print(
+            json.dumps(
+                {
+                    "path": name,
+                    "messages": args.messages,
+                    "median_ms": round(median * 1000, 2),
+                    "min_ms": round(min(seconds) * 1000, 2),
+                    "messages_per_second": round(args.messages / median),
+                    "response_mb": round(len(body) / 2**20, 2),
+                }
+            )
+        )
+    parsed = [json.loads(body) for body in bodies.values()]
+    if any(other != parsed[0] for other in parsed[1:]):
+        raise SystemExit("Ответы разных способов сериализации различаются.")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,11 +22,111 @@ def get_postgres_url() -> str:
     )
 
 
+def get_replica_postgres_url() -> str | None:
+    """
+    Получение URL подключения к реплике PostgreSQL для чтения.
+
+    Реплика задается DB_REPLICA_HOST и DB_REPLICA_PORT, остальные
+    параметры подключения совпадают с основной БД.
+    """
+    if not os.getenv("DB_REPLICA_HOST"):
+        return None
+    return (
+        "postgresql+asyncpg://"
+        + os.getenv("DB_USER")
+        + ":"
+        + os.getenv("DB_PASSWORD")
+        + "@"
+        + os.getenv("DB_REPLICA_HOST")
+        + ":"
+        + (os.getenv("DB_REPLICA_PORT") or os.getenv("DB_PORT"))
+        + "/"
+        + os.getenv("DB_NAME")
+    )
+
+
+def get_db_pool_size() -> int:
+    """Получение числа постоянных соединений в пуле движка БД."""
+    if os.getenv("DB_POOL_SIZE"):
+        return int(os.getenv("DB_POOL_SIZE"))
+    return 5
+
+
+def get_db_max_overflow() -> int:
+    """Получение числа временных соединений сверх размера пула."""
+    if os.getenv("DB_MAX_OVERFLOW"):
+        return int(os.getenv("DB_MAX_OVERFLOW"))
+    return 10
+
+
+def get_db_pool_timeout() -> float:
+    """Получение времени ожидания свободного соединения в секундах."""
+    if os.getenv("DB_POOL_TIMEOUT"):
+        return float(os.getenv("DB_POOL_TIMEOUT"))
+    return 30.0
+
+
+def get_db_pool_recycle() -> int:
+    """Получение времени жизни соединения в секундах (-1 - без ограничения)."""
+    if os.getenv("DB_POOL_RECYCLE"):
+        return int(os.getenv("DB_POOL_RECYCLE"))
+    return 1_800
+
+
+def is_db_pool_pre_ping() -> bool:
+    """Проверять ли соединение перед выдачей из пула."""
+    return os.getenv("DB_POOL_PRE_PING", "True") == "True"
+
+
+def is_behind_pgbouncer() -> bool:
+    """
+    Подключается ли приложение к БД через PgBouncer.
+
+    В режиме пула транзакций PgBouncer подготовленные выражения asyncpg
+    не переживают смену серверного соединения, поэтому их кэш
+    отключается.
+    """
+    return os.getenv("DB_BEHIND_PGBOUNCER") == "True"
+
+
+def get_read_your_writes_window() -> float:
+    """Получение времени чтения из основной БД после записи в секундах."""
+    if os.getenv("READ_YOUR_WRITES_WINDOW"):
+        return float(os.getenv("READ_YOUR_WRITES_WINDOW"))
+    return 5.0
+
+
 def show_sql_logs() -> bool:
     """Показывать ли логи SQL-запросов."""
     return os.getenv("SHOW_SQL_LOGS") == "True"
 
 
+class QueryStatsModeChoice(Enum):
+    """Режимы учета SQL-запросов каждого HTTP-запроса."""
+
+    OFF = "off"
+    LOG = "log"
+    HEADERS = "headers"
+
+
+def get_query_stats_mode() -> QueryStatsModeChoice:
+    """
+    Получение режима учета SQL-запросов для разработки и тестов.
+
+    В режиме log число выражений, транзакций, строк и время в БД
+    записываются в лог по завершении запроса, в режиме headers еще и
+    добавляются в заголовки ответа.
+    """
+    return QueryStatsModeChoice(os.getenv("QUERY_STATS_MODE") or "off")
+
+
+def get_query_repeat_threshold() -> int:
+    """Получение числа повторов выражения для предупреждения о N+1."""
+    if os.getenv("QUERY_REPEAT_THRESHOLD"):
+        return int(os.getenv("QUERY_REPEAT_THRESHOLD"))
+    return 5
+
+
 def get_secret_key() -> str:
     """Получение секретного ключа."""
     return os.getenv("SECRET_KEY")
@@ -58,6 +158,50 @@ def get_refresh_token_expires_hours() -> int:
     return 24
 
 
+def get_scrypt_n() -> int:
+    """
+    Получение параметра стоимости scrypt для хеширования паролей.
+
+    Степень двойки. Память на одно хеширование - 128 * n * r байт.
+    """
+    if os.getenv("SCRYPT_N"):
+        return int(os.getenv("SCRYPT_N"))
+    return 2**14
+
+
+def get_scrypt_r() -> int:
+    """Получение размера блока scrypt для хеширования паролей."""
+    if os.getenv("SCRYPT_R"):
+        return int(os.getenv("SCRYPT_R"))
+    return 8
+
+
+def get_scrypt_p() -> int:
+    """Получение параметра параллелизма scrypt для хеширования паролей."""
+    if os.getenv("SCRYPT_P"):
+        return int(os.getenv("SCRYPT_P"))
+    return 1
+
+
+def get_password_hash_workers() -> int:
+    """Получение числа процессов хеширования паролей."""
+    if os.getenv("PASSWORD_HASH_WORKERS"):
+        return int(os.getenv("PASSWORD_HASH_WORKERS"))
+    return 2
+
+
+def get_password_hash_max_pending() -> int:
+    """
+    Получение лимита одновременных хеширований паролей.
+
+    Сверх лимита регистрация и вход отклоняются с рекомендацией повтора,
+    а не ждут в очереди пула процессов.
+    """
+    if os.getenv("PASSWORD_HASH_MAX_PENDING"):
+        return int(os.getenv("PASSWORD_HASH_MAX_PENDING"))
+    return 32
+
+
 def get_time_for_getting_jwt_from_ws() -> int:
     """Получение времени для предоставления JWT через WebSocket."""
     if os.getenv("TIME_FOR_GETTING_JWT_FROM_WS"):
@@ -70,6 +214,123 @@ def get_llm_url() -> str:
     return f"http://{os.getenv('LLM_HOST')}:{os.getenv('LLM_PORT')}"
 
 
+def get_llm_backend_urls() -> list[str]:
+    """
+    Получение адресов реплик микросервиса большой языковой модели.
+
+    Реплики перечисляются в LLM_BACKENDS через запятую в формате
+    host:port, по умолчанию используется единственная реплика из
+    LLM_HOST и LLM_PORT.
+    """
+    if os.getenv("LLM_BACKENDS"):
+        return [
+            f"http://{backend.strip()}"
+            for backend in os.getenv("LLM_BACKENDS").split(",")
+            if backend.strip()
+        ]
+    return [get_llm_url()]
+
+
+def get_llm_slots_per_backend() -> int:
+    """Получение числа слотов (параллельных KV-кэшей) реплики LLM."""
+    if os.getenv("LLM_SLOTS_PER_BACKEND"):
+        return int(os.getenv("LLM_SLOTS_PER_BACKEND"))
+    return 1
+
+
+def get_llm_max_in_flight_per_slot() -> int:
+    """Получение числа запросов к слоту LLM до перехода на соседний."""
+    if os.getenv("LLM_MAX_IN_FLIGHT_PER_SLOT"):
+        return int(os.getenv("LLM_MAX_IN_FLIGHT_PER_SLOT"))
+    return 1
+
+
+def get_llm_circuit_failure_threshold() -> int:
+    """Получение числа ошибок подряд до отключения реплики LLM."""
+    if os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD"):
+        return int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD"))
+    return 3
+
+
+def get_llm_circuit_open_seconds() -> float:
+    """Получение времени отключения реплики LLM до пробного запроса."""
+    if os.getenv("LLM_CIRCUIT_OPEN_SECONDS"):
+        return float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS"))
+    return 30.0
+
+
+def get_llm_hedge_after_ms() -> float | None:
+    """
+    Получение задержки дублирования запроса в другую реплику LLM.
+
+    Дублирование удваивает нагрузку на медленных запросах, поэтому по
+    умолчанию выключено.
+    """
+    if os.getenv("LLM_HEDGE_AFTER_MS"):
+        return float(os.getenv("LLM_HEDGE_AFTER_MS"))
+    return None
+
+
+def get_llm_health_check_path() -> str:
+    """Получение пути проверки здоровья реплики LLM."""
+    return os.getenv("LLM_HEALTH_CHECK_PATH") or "/health"
+
+
+def get_llm_health_check_interval() -> float:
+    """Получение интервала проверки здоровья реплик LLM в секундах."""
+    if os.getenv("LLM_HEALTH_CHECK_INTERVAL"):
+        return float(os.getenv("LLM_HEALTH_CHECK_INTERVAL"))
+    return 10.0
+
+
+def get_llm_max_concurrency() -> int:
+    """
+    Получение числа одновременно обрабатываемых запросов к LLM.
+
+    По умолчанию равно суммарной емкости слотов всех реплик.
+    """
+    if os.getenv("LLM_MAX_CONCURRENCY"):
+        return int(os.getenv("LLM_MAX_CONCURRENCY"))
+    return (
+        len(get_llm_backend_urls())
+        * get_llm_slots_per_backend()
+        * get_llm_max_in_flight_per_slot()
+    )
+
+
+def get_llm_max_queue_wait() -> float:
+    """Получение допустимой оценки ожидания в очереди к LLM в секундах."""
+    if os.getenv("LLM_MAX_QUEUE_WAIT"):
+        return float(os.getenv("LLM_MAX_QUEUE_WAIT"))
+    return 60.0
+
+
+def get_rag_max_concurrency() -> int:
+    """Получение числа одновременно обрабатываемых запросов только к RAG."""
+    if os.getenv("RAG_MAX_CONCURRENCY"):
+        return int(os.getenv("RAG_MAX_CONCURRENCY"))
+    return os.cpu_count() or 1
+
+
+def get_rag_max_queue_wait() -> float:
+    """Получение допустимой оценки ожидания в очереди к RAG в секундах."""
+    if os.getenv("RAG_MAX_QUEUE_WAIT"):
+        return float(os.getenv("RAG_MAX_QUEUE_WAIT"))
+    return 5.0
+
+
+def get_max_queued_requests_per_user() -> int:
+    """Получение числа ожидающих запросов пользователя в одной полосе."""
+    if os.getenv("MAX_QUEUED_REQUESTS_PER_USER"):
+        return int(os.getenv("MAX_QUEUED_REQUESTS_PER_USER"))
+    return 2
+
+
+def get_llm_system_prompt() -> str | None:
+    """Получение системного промпта большой языковой модели."""
+    return os.getenv("LLM_SYSTEM_PROMPT") or None
+
+
 def get_max_tokens_for_model() -> int:
     """Получение размера контекстного окна модели."""
     if os.getenv("N_TOKENS"):
@@ -77,6 +338,53 @@ def get_max_tokens_for_model() -> int:
     return 5_000
 
 
+def get_history_trim_step() -> int:
+    """Получение шага отсечения старых сообщений истории в токенах."""
+    if os.getenv("HISTORY_TRIM_STEP"):
+        return int(os.getenv("HISTORY_TRIM_STEP"))
+    return max(get_max_tokens_for_model() // 4, 1)
+
+
+def get_history_cache_size() -> int:
+    """Получение числа чатов в кэше последних сообщений (0 - отключен)."""
+    if os.getenv("HISTORY_CACHE_SIZE"):
+        return int(os.getenv("HISTORY_CACHE_SIZE"))
+    return 0
+
+
+def get_message_partitions_ahead() -> int:
+    """Получение числа месяцев, секции сообщений которых создаются заранее."""
+    if os.getenv("MESSAGE_PARTITIONS_AHEAD"):
+        return int(os.getenv("MESSAGE_PARTITIONS_AHEAD"))
+    return 3
+
+
+def get_chat_archive_idle_months() -> int:
+    """Получение числа месяцев без сообщений до архивации чата."""
+    if os.getenv("CHAT_ARCHIVE_IDLE_MONTHS"):
+        return int(os.getenv("CHAT_ARCHIVE_IDLE_MONTHS"))
+    return 6
+
+
+def get_chat_metadata_cache_ttl() -> float:
+    """
+    Получение времени жизни записей кэша владельцев и типов в секундах.
+
+    Ограничивает, как долго процесс не видит удаление или архивацию
+    чата, выполненные другим процессом.
+    """
+    if os.getenv("CHAT_METADATA_CACHE_TTL"):
+        return float(os.getenv("CHAT_METADATA_CACHE_TTL"))
+    return 300.0
+
+
+def get_chat_metadata_cache_size() -> int:
+    """Получение числа чатов в кэше владельцев и типов (0 - отключен)."""
+    if os.getenv("CHAT_METADATA_CACHE_SIZE"):
+        return int(os.getenv("CHAT_METADATA_CACHE_SIZE"))
+    return 10_000
+
+
 def get_n_relevant_docs() -> int:
     """Получение размера топа релевантных документов для извлечения."""
     if os.getenv("N_DOCS"):
@@ -84,6 +392,20 @@ def get_n_relevant_docs() -> int:
     return 5
 
 
+def get_max_batch_messages() -> int:
+    """Получение максимального числа вопросов в пакетном запросе."""
+    if os.getenv("MAX_BATCH_MESSAGES"):
+        return int(os.getenv("MAX_BATCH_MESSAGES"))
+    return 200
+
+
+def get_export_batch_size() -> int:
+    """Получение числа строк, читаемых из БД за раз при выгрузке."""
+    if os.getenv("EXPORT_BATCH_SIZE"):
+        return int(os.getenv("EXPORT_BATCH_SIZE"))
+    return 1_000
+
+
 def get_embedding_model_path() -> str:
     """Получение пути до модели эмбеддингов."""
     return (
@@ -106,6 +428,359 @@ def get_bm25_retriever_path() -> str:
     )
 
 
+def _get_project_path(relative_path: str) -> str:
+    """Получение абсолютного пути относительно корня проекта."""
+    return (
+        os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        + "/"
+        + relative_path
+    )
+
+
+def get_faiss_index_path() -> str:
+    """Получение пути до FAISS индекса."""
+    return _get_project_path(os.getenv("FAISS_INDEX_PATH") or "faiss.index")
+
+
+def get_index_manifest_path() -> str:
+    """Получение пути до манифеста поисковых индексов."""
+    return _get_project_path(
+        os.getenv("INDEX_MANIFEST_PATH") or "index_manifest.json"
+    )
+
+
+def get_chunk_size() -> int:
+    """Получение размера фрагмента документа в символах."""
+    if os.getenv("CHUNK_SIZE"):
+        return int(os.getenv("CHUNK_SIZE"))
+    return 1_000
+
+
+def get_chunk_overlap() -> int:
+    """Получение размера перекрытия соседних фрагментов в символах."""
+    if os.getenv("CHUNK_OVERLAP"):
+        return int(os.getenv("CHUNK_OVERLAP"))
+    return 200
+
+
+def is_embedding_model_quantized() -> bool:
+    """Использовать ли int8-квантизованную модель эмбеддингов."""
+    return os.getenv("EMBEDDING_QUANTIZED") == "True"
+
+
+def get_embedding_threads() -> int | None:
+    """Получение числа потоков ONNX Runtime для модели эмбеддингов."""
+    if os.getenv("EMBEDDING_THREADS"):
+        return int(os.getenv("EMBEDDING_THREADS"))
+    return None
+
+
+def get_embedding_max_batch_size() -> int:
+    """Получение максимального размера батча запросов к модели эмбеддингов."""
+    if os.getenv("EMBEDDING_MAX_BATCH_SIZE"):
+        return int(os.getenv("EMBEDDING_MAX_BATCH_SIZE"))
+    return 32
+
+
+def get_embedding_max_wait_ms() -> float:
+    """Получение времени накопления батча запросов в миллисекундах."""
+    if os.getenv("EMBEDDING_MAX_WAIT_MS"):
+        return float(os.getenv("EMBEDDING_MAX_WAIT_MS"))
+    return 5.0
+
+
+def get_embedding_cache_size() -> int:
+    """Получение размера LRU-кэша эмбеддингов запросов."""
+    if os.getenv("EMBEDDING_CACHE_SIZE"):
+        return int(os.getenv("EMBEDDING_CACHE_SIZE"))
+    return 1_024
+
+
+def get_bm25_mmap_index_path() -> str:
+    """Получение пути до каталога BM25 индекса, отображаемого в память."""
+    return _get_project_path(
+        os.getenv("BM25_MMAP_INDEX_PATH") or "bm_25_index"
+    )
+
+
+def get_embeddings_path() -> str:
+    """Получение пути до матрицы эмбеддингов фрагментов корпуса."""
+    return _get_project_path(os.getenv("EMBEDDINGS_PATH") or "embeddings.npy")
+
+
+def get_embedding_chunk_ids_path() -> str:
+    """Получение пути до идентификаторов фрагментов строк эмбеддингов."""
+    return _get_project_path(
+        os.getenv("EMBEDDING_CHUNK_IDS_PATH") or "embedding_chunk_ids.npy"
+    )
+
+
+def get_bm25_delta_log_path() -> str:
+    """Получение пути до журнала изменений BM25 индекса."""
+    return _get_project_path(
+        os.getenv("BM25_DELTA_LOG_PATH") or "bm_25_delta_log"
+    )
+
+
+def get_bm25_max_segments() -> int:
+    """Получение числа дельта-сегментов BM25 индекса до их слияния."""
+    if os.getenv("BM25_MAX_SEGMENTS"):
+        return int(os.getenv("BM25_MAX_SEGMENTS"))
+    return 8
+
+
+def get_bm25_max_tombstone_ratio() -> float:
+    """Получение доли удаленных документов дельта-сегментов до слияния."""
+    if os.getenv("BM25_MAX_TOMBSTONE_RATIO"):
+        return float(os.getenv("BM25_MAX_TOMBSTONE_RATIO"))
+    return 0.2
+
+
+def get_index_refresh_interval() -> float:
+    """Получение периода проверки журнала изменений индекса в секундах."""
+    if os.getenv("INDEX_REFRESH_INTERVAL"):
+        return float(os.getenv("INDEX_REFRESH_INTERVAL"))
+    return 30.0
+
+
+def get_max_context_tokens() -> int:
+    """Получение бюджета токенов на контекст из найденных фрагментов."""
+    if os.getenv("MAX_CONTEXT_TOKENS"):
+        return int(os.getenv("MAX_CONTEXT_TOKENS"))
+    return 1_024
+
+
+def get_retrieval_candidates_factor() -> int:
+    """Получение множителя числа кандидатов для отбора фрагментов."""
+    if os.getenv("RETRIEVAL_CANDIDATES_FACTOR"):
+        return int(os.getenv("RETRIEVAL_CANDIDATES_FACTOR"))
+    return 4
+
+
+def get_mmr_lambda() -> float:
+    """Получение баланса релевантности и разнообразия для MMR."""
+    if os.getenv("MMR_LAMBDA"):
+        return float(os.getenv("MMR_LAMBDA"))
+    return 0.7
+
+
+def get_duplicate_similarity_threshold() -> float:
+    """Получение порога сходства, выше которого фрагменты - дубликаты."""
+    if os.getenv("DUPLICATE_SIMILARITY_THRESHOLD"):
+        return float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD"))
+    return 0.9
+
+
+def get_relevance_score_gap() -> float:
+    """Получение относительного разрыва скоров для отсечения выдачи."""
+    if os.getenv("RELEVANCE_SCORE_GAP"):
+        return float(os.getenv("RELEVANCE_SCORE_GAP"))
+    return 0.3
+
+
+def get_hybrid_relevance_score_gap() -> float:
+    """
+    Получение относительного разрыва скоров для отсечения выдачи RRF.
+
+    Скоры RRF гибридного поиска образуют уровни по числу ретриверов,
+    нашедших фрагмент, и разрыв между уровнями около 0.5 не говорит о
+    падении релевантности, поэтому по умолчанию отсечение выключено.
+    """
+    if os.getenv("HYBRID_RELEVANCE_SCORE_GAP"):
+        return float(os.getenv("HYBRID_RELEVANCE_SCORE_GAP"))
+    return 0.0
+
+
+class RetrieverTypeChoice(Enum):
+    """Типы ретриверов RAG-системы."""
+
+    BM25 = "bm25"
+    SEGMENTED_BM25 = "segmented_bm25"
+    DENSE = "dense"
+    HYBRID = "hybrid"
+
+
+def get_retriever_type() -> RetrieverTypeChoice:
+    """Получение типа используемого ретривера."""
+    return RetrieverTypeChoice(os.getenv("RETRIEVER_TYPE") or "bm25")
+
+
+def get_rrf_k() -> int:
+    """Получение константы RRF для объединения выдач гибридного поиска."""
+    if os.getenv("RRF_K"):
+        return int(os.getenv("RRF_K"))
+    return 60
+
+
+class DenseIndexTypeChoice(Enum):
+    """Типы индексов векторного поиска."""
+
+    FLAT = "flat"
+    HNSW = "hnsw"
+    IVF_FLAT = "ivf_flat"
+    IVF_PQ = "ivf_pq"
+    SQ8 = "sq8"
+    BINARY = "binary"
+
+
+def get_dense_index_type() -> DenseIndexTypeChoice:
+    """Получение типа индекса векторного поиска."""
+    return DenseIndexTypeChoice(os.getenv("DENSE_INDEX_TYPE") or "flat")
+
+
+def get_hnsw_m() -> int:
+    """Получение числа связей вершины графа HNSW."""
+    if os.getenv("HNSW_M"):
+        return int(os.getenv("HNSW_M"))
+    return 32
+
+
+def get_hnsw_ef_construction() -> int:
+    """Получение ширины поиска при построении графа HNSW."""
+    if os.getenv("HNSW_EF_CONSTRUCTION"):
+        return int(os.getenv("HNSW_EF_CONSTRUCTION"))
+    return 200
+
+
+def get_hnsw_ef_search() -> int:
+    """Получение ширины поиска по графу HNSW при запросе."""
+    if os.getenv("HNSW_EF_SEARCH"):
+        return int(os.getenv("HNSW_EF_SEARCH"))
+    return 64
+
+
+def get_ivf_nlist() -> int | None:
+    """Получение числа кластеров IVF индекса."""
+    if os.getenv("IVF_NLIST"):
+        return int(os.getenv("IVF_NLIST"))
+    return None
+
+
+def get_ivf_nprobe() -> int:
+    """Получение числа просматриваемых кластеров IVF индекса."""
+    if os.getenv("IVF_NPROBE"):
+        return int(os.getenv("IVF_NPROBE"))
+    return 16
+
+
+def get_pq_m() -> int:
+    """Получение числа подвекторов продуктового квантования."""
+    if os.getenv("PQ_M"):
+        return int(os.getenv("PQ_M"))
+    return 48
+
+
+def get_pq_nbits() -> int:
+    """Получение числа бит на код подвектора продуктового квантования."""
+    if os.getenv("PQ_NBITS"):
+        return int(os.getenv("PQ_NBITS"))
+    return 8
+
+
+def get_binary_rerank_factor() -> int:
+    """Получение множителя числа кандидатов бинарного индекса."""
+    if os.getenv("BINARY_RERANK_FACTOR"):
+        return int(os.getenv("BINARY_RERANK_FACTOR"))
+    return 10
+
+
+def get_llm_request_timeout() -> float:
+    """
+    Получение срока обработки запроса к чату с LLM в секундах.
+
+    Срок отсчитывается от поступления запроса и передается микросервису
+    LLM, чтобы он прекращал генерацию ответа, который уже не нужен.
+    """
+    if os.getenv("LLM_REQUEST_TIMEOUT"):
+        return float(os.getenv("LLM_REQUEST_TIMEOUT"))
+    return 300.0
+
+
+def get_disconnect_poll_interval() -> float:
+    """Получение периода проверки отключения клиента в секундах."""
+    if os.getenv("DISCONNECT_POLL_INTERVAL"):
+        return float(os.getenv("DISCONNECT_POLL_INTERVAL"))
+    return 0.5
+
+
+class BillingPolicyChoice(Enum):
+    """Политики списания средств за ответ в чате."""
+
+    REFUND = "refund"
+    CHARGE_ON_SUCCESS = "charge_on_success"
+
+
+def get_billing_policy() -> BillingPolicyChoice:
+    """
+    Получение политики списания средств за ответ.
+
+    При refund средства списываются до ответа и возвращаются, если ответ
+    не получен, при charge_on_success - только после ответа.
+    """
+    return BillingPolicyChoice(os.getenv("BILLING_POLICY") or "refund")
+
+
+class WriteBehindModeChoice(Enum):
+    """Режимы отложенной записи сообщений и транзакций."""
+
+    OFF = "off"
+    ASYNC = "async"
+    DURABLE = "durable"
+
+
+def get_write_behind_mode() -> WriteBehindModeChoice:
+    """
+    Получение режима отложенной записи.
+
+    В режиме async запрос завершается до записи строк в БД, в режиме
+    durable - после фиксации пачки, в которую они попали.
+    """
+    return WriteBehindModeChoice(os.getenv("WRITE_BEHIND_MODE") or "off")
+
+
+def get_write_behind_max_rows() -> int:
+    """Получение числа строк, при котором буфер записывается сразу."""
+    if os.getenv("WRITE_BEHIND_MAX_ROWS"):
+        return int(os.getenv("WRITE_BEHIND_MAX_ROWS"))
+    return 500
+
+
+def get_write_behind_flush_interval() -> float:
+    """Получение периода записи буфера в секундах."""
+    if os.getenv("WRITE_BEHIND_FLUSH_INTERVAL"):
+        return float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL"))
+    return 0.05
+
+
+def get_chat_purge_batch_size() -> int | None:
+    """
+    Получение размера пачки фонового удаления сообщений чатов.
+
+    Если задан, удаляемый чат только помечается, а его сообщения
+    удаляются фоновой задачей пачками. Иначе чат с сообщениями удаляется
+    одним каскадным запросом.
+    """
+    if os.getenv("CHAT_PURGE_BATCH_SIZE"):
+        return int(os.getenv("CHAT_PURGE_BATCH_SIZE"))
+    return None
+
+
+def get_chat_purge_interval() -> float:
+    """Получение периода фонового удаления сообщений чатов в секундах."""
+    if os.getenv("CHAT_PURGE_INTERVAL"):
+        return float(os.getenv("CHAT_PURGE_INTERVAL"))
+    return 5.0
+
+
+class ExportFormatChoice(Enum):
+    """Форматы выгрузки данных."""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
 class ChatTypeChoice(Enum):
     """Типы чатов."""
 
@@ -0,0 +1,238 @@
+"""Модуль движков базы данных."""
+
+from collections import OrderedDict
+from contextvars import ContextVar
+import hashlib
+import hmac
+from http.cookies import SimpleCookie
+import time
+from uuid import uuid4
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import (
+    get_db_max_overflow,
+    get_db_pool_recycle,
+    get_db_pool_size,
+    get_db_pool_timeout,
+    get_query_stats_mode,
+    is_behind_pgbouncer,
+    is_db_pool_pre_ping,
+    QueryStatsModeChoice,
+    show_sql_logs,
+)
+from .query_stats import instrument_engine
+
+# Заголовок и cookie с подписанной отметкой последней записи
+# пользователя, которую клиент возвращает в следующих запросах.
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+
+def create_engine(url: str) -> AsyncEngine:
+    """
+    Создание асинхронного движка с настройками пула из конфигурации.
+
+    За PgBouncer в режиме пула транзакций соседние запросы сессии могут
+    попасть в разные серверные соединения, поэтому кэш подготовленных
+    выражений asyncpg отключается, а безымянные выражения получают
+    уникальные имена, чтобы не конфликтовать между клиентами. Если
+    включен учет SQL-запросов, к движку подключается его учет.
+    """
+    url = make_url(url)
+    connect_args = {}
+    if is_behind_pgbouncer() and url.get_driver_name() == "asyncpg":
+        url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    engine = create_async_engine(
+        url,
+        echo=show_sql_logs(),
+        pool_size=get_db_pool_size(),
+        max_overflow=get_db_max_overflow(),
+        pool_timeout=get_db_pool_timeout(),
+        pool_recycle=get_db_pool_recycle(),
+        pool_pre_ping=is_db_pool_pre_ping(),
+        connect_args=connect_args,
+    )
+    if get_query_stats_mode() != QueryStatsModeChoice.OFF:
+        instrument_engine(engine)
+    return engine
+
+
+class _RequestWrites:
+    """Отметки записи пользователя, полученная и сделанная в запросе."""
+
+    def __init__(self, received: tuple[int, float] | None):
+        """Инициализация отметок."""
+        self.received = received
+        self.written: tuple[int, float] | None = None
+
+
+_request_writes: ContextVar[_RequestWrites | None] = ContextVar(
+    "request_writes", default=None
+)
+
+
+class ReadYourWritesTracker:
+    """
+    Учет недавних записей пользователей для чтения своих изменений.
+
+    Реплика отстает от основной БД, поэтому в течение окна после записи
+    чтения пользователя направляются в основную БД. Окно должно
+    превышать типичное отставание реплики. Запись учитывается в памяти
+    процесса, а в запросе с ReadYourWritesMiddleware еще и отметкой
+    времени записи, подписанной secret_key. Клиент возвращает ее в
+    следующих запросах, поэтому их чтения остаются в основной БД и в
+    других воркерах. Время отметки сравнивается по часам серверов.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        secret_key: str | None = None,
+        max_users: int = 100_000,
+    ):
+        """Инициализация учета."""
+        self.window = window
+        self.max_users = max_users
+        self._secret_key = (secret_key or "").encode()
+        self._written_at: OrderedDict[int, float] = OrderedDict()
+
+    def mark_write(self, user_id: int) -> None:
+        """Учет записи пользователя."""
+        self._written_at[user_id] = time.monotonic()
+        self._written_at.move_to_end(user_id)
+        self._evict()
+        request_writes = _request_writes.get()
+        if request_writes is not None:
+            request_writes.written = (user_id, time.time())
+
+    def must_read_primary(self, user_id: int | None) -> bool:
+        """Нужно ли читать данные пользователя из основной БД."""
+        written_at = self._written_at.get(user_id)
+        if (
+            written_at is not None
+            and time.monotonic() - written_at < self.window
+        ):
+            return True
+        request_writes = _request_writes.get()
+        if request_writes is None:
+            return False
+        for marker in (request_writes.written, request_writes.received):
+            if marker is not None and marker[0] == user_id:
+                return self._is_recent(marker[1])
+        return False
+
+    def sign(self, user_id: int, written_at: float) -> str:
+        """Подписанная отметка записи пользователя."""
+        payload = f"{user_id}:{written_at:.3f}"
+        return f"{payload}:{self._signature(payload)}"
+
+    def verify(self, value: str | None) -> tuple[int, float] | None:
+        """
+        Пользователь и время записи из подписанной отметки.
+
+        Отметка с неверной подписью или вне окна не учитывается, поэтому
+        клиент не может надолго направить свои чтения в основную БД.
+        """
+        if not value:
+            return None
+        payload, _, signature = value.rpartition(":")
+        if not hmac.compare_digest(self._signature(payload), signature):
+            return None
+        user_id, _, written_at = payload.partition(":")
+        try:
+            marker = (int(user_id), float(written_at))
+        except ValueError:
+            return None
+        return marker if self._is_recent(marker[1]) else None
+
+    def _signature(self, payload: str) -> str:
+        """Подпись отметки записи."""
+        return hmac.new(
+            self._secret_key, payload.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def _is_recent(self, written_at: float) -> bool:
+        """Попадает ли время записи по часам сервера в окно."""
+        return 0 <= time.time() - written_at < self.window
+
+    def _evict(self) -> None:
+        """Удаление записей старше окна и сверх лимита пользователей."""
+        now = time.monotonic()
+        while self._written_at:
+            user_id, written_at = next(iter(self._written_at.items()))
+            if (
+                now - written_at < self.window
+                and len(self._written_at) <= self.max_users
+            ):
+                return
+            del self._written_at[user_id]
+
+
+class ReadYourWritesMiddleware:
+    """
+    Передача отметки последней записи пользователя между воркерами.
+
+    Отметка из заголовка X-Last-Write или cookie запроса учитывается
+    трекером в чтениях запроса. Если запрос записал данные до начала
+    ответа, новая отметка отправляется в заголовке и cookie ответа со
+    сроком окна. Запись после начала потокового ответа учитывается
+    только в памяти воркера.
+    """
+
+    def __init__(self, app: ASGIApp, tracker: ReadYourWritesTracker):
+        """Инициализация middleware."""
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Обработка запроса с отметкой последней записи."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_writes = _RequestWrites(
+            self.tracker.verify(_get_last_write(scope))
+        )
+        token = _request_writes.set(request_writes)
+
+        async def send_with_marker(message: Message) -> None:
+            if (
+                message["type"] == "http.response.start"
+                and request_writes.written is not None
+            ):
+                value = self.tracker.sign(*request_writes.written)
+                cookie = (
+                    f"{LAST_WRITE_COOKIE}={value}; "
+                    f"Max-Age={int(self.tracker.window) + 1}; Path=/; "
+                    "HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (LAST_WRITE_HEADER.lower().encode(), value.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_marker)
+        finally:
+            _request_writes.reset(token)
+
+
+def _get_last_write(scope: Scope) -> str | None:
+    """Отметка последней записи из заголовка или cookie запроса."""
+    header = LAST_WRITE_HEADER.lower().encode()
+    cookies = SimpleCookie()
+    for name, value in scope["headers"]:
+        if name == header:
+            return value.decode("latin-1")
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+    morsel = cookies.get(LAST_WRITE_COOKIE)
+    return morsel.value if morsel else None
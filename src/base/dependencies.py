@@ -4,21 +4,43 @@ from typing import Annotated
 
 from fastapi import Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from chats.adapters.metadata_cache import ChatMetadataCache
+from chats.adapters.repositories import bump_inserted_chat_versions
+from users.adapters.hashing import PasswordHasher
 from users.services.services import UserService
 from users.services.unit_of_work import UserSqlAlchemyUnitOfWork
 from .config import (
     get_access_token_expires_minutes,
+    get_chat_metadata_cache_size,
+    get_chat_metadata_cache_ttl,
+    get_password_hash_max_pending,
+    get_password_hash_workers,
     get_postgres_url,
+    get_read_your_writes_window,
     get_refresh_token_expires_hours,
+    get_replica_postgres_url,
+    get_scrypt_n,
+    get_scrypt_p,
+    get_scrypt_r,
     get_secret_key,
-    show_sql_logs,
+    get_write_behind_flush_interval,
+    get_write_behind_max_rows,
+    get_write_behind_mode,
+    WriteBehindModeChoice,
 )
 from .data_structures import JWTPayloadDTO
+from .database import create_engine, ReadYourWritesTracker
 from .utils import JWTHandler
+from .write_behind import WriteBehindBuffer
 
-engine = create_async_engine(get_postgres_url(), echo=show_sql_logs())
+engine = create_engine(get_postgres_url())
+replica_url = get_replica_postgres_url()
+read_engine = create_engine(replica_url) if replica_url else None
+write_tracker = ReadYourWritesTracker(
+    get_read_your_writes_window(), get_secret_key()
+)
 
 
 def get_session_factory() -> async_sessionmaker:
@@ -30,8 +52,93 @@ SessionFactoryDependency = Annotated[
     async_sessionmaker, Depends(get_session_factory)
 ]
 
+
+def get_read_session_factory() -> async_sessionmaker | None:
+    """Получение фабрики сессий реплики для чтения, если она задана."""
+    if read_engine is None:
+        return None
+    return async_sessionmaker(
+        bind=read_engine, autoflush=False, autocommit=False
+    )
+
+
+ReadSessionFactoryDependency = Annotated[
+    async_sessionmaker | None, Depends(get_read_session_factory)
+]
+
+
+def get_write_tracker() -> ReadYourWritesTracker:
+    """Получение учета недавних записей пользователей."""
+    return write_tracker
+
+
+WriteTrackerDependency = Annotated[
+    ReadYourWritesTracker, Depends(get_write_tracker)
+]
+
+write_buffer = (
+    WriteBehindBuffer(
+        get_session_factory(),
+        max_rows=get_write_behind_max_rows(),
+        flush_interval=get_write_behind_flush_interval(),
+        durable=get_write_behind_mode() == WriteBehindModeChoice.DURABLE,
+        on_insert=bump_inserted_chat_versions,
+    )
+    if get_write_behind_mode() != WriteBehindModeChoice.OFF
+    else None
+)
+
+
+def get_write_buffer() -> WriteBehindBuffer | None:
+    """Получение буфера отложенной записи, если он включен."""
+    return write_buffer
+
+
+WriteBufferDependency = Annotated[
+    WriteBehindBuffer | None, Depends(get_write_buffer)
+]
+
+# Кэш метаданных чатов общий для сервисов чатов и пользователей:
+# удаление пользователя сбрасывает его чаты.
+metadata_cache = (
+    ChatMetadataCache(
+        get_chat_metadata_cache_size(), get_chat_metadata_cache_ttl()
+    )
+    if get_chat_metadata_cache_size()
+    else None
+)
+
+
+def get_metadata_cache() -> ChatMetadataCache | None:
+    """Получение кэша метаданных чатов, если он включен."""
+    return metadata_cache
+
+
+MetadataCacheDependency = Annotated[
+    ChatMetadataCache | None, Depends(get_metadata_cache)
+]
+
 SecretKeyDependency = Annotated[get_secret_key, Depends(get_secret_key)]
 
+password_hasher = PasswordHasher(
+    get_secret_key(),
+    n=get_scrypt_n(),
+    r=get_scrypt_r(),
+    p=get_scrypt_p(),
+    max_workers=get_password_hash_workers(),
+    max_pending=get_password_hash_max_pending(),
+)
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Получение хеширования паролей."""
+    return password_hasher
+
+
+PasswordHasherDependency = Annotated[
+    PasswordHasher, Depends(get_password_hasher)
+]
+
 
 def get_jwt_handler(
     secret_key: SecretKeyDependency,
@@ -72,12 +179,20 @@ from fastapi import Depends
 
 def get_service(
     session_factory: SessionFactoryDependency,
-    secret_key: SecretKeyDependency,
+    read_session_factory: ReadSessionFactoryDependency,
+    write_tracker: WriteTrackerDependency,
+    write_buffer: WriteBufferDependency,
+    password_hasher: PasswordHasherDependency,
+    metadata_cache: MetadataCacheDependency,
 ) -> UserService:
     """Получение сервиса."""
     return UserService(
-        uow=UserSqlAlchemyUnitOfWork(session_factory),
-        secret_key=secret_key,
+        uow=UserSqlAlchemyUnitOfWork(
+            session_factory, read_session_factory, write_tracker
+        ),
+        password_hasher=password_hasher,
+        write_buffer=write_buffer,
+        chat_metadata_cache=metadata_cache,
     )
 
 
@@ -5,11 +5,18 @@ from jwt import ExpiredSignatureError
 
 from .exceptions import (
     AlreadyExistsException,
+    ClientDisconnectedException,
+    DeadlineExceededException,
     DoesntExistException,
+    EmptyMessageException,
+    InsufficientFundsException,
+    InvalidBatchException,
     InvalidTokenException,
+    LLMUnavailableException,
     PermissionException,
+    ServiceOverloadedException,
+    TooManyRequestsException,
     UnauthorizedException,
-    InsufficientFundsException,
 )
 
 
@@ -38,6 +45,44 @@ async def exception_handler_with_402_status(request, exc):
     raise HTTPException(status_code=402, detail=str(exc))
 
 
+async def exception_handler_with_503_status(request, exc):
+    """Обработчик исключений с кодом 503."""
+    raise HTTPException(status_code=503, detail=str(exc))
+
+
+async def exception_handler_with_504_status(request, exc):
+    """Обработчик исключений с кодом 504."""
+    raise HTTPException(status_code=504, detail=str(exc))
+
+
+async def exception_handler_with_499_status(request, exc):
+    """
+    Обработчик исключений с кодом 499.
+
+    Ответ клиент уже не получит, код нужен для логов доступа, как у
+    nginx для закрытых клиентом запросов.
+    """
+    raise HTTPException(status_code=499, detail=str(exc))
+
+
+async def exception_handler_with_429_status(request, exc):
+    """Обработчик исключений с кодом 429 и заголовком Retry-After."""
+    raise HTTPException(
+        status_code=429,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def exception_handler_with_503_status_and_retry(request, exc):
+    """Обработчик исключений с кодом 503 и заголовком Retry-After."""
+    raise HTTPException(
+        status_code=503,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 EXCEPTION_HANDLERS = {
     DoesntExistException: exception_handler_with_404_status,
     AlreadyExistsException: exception_handler_with_400_status,
@@ -46,4 +91,11 @@ EXCEPTION_HANDLERS = {
     UnauthorizedException: exception_handler_with_401_status,
     ExpiredSignatureError: exception_handler_with_401_status,
     InsufficientFundsException: exception_handler_with_402_status,
+    EmptyMessageException: exception_handler_with_400_status,
+    InvalidBatchException: exception_handler_with_400_status,
+    LLMUnavailableException: exception_handler_with_503_status,
+    DeadlineExceededException: exception_handler_with_504_status,
+    ClientDisconnectedException: exception_handler_with_499_status,
+    TooManyRequestsException: exception_handler_with_429_status,
+    ServiceOverloadedException: exception_handler_with_503_status_and_retry,
 }
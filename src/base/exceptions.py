@@ -25,5 +25,38 @@ class EmptyMessageException(Exception):
     """Исключение при получении пустого сообщения."""
 
 
+class InvalidBatchException(Exception):
+    """Исключение при некорректном пакетном запросе."""
+
+
 class InsufficientFundsException(Exception):
     """Исключение при недостатке средств."""
+
+
+class LLMUnavailableException(Exception):
+    """Исключение при недоступности всех реплик языковой модели."""
+
+
+class DeadlineExceededException(Exception):
+    """Исключение при истечении срока обработки запроса."""
+
+
+class ClientDisconnectedException(Exception):
+    """Исключение при отключении клиента до получения ответа."""
+
+
+class RetryLaterException(Exception):
+    """Исключение при отказе в обслуживании с рекомендацией повтора."""
+
+    def __init__(self, message: str, retry_after: int):
+        """Инициализация исключения с задержкой повтора в секундах."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TooManyRequestsException(RetryLaterException):
+    """Исключение при превышении пользователем лимита запросов."""
+
+
+class ServiceOverloadedException(RetryLaterException):
+    """Исключение при перегрузке сервиса."""
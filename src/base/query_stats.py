@@ -0,0 +1,178 @@
+"""Модуль учета SQL-запросов каждого HTTP-запроса."""
+
+from collections import Counter
+from contextvars import ContextVar
+import logging
+import time
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_HEADERS = {
+    "statements": "X-DB-Statements",
+    "transactions": "X-DB-Transactions",
+    "rows": "X-DB-Rows",
+    "time_ms": "X-DB-Time-Ms",
+    "max_repeats": "X-DB-Max-Repeats",
+}
+
+
+class QueryStats:
+    """
+    Учет SQL-запросов одного HTTP-запроса.
+
+    Повторы считаются по тексту выражения без параметров: одно и то же
+    выражение, выполненное в запросе много раз, обычно означает N+1
+    запрос, например ленивую загрузку связи в цикле.
+    """
+
+    def __init__(self):
+        """Инициализация учета."""
+        self.statements = 0
+        self.transactions = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.repeats: Counter[str] = Counter()
+
+    @property
+    def max_repeats(self) -> int:
+        """Наибольшее число выполнений одного выражения."""
+        return max(self.repeats.values(), default=0)
+
+    def most_repeated(self) -> str | None:
+        """Чаще всего выполнявшееся выражение."""
+        if not self.repeats:
+            return None
+        return self.repeats.most_common(1)[0][0]
+
+    def as_dict(self) -> dict:
+        """Учет в виде полей для заголовков и логов."""
+        return {
+            "statements": self.statements,
+            "transactions": self.transactions,
+            "rows": self.rows,
+            "time_ms": round(self.db_time * 1000, 2),
+            "max_repeats": self.max_repeats,
+        }
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar(
+    "query_stats", default=None
+)
+# Наблюдатели завершенных HTTP-запросов, которые вызываются с путем
+# запроса и его учетом, например бюджет запросов в тестах.
+observers: list[Callable[[str, QueryStats], None]] = []
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Подключение учета к движку.
+
+    Учитываются только выражения, выполненные в контексте HTTP-запроса
+    с QueryStatsMiddleware, поэтому фоновые задачи не искажают учет.
+    Транзакции считаются по их началу: asyncpg начинает их без
+    отдельного выражения BEGIN. Строки считаются по буферу курсоров
+    асинхронных драйверов, который заполняется при выполнении; строки
+    курсоров на стороне сервера, читаемые позже пачками, не учитываются.
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "begin")
+    def on_begin(connection) -> None:
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.transactions += 1
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(
+        connection, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if _current_stats.get() is not None:
+            connection.info.setdefault("query_started_at", []).append(
+                time.perf_counter()
+            )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(
+        connection, cursor, statement, parameters, context, executemany
+    ) -> None:
+        stats = _current_stats.get()
+        started = connection.info.get("query_started_at")
+        if stats is None or not started:
+            return
+        stats.db_time += time.perf_counter() - started.pop()
+        stats.statements += 1
+        stats.repeats[statement] += 1
+        if cursor.description is not None:
+            stats.rows += len(getattr(cursor, "_rows", ()))
+
+
+class QueryStatsMiddleware:
+    """
+    Учет SQL-запросов каждого HTTP-запроса.
+
+    Учет добавляется в заголовки ответа, если with_headers, и в поля
+    лога по завершении запроса. Заголовки отправляются до тела ответа,
+    поэтому для потоковых ответов они содержат только запросы до начала
+    ответа, а лог - все. Выражение, выполненное repeat_threshold раз и
+    больше, записывается в лог предупреждением о возможном N+1 запросе.
+    """
+
+    def __init__(
+        self, app: ASGIApp, with_headers: bool, repeat_threshold: int
+    ):
+        """Инициализация middleware."""
+        self.app = app
+        self.with_headers = with_headers
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Обработка запроса с учетом SQL-запросов."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.with_headers:
+                fields = stats.as_dict()
+                message["headers"] = [
+                    *message.get("headers", []),
+                    *(
+                        (header.encode(), str(fields[key]).encode())
+                        for key, header in QUERY_STATS_HEADERS.items()
+                    ),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _current_stats.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope: Scope, stats: QueryStats) -> None:
+        """Запись учета в лог и передача наблюдателям."""
+        fields = stats.as_dict()
+        logger.info(
+            "%s %s: %s",
+            scope["method"],
+            scope["path"],
+            " ".join(f"{key}={value}" for key, value in fields.items()),
+            extra={"db": fields},
+        )
+        if stats.max_repeats >= self.repeat_threshold:
+            logger.warning(
+                "Возможен N+1 запрос в %s %s: выражение выполнено %s раз: %s",
+                scope["method"],
+                scope["path"],
+                stats.max_repeats,
+                stats.most_repeated(),
+            )
+        for observer in observers:
+            observer(scope["path"], stats)
@@ -0,0 +1,78 @@
+"""
+Плагин pytest с бюджетом SQL-запросов эндпойнтов.
+
+Подключается в conftest.py строкой pytest_plugins = ["base.testing"].
+Учет ведет QueryStatsMiddleware, поэтому до импорта приложения в
+тестах должен быть задан QUERY_STATS_MODE=log или headers. Пример:
+
+    def test_chat_answer(client, query_budget):
+        with query_budget(statements=8, transactions=2, repeats=1):
+            client.post(f"/api/v1/chats/chat/{chat_id}/", json=message)
+"""
+
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterator
+
+import pytest
+
+from .query_stats import observers, QueryStats
+
+QueryBudget = Callable[..., ContextManager[list[tuple[str, QueryStats]]]]
+
+
+@pytest.fixture
+def query_budget() -> QueryBudget:
+    """
+    Бюджет SQL-запросов каждого HTTP-запроса внутри блока with.
+
+    Лимиты задаются на число выражений, транзакций, строк и повторов
+    одного выражения; незаданные не проверяются. Тест падает, если
+    хотя бы один запрос блока превысил лимит или учет не вел ни одного
+    запроса, например из-за выключенного QUERY_STATS_MODE. Блок
+    возвращает список путей запросов и их учета для своих проверок.
+    """
+
+    @contextmanager
+    def budget(
+        statements: int | None = None,
+        transactions: int | None = None,
+        rows: int | None = None,
+        repeats: int | None = None,
+    ) -> Iterator[list[tuple[str, QueryStats]]]:
+        recorded = []
+
+        def observe(path: str, stats: QueryStats) -> None:
+            recorded.append((path, stats))
+
+        observers.append(observe)
+        try:
+            yield recorded
+        finally:
+            observers.remove(observe)
+        if not recorded:
+            pytest.fail(
+                "Не учтено ни одного запроса: задайте QUERY_STATS_MODE."
+            )
+        limits = {
+            "statements": statements,
+            "transactions": transactions,
+            "rows": rows,
+            "max_repeats": repeats,
+        }
+        violations = [
+            f"{path}: {field} = {value} > {limits[field]}"
+            + (
+                f" ({stats.most_repeated()})"
+                if field == "max_repeats"
+                else ""
+            )
+            for path, stats in recorded
+            for field, value in stats.as_dict().items()
+            if limits.get(field) is not None and value > limits[field]
+        ]
+        if violations:
+            pytest.fail(
+                "Превышен бюджет SQL-запросов:\n" + "\n".join(violations)
+            )
+
+    return budget
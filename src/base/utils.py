@@ -1,19 +1,47 @@
 """Утилиты."""
 
+import asyncio
+import csv
 from datetime import datetime, timedelta, timezone
+from enum import Enum
+import io
+import json
+import math
 import pickle
-from typing import Literal
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Literal,
+    Sequence,
+)
 
 import jwt
 from langchain_community.retrievers import BM25Retriever
+import orjson
 
+from base.config import ExportFormatChoice
 from base.data_structures import (
     AccessTokenDTO,
     JWTPayloadDTO,
     JWTPayloadExtendedDTO,
     TokenPairDTO,
 )
-from base.exceptions import InvalidTokenException
+from base.exceptions import (
+    ClientDisconnectedException,
+    InvalidTokenException,
+)
+
+# Оценка сверху для токенизаторов LLaMA на русском тексте.
+CHARS_PER_TOKEN = 3
+CLIENT_DISCONNECTED_EXC_MESSAGE = "Клиент отключился до получения ответа."
+JSON_MEDIA_TYPE = "application/json"
+EXPORT_MEDIA_TYPES = {
+    ExportFormatChoice.NDJSON: "application/x-ndjson",
+    ExportFormatChoice.CSV: "text/csv",
+}
 
 
 class JWTHandler:
@@ -100,3 +128,206 @@ def load_retriever(load_path: str) -> BM25Retriever:
     """Загружает ретривер из pkl."""
     with open(load_path, "rb") as f:
         return pickle.load(f)
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов текста без вызова токенизатора модели."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, n_tokens: int) -> str:
+    """Обрезка текста до оценочного числа токенов по границе слова."""
+    max_chars = n_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    truncated = text[:max_chars]
+    return truncated.rsplit(maxsplit=1)[0] if " " in truncated else truncated
+
+
+async def cancel_on_disconnect(
+    awaitable: Awaitable[Any],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float,
+) -> Any:
+    """
+    Ожидание результата с отменой при отключении клиента.
+
+    Сервер не отменяет обработчик запроса, когда клиент закрывает
+    соединение, поэтому отключение проверяется раз в poll_interval
+    секунд, и при нем работа отменяется вместе с запросами к внешним
+    сервисам.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                raise ClientDisconnectedException(
+                    CLIENT_DISCONNECTED_EXC_MESSAGE
+                )
+    finally:
+        task.cancel()
+
+
+def make_etag(*parts: Hashable) -> str:
+    """Построение ETag из частей токена версии ресурса."""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Совпадает ли ETag с одним из тегов заголовка If-None-Match.
+
+    Для условного GET теги сравниваются слабо, то есть без учета
+    префикса W/.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag
+        for tag in if_none_match.split(",")
+    )
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых асинхронных вычислений.
+
+    Первый вызов с ключом запускает вычисление в отдельной задаче, а
+    вызовы с тем же ключом до его завершения ждут ту же задачу и получают
+    тот же результат или то же исключение. Отмена одного ожидающего не
+    прерывает вычисление для остальных; задача отменяется, только когда
+    отменены все ожидающие. Результат не кэшируется: после завершения
+    задачи следующий вызов запускает новое вычисление.
+    """
+
+    def __init__(self):
+        """Инициализация пустого набора вычислений."""
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[Hashable, int] = {}
+        self._n_calls = 0
+        self._n_shared = 0
+
+    async def do(
+        self, key: Hashable, func: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Выполнение func или ожидание уже запущенного вычисления."""
+        self._n_calls += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self._n_shared += 1
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """Удаление завершенного вычисления."""
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._waiters[key]
+
+    def get_stats(self) -> dict:
+        """Статистика объединения вычислений."""
+        return {
+            "calls": self._n_calls,
+            "shared": self._n_shared,
+            "in_flight": len(self._tasks),
+        }
+
+
+async def prefetch(iterator: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Получение первого элемента асинхронного итератора заранее.
+
+    Потоковый ответ отправляет заголовки до первого элемента, поэтому
+    ошибки доступа и отсутствия объектов должны возникнуть до его
+    создания, чтобы их обработали обработчики исключений.
+    """
+    try:
+        first = await anext(iterator)
+    except StopAsyncIteration:
+        first = None
+
+    async def chain() -> AsyncIterator[Any]:
+        if first is None:
+            return
+        yield first
+        async for item in iterator:
+            yield item
+
+    return chain()
+
+
+async def serialize_export(
+    partitions: AsyncIterator[Sequence[Sequence]],
+    fields: list[str],
+    export_format: ExportFormatChoice,
+) -> AsyncIterator[str]:
+    """
+    Сериализация выгрузки в NDJSON или CSV по мере чтения строк.
+
+    Каждая пачка строк из БД сериализуется и отдается в ответ целиком,
+    поэтому память не зависит от объема выгрузки.
+    """
+    if export_format == ExportFormatChoice.CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        async for rows in partitions:
+            writer.writerows(
+                [_export_value(value) for value in row] for row in rows
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+    async for rows in partitions:
+        yield "".join(
+            json.dumps(
+                {
+                    field: _export_value(value)
+                    for field, value in zip(fields, row)
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+            for row in rows
+        )
+
+
+def dump_json_rows(rows: Sequence[Sequence], fields: Sequence[str]) -> bytes:
+    """
+    Сериализация строк БД в JSON-массив объектов без моделей pydantic.
+
+    Перечисления записываются значениями, а время - в ISO 8601, как при
+    сериализации моделей ответа, поэтому результат соответствует их
+    схеме при совпадении порядка fields с порядком полей модели.
+    """
+    return orjson.dumps([dict(zip(fields, row)) for row in rows])
+
+
+def _export_value(value: Any) -> Any:
+    """Приведение значения из БД к типу, сериализуемому в выгрузке."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
@@ -0,0 +1,309 @@
+"""Модуль отложенной пакетной записи строк в БД."""
+
+import asyncio
+from collections import Counter
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from .orm import Base
+
+logger = logging.getLogger(__name__)
+
+# Ошибки самих строк, которые не исчезнут при повторе записи.
+NON_RETRYABLE_ERRORS = (IntegrityError, DataError)
+MAX_RETRY_DELAY = 5.0
+# Обработчик записанных строк по моделям в транзакции их записи.
+InsertHook = Callable[
+    [AsyncSession, dict[type[Base], list[dict]]], Awaitable[None]
+]
+
+
+class _PendingRow:
+    """Строка, ожидающая записи, и ожидание ее фиксации."""
+
+    def __init__(
+        self,
+        model: type[Base],
+        row: dict,
+        user_id: int,
+        ignore_conflicts: bool,
+    ):
+        """Инициализация строки."""
+        self.model = model
+        self.row = row
+        self.user_id = user_id
+        self.ignore_conflicts = ignore_conflicts
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи строк из многих запросов.
+
+    Строки копятся в памяти процесса и записываются одной транзакцией с
+    многострочными INSERT по таблицам, когда буфер достигает max_rows
+    строк, раз в flush_interval секунд и при остановке. В режиме durable
+    добавление строки ждет фиксации ее пачки, и запросы делят одну
+    фиксацию вместо своей. Иначе добавление возвращается сразу, и строки
+    теряются при аварийном завершении процесса.
+
+    Чтения пользователя должны вызывать sync, чтобы видеть свои
+    записи: при наличии его незаписанных строк буфер записывается
+    досрочно.
+
+    Строки, не записанные из-за временной ошибки БД, например обрыва
+    соединения, возвращаются в начало буфера, и запись повторяется с
+    экспоненциальной задержкой. Строка отбрасывается только при ошибке
+    целостности или данных самой строки.
+
+    on_insert вызывается в транзакции записи после вставки строк с
+    записанными строками по моделям, например чтобы обновить зависящие
+    от них строки других таблиц той же фиксацией.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        max_rows: int,
+        flush_interval: float,
+        durable: bool,
+        on_insert: InsertHook | None = None,
+    ):
+        """Инициализация буфера."""
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.durable = durable
+        self.on_insert = on_insert
+        self._pending: list[_PendingRow] = []
+        self._pending_users: Counter[int] = Counter()
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._size_flushes: set[asyncio.Task] = set()
+        self._n_flushes = 0
+        self._n_rows = 0
+        self._n_dropped = 0
+        self._n_retries = 0
+        self._n_failures = 0
+        self._retry_at = 0.0
+
+    async def add(
+        self,
+        model: type[Base],
+        row: dict,
+        user_id: int,
+        ignore_conflicts: bool = False,
+    ) -> None:
+        """
+        Добавление строки таблицы модели model в буфер.
+
+        С ignore_conflicts строка, совпадающая по ключу с уже
+        записанной, пропускается.
+        """
+        await self.add_many([(model, row, ignore_conflicts)], user_id)
+
+    async def add_many(
+        self,
+        rows: list[tuple[type[Base], dict, bool]],
+        user_id: int,
+    ) -> None:
+        """
+        Добавление строк в буфер одной операцией.
+
+        Строки задаются тройками из модели, строки и ignore_conflicts и
+        попадают в буфер подряд в заданном порядке. В режиме durable
+        ожидается фиксация всех строк сразу, поэтому строки одного
+        запроса обычно записываются одной пачкой.
+        """
+        batch = [
+            _PendingRow(model, row, user_id, ignore_conflicts)
+            for model, row, ignore_conflicts in rows
+        ]
+        self._pending.extend(batch)
+        self._pending_users[user_id] += len(batch)
+        if len(self._pending) >= self.max_rows:
+            task = asyncio.create_task(self.flush())
+            self._size_flushes.add(task)
+            task.add_done_callback(self._size_flushes.discard)
+        if self.durable:
+            await asyncio.gather(*(pending.future for pending in batch))
+        else:
+            for pending in batch:
+                # Исключение записи уже залогировано при сбросе буфера.
+                pending.future.add_done_callback(_consume_exception)
+
+    async def sync(self, user_id: int) -> None:
+        """Запись буфера, если в нем или в записи есть строки пользователя."""
+        if self._pending_users[user_id]:
+            await self.flush()
+
+    async def flush(self, force: bool = False) -> None:
+        """
+        Запись накопленных строк после завершения текущей записи.
+
+        После временной ошибки запись до истечения задержки повтора
+        пропускается, если не задан force.
+        """
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            if not force and loop.time() < self._retry_at:
+                return
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            retry = batch
+            try:
+                retry = await self._write(batch)
+            finally:
+                if retry:
+                    self._pending = retry + self._pending
+                self._pending_users.subtract(
+                    pending.user_id
+                    for pending in batch
+                    if pending.future.done()
+                )
+                self._pending_users += Counter()
+            if retry:
+                self._n_failures += 1
+                self._n_retries += 1
+                delay = min(
+                    self.flush_interval * 2**self._n_failures,
+                    MAX_RETRY_DELAY,
+                )
+                self._retry_at = loop.time() + delay
+            else:
+                self._n_failures = 0
+                self._retry_at = 0.0
+
+    async def _write(self, batch: list[_PendingRow]) -> list[_PendingRow]:
+        """
+        Запись пачки строк одной транзакцией.
+
+        Если пачка отклонена из-за ошибки строки, строки записываются по
+        одной, чтобы строка, ссылающаяся, например, на удаленный за это
+        время чат, не отменяла запись остальных. Возвращаются строки,
+        не записанные из-за временной ошибки, для повторной записи.
+        """
+        self._n_flushes += 1
+        try:
+            await self._insert(batch)
+        except NON_RETRYABLE_ERRORS as exc:
+            if len(batch) == 1:
+                self._fail(batch[0], exc)
+                return []
+            logger.warning(
+                "Пачка из %s строк не записана, запись по одной: %s",
+                len(batch),
+                exc,
+            )
+            for position, pending in enumerate(batch):
+                try:
+                    await self._insert([pending])
+                except NON_RETRYABLE_ERRORS as row_exc:
+                    self._fail(pending, row_exc)
+                except Exception as row_exc:
+                    self._log_retry(len(batch) - position, row_exc)
+                    return batch[position:]
+                else:
+                    self._succeed([pending])
+            return []
+        except Exception as exc:
+            self._log_retry(len(batch), exc)
+            return batch
+        self._succeed(batch)
+        return []
+
+    def _log_retry(self, n_rows: int, exc: Exception) -> None:
+        """Запись в лог временной ошибки записи."""
+        logger.warning(
+            "Запись %s строк отложена до повтора: %s", n_rows, exc
+        )
+
+    async def _insert(self, batch: list[_PendingRow]) -> None:
+        """Многострочная вставка строк по таблицам и фиксация."""
+        rows_by_model: dict[tuple[type[Base], bool], list[dict]] = {}
+        for pending in batch:
+            rows_by_model.setdefault(
+                (pending.model, pending.ignore_conflicts), []
+            ).append(pending.row)
+        async with self.session_factory() as session:
+            for (model, ignore_conflicts), rows in rows_by_model.items():
+                statement = (
+                    pg_insert(model).on_conflict_do_nothing()
+                    if ignore_conflicts
+                    else insert(model)
+                )
+                await session.execute(statement, rows)
+            if self.on_insert is not None:
+                inserted: dict[type[Base], list[dict]] = {}
+                for (model, _), rows in rows_by_model.items():
+                    inserted.setdefault(model, []).extend(rows)
+                await self.on_insert(session, inserted)
+            await session.commit()
+
+    def _succeed(self, batch: list[_PendingRow]) -> None:
+        """Завершение ожидания записанных строк."""
+        self._n_rows += len(batch)
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_result(None)
+
+    def _fail(self, pending: _PendingRow, exc: Exception) -> None:
+        """Отказ от записи строки."""
+        self._n_dropped += 1
+        logger.error(
+            "Строка %s не записана: %s", pending.model.__tablename__, exc
+        )
+        if not pending.future.done():
+            pending.future.set_exception(exc)
+
+    def start(self) -> None:
+        """Запуск периодической записи в текущем цикле событий."""
+        if self._flush_task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                # Остановка не должна прерывать запись уже взятой пачки.
+                await asyncio.shield(self.flush())
+
+        self._flush_task = asyncio.get_running_loop().create_task(run())
+
+    async def close(self) -> None:
+        """
+        Остановка периодической записи и запись остатка буфера.
+
+        Запись остатка не ждет задержки повтора; строки, которые не
+        удалось записать и на этот раз, теряются с ошибкой в логе.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush(force=True)
+        if self._pending:
+            logger.error(
+                "При остановке не записано строк: %s", len(self._pending)
+            )
+
+    def get_stats(self) -> dict:
+        """Статистика буфера."""
+        return {
+            "durable": self.durable,
+            "pending": len(self._pending),
+            "flushes": self._n_flushes,
+            "rows": self._n_rows,
+            "dropped": self._n_dropped,
+            "retries": self._n_retries,
+        }
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    """Пометка исключения будущего результата как обработанного."""
+    if not future.cancelled():
+        future.exception()
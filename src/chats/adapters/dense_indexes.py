@@ -0,0 +1,249 @@
+"""Модуль индексов приближенного поиска ближайших соседей."""
+
+import faiss
+import numpy as np
+from pydantic import BaseModel
+
+from base.config import (
+    DenseIndexTypeChoice,
+    get_binary_rerank_factor,
+    get_dense_index_type,
+    get_hnsw_ef_construction,
+    get_hnsw_ef_search,
+    get_hnsw_m,
+    get_ivf_nlist,
+    get_ivf_nprobe,
+    get_pq_m,
+    get_pq_nbits,
+)
+
+
+class DenseIndexParams(BaseModel):
+    """Параметры построения и поиска индекса векторного поиска."""
+
+    index_type: DenseIndexTypeChoice = DenseIndexTypeChoice.FLAT
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nlist: int | None = None
+    ivf_nprobe: int = 16
+    pq_m: int = 48
+    pq_nbits: int = 8
+    binary_rerank_factor: int = 10
+
+    @classmethod
+    def from_config(cls) -> "DenseIndexParams":
+        """Получение параметров из переменных окружения."""
+        return cls(
+            index_type=get_dense_index_type(),
+            hnsw_m=get_hnsw_m(),
+            hnsw_ef_construction=get_hnsw_ef_construction(),
+            hnsw_ef_search=get_hnsw_ef_search(),
+            ivf_nlist=get_ivf_nlist(),
+            ivf_nprobe=get_ivf_nprobe(),
+            pq_m=get_pq_m(),
+            pq_nbits=get_pq_nbits(),
+            binary_rerank_factor=get_binary_rerank_factor(),
+        )
+
+
+class DenseIndex:
+    """
+    Индекс векторного поиска по нормированным эмбеддингам.
+
+    Идентификаторы фрагментов строк матрицы эмбеддингов хранятся рядом
+    с ней в ``chunk_ids``; без них номер строки считается
+    идентификатором фрагмента, как в индексах первых версий. Точный
+    поиск (``flat``) выполняется умножением матрицы, отображенной в
+    память, и не требует копии данных в каждом воркере; остальные типы
+    строятся через FAISS. Бинарный индекс ищет кандидатов по расстоянию
+    Хэмминга и переранжирует их по исходным векторам.
+    """
+
+    def __init__(
+        self,
+        params: DenseIndexParams,
+        embeddings: np.ndarray,
+        index: faiss.Index | faiss.IndexBinary | None = None,
+        chunk_ids: np.ndarray | None = None,
+    ):
+        """Инициализация индекса."""
+        self.params = params
+        self.embeddings = embeddings
+        self.index = index
+        self.chunk_ids = chunk_ids
+        self.set_search_params(params)
+
+    @classmethod
+    def build(
+        cls, embeddings: np.ndarray, params: DenseIndexParams
+    ) -> "DenseIndex":
+        """Построение индекса по матрице эмбеддингов."""
+        n, dim = embeddings.shape
+        metric = faiss.METRIC_INNER_PRODUCT
+        nlist = params.ivf_nlist or max(1, int(4 * np.sqrt(n)))
+        match params.index_type:
+            case DenseIndexTypeChoice.FLAT:
+                return cls(params, embeddings)
+            case DenseIndexTypeChoice.HNSW:
+                index = faiss.IndexHNSWFlat(dim, params.hnsw_m, metric)
+                index.hnsw.efConstruction = params.hnsw_ef_construction
+            case DenseIndexTypeChoice.IVF_FLAT:
+                index = faiss.IndexIVFFlat(
+                    faiss.IndexFlatIP(dim), dim, nlist, metric
+                )
+            case DenseIndexTypeChoice.IVF_PQ:
+                index = faiss.IndexIVFPQ(
+                    faiss.IndexFlatIP(dim),
+                    dim,
+                    nlist,
+                    params.pq_m,
+                    params.pq_nbits,
+                    metric,
+                )
+            case DenseIndexTypeChoice.SQ8:
+                index = faiss.IndexScalarQuantizer(
+                    dim, faiss.ScalarQuantizer.QT_8bit, metric
+                )
+            case DenseIndexTypeChoice.BINARY:
+                index = faiss.IndexBinaryFlat(dim)
+                index.add(_binarize(embeddings))
+                return cls(params, embeddings, index)
+
+        if not index.is_trained:
+            index.train(_training_sample(embeddings, nlist))
+        for start in range(0, n, BUILD_BATCH_SIZE):
+            index.add(
+                np.ascontiguousarray(
+                    embeddings[start:start + BUILD_BATCH_SIZE],
+                    dtype=np.float32,
+                )
+            )
+        return cls(params, embeddings, index)
+
+    @classmethod
+    def load(
+        cls,
+        path: str | None,
+        embeddings: np.ndarray,
+        params: DenseIndexParams,
+        chunk_ids: np.ndarray | None = None,
+    ) -> "DenseIndex":
+        """Загрузка индекса, сохраненного ``save``."""
+        match params.index_type:
+            case DenseIndexTypeChoice.FLAT:
+                index = None
+            case DenseIndexTypeChoice.BINARY:
+                index = faiss.read_index_binary(path)
+            case _:
+                index = faiss.read_index(path)
+        return cls(params, embeddings, index, chunk_ids)
+
+    def save(self, path: str) -> None:
+        """Сохранение индекса в файл."""
+        match self.index:
+            case None:
+                return
+            case faiss.IndexBinary():
+                faiss.write_index_binary(self.index, path)
+            case _:
+                faiss.write_index(self.index, path)
+
+    def set_search_params(self, params: DenseIndexParams) -> None:
+        """Настройка параметров поиска без перестройки индекса."""
+        self.params = params
+        if isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = params.hnsw_ef_search
+        elif isinstance(self.index, faiss.Index):
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                ivf.nprobe = params.ivf_nprobe
+
+    def search(
+        self, queries: np.ndarray, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск k ближайших фрагментов для батча запросов.
+
+        Возвращает матрицы скоров и идентификаторов фрагментов, пустые
+        позиции заполнены идентификатором -1.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self.embeddings))
+        if self.index is None:
+            scores, rows = _exact_search(self.embeddings, queries, k)
+        elif isinstance(self.index, faiss.IndexBinary):
+            n_candidates = min(
+                k * self.params.binary_rerank_factor, len(self.embeddings)
+            )
+            _, candidates = self.index.search(_binarize(queries), n_candidates)
+            scores, rows = _rerank(self.embeddings, queries, candidates, k)
+        else:
+            scores, rows = self.index.search(queries, k)
+        if self.chunk_ids is None:
+            return scores, rows
+        return scores, np.where(
+            rows >= 0, self.chunk_ids[np.maximum(rows, 0)], -1
+        )
+
+    def memory_bytes(self) -> int:
+        """Размер структур индекса в памяти."""
+        if self.index is None:
+            return self.embeddings.nbytes
+        if isinstance(self.index, faiss.IndexBinary):
+            return faiss.serialize_index_binary(self.index).nbytes
+        return faiss.serialize_index(self.index).nbytes
+
+
+BUILD_BATCH_SIZE = 65_536
+TRAINING_POINTS_PER_CENTROID = 64
+
+
+def _training_sample(embeddings: np.ndarray, nlist: int) -> np.ndarray:
+    """Случайная выборка векторов для обучения квантизаторов."""
+    n_samples = min(
+        len(embeddings), max(nlist * TRAINING_POINTS_PER_CENTROID, 10_000)
+    )
+    rows = np.sort(
+        np.random.default_rng(0).choice(
+            len(embeddings), n_samples, replace=False
+        )
+    )
+    return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+
+
+def _binarize(embeddings: np.ndarray) -> np.ndarray:
+    """Упаковка знаков компонент векторов в биты."""
+    return np.packbits(np.asarray(embeddings) > 0, axis=1)
+
+
+def _exact_search(
+    embeddings: np.ndarray, queries: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Точный поиск по скалярному произведению."""
+    scores = queries @ embeddings.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return (
+        np.take_along_axis(top_scores, order, axis=1),
+        np.take_along_axis(top, order, axis=1),
+    )
+
+
+def _rerank(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Переранжирование кандидатов по исходным векторам."""
+    scores = np.einsum(
+        "qd,qcd->qc", queries, np.asarray(embeddings[candidates.ravel()])
+        .reshape(*candidates.shape, -1)
+    )
+    order = np.argsort(-scores, axis=1)[:, :k]
+    return (
+        np.take_along_axis(scores, order, axis=1),
+        np.take_along_axis(candidates, order, axis=1),
+    )
@@ -0,0 +1,230 @@
+"""Модуль векторизации запросов моделью эмбеддингов."""
+
+import asyncio
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import numpy as np
+
+ONNX_MODEL_FILE = "model.onnx"
+QUANTIZED_ONNX_MODEL_FILE = "model_quantized.onnx"
+
+
+class MiniLMEncoder:
+    """
+    Энкодер MiniLM на ONNX Runtime для CPU.
+
+    Использует быстрый токенизатор из ``tokenizer.json`` с паддингом до
+    самой длинной последовательности батча и экспорт модели из
+    ``chats.entrypoints.cli.export_embedding_model``.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        quantized: bool = False,
+        n_threads: int | None = None,
+    ):
+        """Загрузка токенизатора и ONNX модели."""
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(model_path, "tokenizer.json")
+        )
+        self.tokenizer.enable_padding(
+            pad_id=self.tokenizer.padding["pad_id"],
+            pad_token=self.tokenizer.padding["pad_token"],
+        )
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if n_threads:
+            options.intra_op_num_threads = n_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(
+                model_path,
+                QUANTIZED_ONNX_MODEL_FILE if quantized else ONNX_MODEL_FILE,
+            ),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {item.name for item in self.session.get_inputs()}
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Получение нормированных эмбеддингов для батча текстов."""
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array(
+            [encoding.attention_mask for encoding in encodings],
+            dtype=np.int64,
+        )
+        inputs = {
+            "input_ids": np.array(
+                [encoding.ids for encoding in encodings], dtype=np.int64
+            ),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array(
+                [encoding.type_ids for encoding in encodings], dtype=np.int64
+            ),
+        }
+        (hidden_state, *_) = self.session.run(
+            None,
+            {
+                name: value
+                for name, value in inputs.items()
+                if name in self._input_names
+            },
+        )
+        mask = attention_mask[:, :, None].astype(np.float32)
+        embeddings = (hidden_state * mask).sum(axis=1) / np.maximum(
+            mask.sum(axis=1), 1e-9
+        )
+        embeddings /= np.maximum(
+            np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+        )
+        return embeddings.astype(np.float32)
+
+
+class EmbeddingService:
+    """
+    Сервис векторизации запросов с динамическим батчингом.
+
+    Одновременные запросы накапливаются, пока энкодер занят предыдущим
+    батчем или не истечет ``max_wait_ms``, и векторизуются одним вызовом
+    модели в отдельном потоке. Недавние эмбеддинги хранятся в LRU-кэше.
+    """
+
+    def __init__(
+        self,
+        encoder: MiniLMEncoder,
+        max_batch_size: int,
+        max_wait_ms: float,
+        cache_size: int,
+    ):
+        """Инициализация сервиса."""
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: list[str] = []
+        self._futures: dict[str, asyncio.Future] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._started_at = time.perf_counter()
+        self._n_requests = 0
+        self._n_cache_hits = 0
+        self._n_batches = 0
+        self._n_encoded = 0
+        self._encode_time = 0.0
+        self._request_latencies: deque[float] = deque(maxlen=1_000)
+        self._batch_latencies: deque[float] = deque(maxlen=1_000)
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        """Получение эмбеддинга запроса."""
+        started_at = time.perf_counter()
+        self._n_requests += 1
+        embedding = self._cache.get(text)
+        if embedding is not None:
+            self._cache.move_to_end(text)
+            self._n_cache_hits += 1
+            self._request_latencies.append(time.perf_counter() - started_at)
+            return embedding
+
+        # Одинаковые запросы, уже ожидающие векторизации, получают общий
+        # результат; shield не дает отмене одного из них затронуть других.
+        future = self._futures.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[text] = loop.create_future()
+            self._pending.append(text)
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif not self._in_flight and self._flush_handle is None:
+                self._flush_handle = loop.call_later(
+                    self.max_wait, self._flush
+                )
+        embedding = await asyncio.shield(future)
+        self._request_latencies.append(time.perf_counter() - started_at)
+        return embedding
+
+    def _flush(self) -> None:
+        """Отправка накопленных запросов на векторизацию."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch = self._pending[: self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if batch:
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._encode(batch))
+
+    def _timed_encode(self, texts: list[str]) -> tuple[np.ndarray, float]:
+        """Векторизация батча с замером времени работы модели."""
+        started_at = time.perf_counter()
+        embeddings = self.encoder.encode(texts)
+        return embeddings, time.perf_counter() - started_at
+
+    async def _encode(self, texts: list[str]) -> None:
+        """Векторизация батча и передача результатов ожидающим."""
+        loop = asyncio.get_running_loop()
+        try:
+            embeddings, elapsed = await loop.run_in_executor(
+                self._executor, self._timed_encode, texts
+            )
+        except Exception as exc:
+            for text in texts:
+                future = self._futures.pop(text)
+                future.set_exception(exc)
+                # Исключение доставляется ожидающим через shield; если их
+                # не осталось, оно не должно попадать в лог как забытое.
+                future.exception()
+            return
+        finally:
+            self._in_flight -= 1
+            # Пока шел батч, могли накопиться новые запросы: они уходят
+            # следующим батчем сразу, без ожидания таймера.
+            if self._pending:
+                self._flush()
+
+        self._n_batches += 1
+        self._n_encoded += len(texts)
+        self._encode_time += elapsed
+        self._batch_latencies.append(elapsed)
+        for text, embedding in zip(texts, embeddings):
+            self._cache[text] = embedding
+            self._futures.pop(text).set_result(embedding)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """Статистика пропускной способности и задержек."""
+        return {
+            "requests": self._n_requests,
+            "cache_hits": self._n_cache_hits,
+            "cache_size": len(self._cache),
+            "batches": self._n_batches,
+            "avg_batch_size": self._n_encoded / max(self._n_batches, 1),
+            "encoded_texts": self._n_encoded,
+            "encode_throughput_per_s": (
+                self._n_encoded / self._encode_time
+                if self._encode_time
+                else 0.0
+            ),
+            "requests_per_s": self._n_requests
+            / (time.perf_counter() - self._started_at),
+            "request_latency_ms": _percentiles_ms(self._request_latencies),
+            "batch_latency_ms": _percentiles_ms(self._batch_latencies),
+        }
+
+
+def _percentiles_ms(latencies: deque[float]) -> dict[str, float]:
+    """Перцентили задержек в миллисекундах."""
+    if not latencies:
+        return {"p50": 0.0, "p99": 0.0}
+    p50, p99 = np.percentile(np.fromiter(latencies, float), [50, 99]) * 1000
+    return {"p50": round(float(p50), 3), "p99": round(float(p99), 3)}
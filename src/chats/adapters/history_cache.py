@@ -0,0 +1,79 @@
+"""Модуль кэша последних сообщений чатов."""
+
+from collections import deque, OrderedDict
+
+from base.utils import estimate_tokens
+from ..domain.models import HistoryTail, MessageData
+
+
+class _ChatTail:
+    """Последние сообщения чата с оценкой их размера в токенах."""
+
+    def __init__(self, user_id: int, n_skipped_tokens: int):
+        """Инициализация пустого хвоста."""
+        self.user_id = user_id
+        self.messages: deque[tuple[MessageData, int]] = deque()
+        self.n_skipped_tokens = n_skipped_tokens
+        self.n_tokens = 0
+
+
+class ChatHistoryTailCache:
+    """
+    LRU-кэш последних сообщений чатов в памяти процесса.
+
+    Хранит для каждого чата хвост истории по тому же правилу отсечения
+    блоками, что и выборка из БД, и дополняется при добавлении сообщений.
+    Кэш не видит сообщений, записанных другими процессами, поэтому
+    корректен только при одном воркере или при привязке чата к воркеру.
+    """
+
+    def __init__(self, max_chats: int, n_tokens: int, trim_step: int):
+        """Инициализация кэша."""
+        self.max_chats = max_chats
+        self.n_tokens = n_tokens
+        self.trim_step = trim_step
+        self._tails: OrderedDict[int, _ChatTail] = OrderedDict()
+
+    def get(self, chat_id: int, user_id: int) -> list[MessageData] | None:
+        """Получение хвоста истории чата, если он есть в кэше."""
+        tail = self._tails.get(chat_id)
+        if tail is None or tail.user_id != user_id:
+            return None
+        self._tails.move_to_end(chat_id)
+        return [message.model_copy() for message, _ in tail.messages]
+
+    def put(self, chat_id: int, user_id: int, history: HistoryTail) -> None:
+        """Сохранение хвоста истории, загруженного из БД."""
+        self._tails[chat_id] = tail = _ChatTail(
+            user_id, history.n_skipped_tokens
+        )
+        for message in history.messages:
+            self._push(tail, message)
+        while len(self._tails) > self.max_chats:
+            self._tails.popitem(last=False)
+
+    def append(self, chat_id: int, message: MessageData) -> None:
+        """Дополнение закэшированного хвоста новым сообщением."""
+        tail = self._tails.get(chat_id)
+        if tail is not None:
+            self._push(tail, message)
+
+    def invalidate(self, chat_id: int) -> None:
+        """Удаление чата из кэша."""
+        self._tails.pop(chat_id, None)
+
+    def _push(self, tail: _ChatTail, message: MessageData) -> None:
+        """Добавление сообщения и отсечение старых блоком trim_step."""
+        n_tokens = estimate_tokens(message.content)
+        tail.messages.append((message.model_copy(), n_tokens))
+        tail.n_tokens += n_tokens
+        total_tokens = tail.n_skipped_tokens + tail.n_tokens
+        if total_tokens <= self.n_tokens:
+            return
+        n_blocks = -(-(total_tokens - self.n_tokens) // self.trim_step)
+        while tail.messages and (
+            tail.n_skipped_tokens < n_blocks * self.trim_step
+        ):
+            _, oldest_tokens = tail.messages.popleft()
+            tail.n_skipped_tokens += oldest_tokens
+            tail.n_tokens -= oldest_tokens
@@ -0,0 +1,1305 @@
+"""Модуль построения поисковых индексов RAG-системы."""
+
+import abc
+import array
+import bisect
+from collections import Counter
+from collections.abc import Sequence
+import functools
+import importlib
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import shutil
+import threading
+from typing import Callable, Iterator, Literal
+
+from langchain_community.retrievers import BM25Retriever
+from langchain_core.documents import Document
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+DELTA_LOG_STATE_FILE = "state.pkl"
+MMAP_META_FILE = "meta.json"
+
+DeltaLogAction = Literal["add", "remove"]
+
+
+def preprocess_text(text: str) -> list[str]:
+    """
+    Токенизация текста для BM25.
+
+    Функция сохраняется в pickle вместе с ретривером, поэтому должна
+    оставаться импортируемой из этого модуля.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_bm25_retriever(
+    documents: list[Document],
+    term_frequencies: list[dict[str, int]],
+    k: int,
+) -> BM25Retriever:
+    """
+    Сборка BM25Retriever по заранее посчитанным частотам термов.
+
+    Подсчет частот выполняется в пуле процессов при загрузке корпуса,
+    здесь остается только агрегация документной частоты и расчет IDF.
+    """
+    vectorizer = BM25Okapi.__new__(BM25Okapi)
+    vectorizer.k1 = 1.5
+    vectorizer.b = 0.75
+    vectorizer.epsilon = 0.25
+    vectorizer.tokenizer = None
+    vectorizer.idf = {}
+    vectorizer.doc_freqs = [dict(freqs) for freqs in term_frequencies]
+    vectorizer.doc_len = [sum(freqs.values()) for freqs in term_frequencies]
+    vectorizer.corpus_size = len(term_frequencies)
+    vectorizer.avgdl = sum(vectorizer.doc_len) / max(vectorizer.corpus_size, 1)
+
+    document_frequencies = Counter()
+    for freqs in term_frequencies:
+        document_frequencies.update(freqs.keys())
+    vectorizer._calc_idf(document_frequencies)
+
+    return BM25Retriever(
+        vectorizer=vectorizer,
+        docs=documents,
+        k=k,
+        preprocess_func=preprocess_text,
+    )
+
+
+class AbstractBM25Segment(abc.ABC):
+    """
+    Неизменяемый сегмент BM25 индекса.
+
+    Постинги хранятся в CSR-виде: для терма ``t`` позиции документов
+    лежат в ``positions[indptr[t]:indptr[t + 1]]``, частоты -- в ``tfs``.
+    """
+
+    chunk_ids: np.ndarray
+    doc_len: np.ndarray
+    indptr: np.ndarray
+    positions: np.ndarray
+    tfs: np.ndarray
+    total_length: float
+    # Номер последней записи журнала изменений, вошедшей в сегмент.
+    delta_seq: int | None = None
+
+    @property
+    def n_docs(self) -> int:
+        """Число документов в сегменте."""
+        return len(self.doc_len)
+
+    @abc.abstractmethod
+    def term_id(self, term: str) -> int | None:
+        """Получение номера терма в словаре сегмента."""
+
+    @abc.abstractmethod
+    def terms(self) -> Iterator[str]:
+        """Обход словаря сегмента в порядке номеров термов."""
+
+    @abc.abstractmethod
+    def document(self, position: int) -> Document:
+        """Получение документа по позиции в сегменте."""
+
+    @abc.abstractmethod
+    def find_chunks(self, chunk_ids: list[int]) -> list[int]:
+        """Поиск позиций фрагментов по их идентификаторам."""
+
+    @abc.abstractmethod
+    def find_sources(self, sources: list[str]) -> list[int]:
+        """Поиск позиций всех фрагментов исходных документов."""
+
+    def documents(self) -> Iterator[Document]:
+        """Обход документов сегмента."""
+        for position in range(self.n_docs):
+            yield self.document(position)
+
+    def documents_by_chunk_ids(self, chunk_ids: list[int]) -> list[Document]:
+        """Получение документов по идентификаторам фрагментов."""
+        return [
+            self.document(position) for position in self.find_chunks(chunk_ids)
+        ]
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """Получение позиций документов и частот терма."""
+        term_id = self.term_id(term)
+        if term_id is None:
+            return None
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.positions[start:end], self.tfs[start:end]
+
+    def term_frequencies(self) -> list[dict[str, int]]:
+        """Восстановление частот термов документов из постингов."""
+        return list(self.iter_term_frequencies())
+
+    def iter_term_frequencies(self) -> Iterator[dict[str, int]]:
+        """
+        Обход частот термов документов в порядке позиций.
+
+        Постинги переставляются по позициям документов массивами numpy,
+        поэтому словари частот создаются по одному на документ.
+        """
+        terms = list(self.terms())
+        term_ids = np.repeat(
+            np.arange(len(terms), dtype=np.int64), np.diff(self.indptr)
+        )
+        order = np.argsort(self.positions, kind="stable")
+        bounds = np.searchsorted(
+            self.positions[order], np.arange(self.n_docs + 1)
+        )
+        term_ids = term_ids[order]
+        tfs = np.asarray(self.tfs)[order]
+        del order
+        for position in range(self.n_docs):
+            start, end = bounds[position], bounds[position + 1]
+            yield {
+                terms[term_id]: int(tf)
+                for term_id, tf in zip(
+                    term_ids[start:end].tolist(), tfs[start:end].tolist()
+                )
+            }
+
+
+class BM25Segment(AbstractBM25Segment):
+    """Сегмент BM25 индекса в памяти процесса."""
+
+    def __init__(
+        self,
+        documents: list[Document],
+        term_frequencies: list[dict[str, int]],
+        chunk_ids: list[int],
+    ):
+        """Построение сегмента по частотам термов документов."""
+        self._documents = documents
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self.doc_len = np.array(
+            [sum(freqs.values()) for freqs in term_frequencies],
+            dtype=np.float32,
+        )
+        self.total_length = float(self.doc_len.sum())
+        self.vocabulary: dict[str, int] = {}
+        term_ids, positions, tfs = [], [], []
+        for position, freqs in enumerate(term_frequencies):
+            for term, tf in freqs.items():
+                term_ids.append(
+                    self.vocabulary.setdefault(term, len(self.vocabulary))
+                )
+                positions.append(position)
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        self.positions = np.asarray(positions, dtype=np.int32)[order]
+        self.tfs = np.asarray(tfs, dtype=np.float32)[order]
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(term_ids, minlength=len(self.vocabulary)),
+            out=self.indptr[1:],
+        )
+        self.position_by_chunk_id = {
+            chunk_id: position for position, chunk_id in enumerate(chunk_ids)
+        }
+        self.positions_by_source: dict[str, list[int]] = {}
+        for position, document in enumerate(documents):
+            self.positions_by_source.setdefault(
+                document.metadata.get("source"), []
+            ).append(position)
+
+    @classmethod
+    def from_retriever(cls, retriever: BM25Retriever) -> "BM25Segment":
+        """Построение сегмента из загруженного BM25Retriever."""
+        return cls(
+            documents=retriever.docs,
+            term_frequencies=retriever.vectorizer.doc_freqs,
+            chunk_ids=[
+                document.metadata.get("chunk_id", position)
+                for position, document in enumerate(retriever.docs)
+            ],
+        )
+
+    def term_id(self, term: str) -> int | None:
+        """Получение номера терма в словаре сегмента."""
+        return self.vocabulary.get(term)
+
+    def terms(self) -> Iterator[str]:
+        """Обход словаря сегмента в порядке номеров термов."""
+        return iter(self.vocabulary)
+
+    def document(self, position: int) -> Document:
+        """Получение документа по позиции в сегменте."""
+        return self._documents[position]
+
+    def find_chunks(self, chunk_ids: list[int]) -> list[int]:
+        """Поиск позиций фрагментов по их идентификаторам."""
+        return [
+            self.position_by_chunk_id[chunk_id]
+            for chunk_id in chunk_ids
+            if chunk_id in self.position_by_chunk_id
+        ]
+
+    def find_sources(self, sources: list[str]) -> list[int]:
+        """Поиск позиций всех фрагментов исходных документов."""
+        return [
+            position
+            for source in sources
+            for position in self.positions_by_source.get(source, [])
+        ]
+
+
+class _BlobSequence(Sequence):
+    """Последовательность строк, закодированных в одном байтовом блоке."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        """Инициализация последовательности."""
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        """Число строк."""
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        """Декодирование строки по номеру."""
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+
+class MmapBM25Segment(AbstractBM25Segment):
+    """
+    Сегмент BM25 индекса, отображенный в память из файлов.
+
+    Все массивы открываются только на чтение через mmap, поэтому воркеры
+    uvicorn разделяют одну копию данных в страничном кэше ОС. Словарь
+    хранится отсортированным блоком строк, термы ищутся бинарным поиском.
+    """
+
+    def __init__(self, directory: str):
+        """Открытие сегмента, сохраненного ``save_bm25_segment``."""
+        self.directory = directory
+        with open(os.path.join(directory, MMAP_META_FILE)) as f:
+            self.meta = json.load(f)
+        self.chunk_ids = self._load_array("chunk_ids")
+        self.doc_len = self._load_array("doc_len")
+        self.indptr = self._load_array("indptr")
+        self.positions = self._load_array("positions")
+        self.tfs = self._load_array("tfs")
+        self.total_length = self.meta["total_length"]
+        self.delta_seq = self.meta.get("delta_seq")
+        self._chunk_order = self._load_array("chunk_order")
+        self._terms = _BlobSequence(
+            self._load_blob("terms"), self._load_array("terms_offsets")
+        )
+        self._texts = _BlobSequence(
+            self._load_blob("texts"), self._load_array("texts_offsets")
+        )
+        self._metadatas = _BlobSequence(
+            self._load_blob("metadatas"), self._load_array("metadatas_offsets")
+        )
+
+    def _load_array(self, name: str) -> np.ndarray:
+        """Отображение массива numpy в память."""
+        return np.load(
+            os.path.join(self.directory, f"{name}.npy"), mmap_mode="r"
+        )
+
+    def _load_blob(self, name: str) -> np.ndarray:
+        """Отображение байтового блока в память."""
+        path = os.path.join(self.directory, f"{name}.bin")
+        if not os.path.getsize(path):
+            return np.empty(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    @property
+    def preprocess_func(self) -> Callable[[str], list[str]]:
+        """Функция токенизации, с которой построен сегмент."""
+        module_name, name = self.meta["preprocess_func"].split(":")
+        return getattr(importlib.import_module(module_name), name)
+
+    def term_id(self, term: str) -> int | None:
+        """Получение номера терма в словаре сегмента."""
+        term_id = bisect.bisect_left(self._terms, term)
+        if term_id < len(self._terms) and self._terms[term_id] == term:
+            return term_id
+        return None
+
+    def terms(self) -> Iterator[str]:
+        """Обход словаря сегмента в порядке номеров термов."""
+        return iter(self._terms)
+
+    def document(self, position: int) -> Document:
+        """Получение документа по позиции в сегменте."""
+        chunk_id = int(self.chunk_ids[position])
+        return Document(
+            id=str(chunk_id),
+            page_content=self._texts[position],
+            metadata=json.loads(self._metadatas[position]),
+        )
+
+    def find_chunks(self, chunk_ids: list[int]) -> list[int]:
+        """Поиск позиций фрагментов по их идентификаторам."""
+        sorted_ids = self.chunk_ids[self._chunk_order]
+        found = np.searchsorted(sorted_ids, chunk_ids)
+        return [
+            int(self._chunk_order[index])
+            for chunk_id, index in zip(chunk_ids, found)
+            if index < len(sorted_ids) and sorted_ids[index] == chunk_id
+        ]
+
+    def find_sources(self, sources: list[str]) -> list[int]:
+        """
+        Поиск позиций всех фрагментов исходных документов.
+
+        Требует просмотра метаданных всего сегмента, но вызывается только
+        при удалении документов из фонового потока обслуживания.
+        """
+        sources = set(sources)
+        return [
+            position
+            for position in range(self.n_docs)
+            if json.loads(self._metadatas[position]).get("source") in sources
+        ]
+
+
+def _write_blob(
+    directory: str, name: str, values: Iterator[str]
+) -> None:
+    """Запись строк в байтовый блок со смещениями."""
+    offsets = [0]
+    with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+        for value in values:
+            offsets.append(offsets[-1] + f.write(value.encode("utf-8")))
+    np.save(
+        os.path.join(directory, f"{name}_offsets.npy"),
+        np.asarray(offsets, dtype=np.int64),
+    )
+
+
+def save_bm25_segment(
+    segment: AbstractBM25Segment,
+    directory: str,
+    preprocess_func: Callable[[str], list[str]],
+) -> None:
+    """
+    Сохранение сегмента в каталог для отображения в память.
+
+    Каталог заменяется целиком: процессы, открывшие предыдущую версию,
+    продолжают читать ее до перезагрузки индекса.
+    """
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    terms = list(segment.terms())
+    order = sorted(range(len(terms)), key=terms.__getitem__)
+    lengths = np.diff(segment.indptr)[order]
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    slices = [
+        slice(segment.indptr[term_id], segment.indptr[term_id + 1])
+        for term_id in order
+    ]
+    arrays = {
+        "chunk_ids": np.asarray(segment.chunk_ids, dtype=np.int64),
+        "chunk_order": np.argsort(segment.chunk_ids, kind="stable"),
+        "doc_len": np.asarray(segment.doc_len, dtype=np.float32),
+        "indptr": indptr,
+        "positions": np.concatenate(
+            [segment.positions[s] for s in slices] or [np.empty(0, np.int32)]
+        ).astype(np.int32),
+        "tfs": np.concatenate(
+            [segment.tfs[s] for s in slices] or [np.empty(0, np.float32)]
+        ).astype(np.float32),
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_directory, f"{name}.npy"), values)
+    _write_blob(tmp_directory, "terms", (terms[i] for i in order))
+    documents = list(segment.documents())
+    _write_blob(
+        tmp_directory,
+        "texts",
+        (document.page_content for document in documents),
+    )
+    _write_blob(
+        tmp_directory,
+        "metadatas",
+        (
+            json.dumps(document.metadata, ensure_ascii=False)
+            for document in documents
+        ),
+    )
+    _write_segment_meta(
+        tmp_directory,
+        segment.n_docs,
+        len(terms),
+        segment.total_length,
+        preprocess_func,
+    )
+    _publish_directory(tmp_directory, directory)
+
+
+def _write_segment_meta(
+    directory: str,
+    n_docs: int,
+    n_terms: int,
+    total_length: float,
+    preprocess_func: Callable[[str], list[str]],
+    delta_seq: int | None = None,
+) -> None:
+    """Запись метаданных сегмента для отображения в память."""
+    with open(os.path.join(directory, MMAP_META_FILE), "w") as f:
+        json.dump(
+            {
+                "n_docs": n_docs,
+                "n_terms": n_terms,
+                "total_length": total_length,
+                "preprocess_func": (
+                    f"{preprocess_func.__module__}:"
+                    f"{preprocess_func.__qualname__}"
+                ),
+                "delta_seq": delta_seq,
+            },
+            f,
+        )
+
+
+def _publish_directory(tmp_directory: str, directory: str) -> None:
+    """Замена каталога сегмента полностью записанной версией."""
+    old_directory = f"{directory}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+class BM25SegmentWriter:
+    """
+    Потоковая запись сегмента BM25 в каталог для отображения в память.
+
+    Тексты и метаданные документов дописываются в файлы по мере
+    поступления, а в памяти остаются только словарь термов и постинги
+    в типизированных массивах по 16 байт на пару терм-документ. Формат
+    каталога совпадает с ``save_bm25_segment``, каталог заменяется при
+    ``close``. delta_seq - номер последней записи журнала изменений,
+    вошедшей в сегмент.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        preprocess_func: Callable[[str], list[str]],
+        delta_seq: int | None = None,
+    ):
+        """Создание временного каталога сегмента."""
+        self.directory = directory
+        self.preprocess_func = preprocess_func
+        self.delta_seq = delta_seq
+        self._tmp_directory = f"{directory}.tmp"
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+        os.makedirs(self._tmp_directory)
+        self._texts = open(
+            os.path.join(self._tmp_directory, "texts.bin"), "wb"
+        )
+        self._metadatas = open(
+            os.path.join(self._tmp_directory, "metadatas.bin"), "wb"
+        )
+        self._text_offsets = array.array("q", [0])
+        self._metadata_offsets = array.array("q", [0])
+        self._chunk_ids = array.array("q")
+        self._doc_len = array.array("f")
+        self._term_ids = array.array("q")
+        self._positions = array.array("i")
+        self._tfs = array.array("f")
+        self.vocabulary: dict[str, int] = {}
+        self.total_length = 0.0
+
+    @property
+    def n_docs(self) -> int:
+        """Число записанных документов."""
+        return len(self._chunk_ids)
+
+    def add(
+        self,
+        document: Document,
+        term_frequencies: dict[str, int],
+        chunk_id: int,
+    ) -> None:
+        """Дозапись документа и его частот термов."""
+        position = self.n_docs
+        self._text_offsets.append(
+            self._text_offsets[-1]
+            + self._texts.write(document.page_content.encode("utf-8"))
+        )
+        self._metadata_offsets.append(
+            self._metadata_offsets[-1]
+            + self._metadatas.write(
+                json.dumps(document.metadata, ensure_ascii=False).encode(
+                    "utf-8"
+                )
+            )
+        )
+        self._chunk_ids.append(chunk_id)
+        length = sum(term_frequencies.values())
+        self._doc_len.append(length)
+        self.total_length += length
+        for term, tf in term_frequencies.items():
+            self._term_ids.append(
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+            )
+            self._positions.append(position)
+            self._tfs.append(tf)
+
+    def close(self) -> None:
+        """Запись постингов в порядке словаря и замена каталога."""
+        self._texts.close()
+        self._metadatas.close()
+        terms = list(self.vocabulary)
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        ranks = np.empty(len(terms), dtype=np.int64)
+        ranks[order] = np.arange(len(terms))
+        term_ranks = ranks[np.frombuffer(self._term_ids, dtype=np.int64)]
+        del self._term_ids
+        postings_order = np.argsort(term_ranks, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(term_ranks, minlength=len(terms)), out=indptr[1:]
+        )
+        del term_ranks
+        chunk_ids = np.frombuffer(self._chunk_ids, dtype=np.int64)
+        arrays = {
+            "chunk_ids": chunk_ids,
+            "chunk_order": np.argsort(chunk_ids, kind="stable"),
+            "doc_len": np.frombuffer(self._doc_len, dtype=np.float32),
+            "indptr": indptr,
+            "positions": np.frombuffer(self._positions, dtype=np.int32)[
+                postings_order
+            ],
+            "tfs": np.frombuffer(self._tfs, dtype=np.float32)[
+                postings_order
+            ],
+            "texts_offsets": np.frombuffer(self._text_offsets, np.int64),
+            "metadatas_offsets": np.frombuffer(
+                self._metadata_offsets, np.int64
+            ),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(self._tmp_directory, f"{name}.npy"), values)
+        _write_blob(self._tmp_directory, "terms", (terms[i] for i in order))
+        _write_segment_meta(
+            self._tmp_directory,
+            self.n_docs,
+            len(terms),
+            self.total_length,
+            self.preprocess_func,
+            self.delta_seq,
+        )
+        _publish_directory(self._tmp_directory, self.directory)
+
+
+def query_term_matrix(
+    queries_terms: list[list[str]],
+) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Разреженная матрица запрос-терм пакета запросов в формате COO.
+
+    Возвращаются словарь термов пакета и строки, столбцы и частоты
+    ненулевых элементов.
+    """
+    vocabulary: dict[str, int] = {}
+    rows, columns, query_tfs = [], [], []
+    for row, terms in enumerate(queries_terms):
+        for term, query_tf in Counter(terms).items():
+            rows.append(row)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
+            query_tfs.append(query_tf)
+    return (
+        list(vocabulary),
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(columns, dtype=np.int64),
+        np.asarray(query_tfs, dtype=np.float32),
+    )
+
+
+def split_columns(columns: np.ndarray, n_terms: int) -> list[np.ndarray]:
+    """Номера элементов матрицы COO, сгруппированные по столбцам."""
+    order = np.argsort(columns, kind="stable")
+    counts = np.bincount(columns, minlength=n_terms)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def score_query_batch(
+    n_queries: int,
+    n_docs: int,
+    term_postings: list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+    k: int,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Топ-k документов сегмента для каждого запроса пакета.
+
+    Элемент term_postings описывает один терм: строки запросов с ним и
+    его частоты в них (столбец матрицы запрос-терм), позиции документов
+    и их веса BM25, посчитанные один раз на пакет. Скоры запроса
+    накапливаются в одном переиспользуемом векторе, в котором затем
+    обнуляются только затронутые позиции. Для запроса возвращаются
+    позиции и скоры документов с ненулевым скором по убыванию скора.
+    """
+    query_postings = [[] for _ in range(n_queries)]
+    for rows, query_tfs, positions, weights in term_postings:
+        for row, query_tf in zip(rows.tolist(), query_tfs.tolist()):
+            query_postings[row].append((query_tf, positions, weights))
+
+    scores = np.zeros(n_docs, dtype=np.float32)
+    results = []
+    for postings in query_postings:
+        for query_tf, positions, weights in postings:
+            scores[positions] += query_tf * weights
+        touched = np.flatnonzero(scores)
+        top = touched
+        if len(top) > k:
+            top = top[np.argpartition(-scores[top], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        results.append((top, scores[top]))
+        scores[touched] = 0
+    return results
+
+
+class BM25IndexSnapshot:
+    """
+    Согласованное состояние сегментированного BM25 индекса.
+
+    Снимок не изменяется после создания: обновления индекса создают новый
+    снимок, разделяющий с предыдущим все нетронутые сегменты.
+
+    Скоры совпадают с BM25Okapi, по которому строится pickle
+    BM25Retriever: отрицательный IDF частых термов заменяется на
+    epsilon от среднего IDF словаря живых документов.
+    """
+
+    def __init__(
+        self,
+        segments: tuple[AbstractBM25Segment, ...],
+        tombstones: dict[AbstractBM25Segment, np.ndarray],
+        next_chunk_id: int,
+        version: int,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ):
+        """Инициализация снимка."""
+        self.segments = segments
+        self.tombstones = tombstones
+        self.next_chunk_id = next_chunk_id
+        self.version = version
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.n_docs = sum(segment.n_docs for segment in segments) - sum(
+            len(positions) for positions in tombstones.values()
+        )
+        total_length = sum(segment.total_length for segment in segments) - sum(
+            float(segment.doc_len[positions].sum())
+            for segment, positions in tombstones.items()
+        )
+        self.avgdl = total_length / max(self.n_docs, 1)
+
+    def _live_document_frequencies(
+        self, segment: AbstractBM25Segment
+    ) -> np.ndarray:
+        """Документная частота термов сегмента без удаленных документов."""
+        df = np.diff(segment.indptr)
+        dead = self.tombstones.get(segment)
+        if dead is None or not len(dead):
+            return df
+        term_ids = np.repeat(np.arange(len(df)), df)
+        return df - np.bincount(
+            term_ids[np.isin(segment.positions, dead)], minlength=len(df)
+        )
+
+    @functools.cached_property
+    def average_idf(self) -> float:
+        """
+        Средний IDF словаря живых документов, как в BM25Okapi.
+
+        Считается один раз на снимок при первом поиске частого терма.
+        Частоты базового сегмента суммируются массивом, термы остальных
+        сегментов сопоставляются с ним поиском по словарю, поэтому
+        стоимость растет с размером дельта-сегментов, а не базы.
+        """
+        base, *others = self.segments
+        df = self._live_document_frequencies(base).astype(np.float64)
+        extra: dict[str, int] = {}
+        for segment in others:
+            segment_df = self._live_document_frequencies(segment)
+            for term, term_df in zip(segment.terms(), segment_df.tolist()):
+                if not term_df:
+                    continue
+                term_id = base.term_id(term)
+                if term_id is None:
+                    extra[term] = extra.get(term, 0) + term_df
+                else:
+                    df[term_id] += term_df
+        df = np.concatenate(
+            [df[df > 0], np.fromiter(extra.values(), np.float64, len(extra))]
+        )
+        if not len(df):
+            return 0.0
+        idfs = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5)
+        return float(idfs.mean())
+
+    def idf(self, df: int) -> float:
+        """IDF терма с документной частотой df."""
+        idf = math.log(self.n_docs - df + 0.5) - math.log(df + 0.5)
+        if idf < 0:
+            return self.epsilon * self.average_idf
+        return idf
+
+    def _live_postings(
+        self, term: str
+    ) -> list[tuple[AbstractBM25Segment, np.ndarray, np.ndarray]]:
+        """Постинги терма по всем сегментам без удаленных документов."""
+        result = []
+        for segment in self.segments:
+            postings = segment.postings(term)
+            if postings is None:
+                continue
+            positions, tfs = postings
+            dead = self.tombstones.get(segment)
+            if dead is not None:
+                alive = ~np.isin(positions, dead, assume_unique=True)
+                positions, tfs = positions[alive], tfs[alive]
+            if len(positions):
+                result.append((segment, positions, tfs))
+        return result
+
+    def search(
+        self, query_terms: list[str], k: int
+    ) -> list[tuple[float, Document]]:
+        """
+        Поиск k наиболее релевантных документов.
+
+        IDF считается на лету только для термов запроса, поэтому
+        добавление и удаление документов не требует пересчета всего
+        словаря; средний IDF нужен только для термов, встречающихся
+        больше чем в половине документов.
+        """
+        scores = {segment: None for segment in self.segments}
+        for term, query_tf in Counter(query_terms).items():
+            postings = self._live_postings(term)
+            df = sum(len(positions) for _, positions, _ in postings)
+            if not df:
+                continue
+            idf = self.idf(df)
+            for segment, positions, tfs in postings:
+                doc_len = segment.doc_len[positions]
+                norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+                if scores[segment] is None:
+                    scores[segment] = np.zeros(segment.n_docs, np.float32)
+                scores[segment][positions] += (
+                    query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm)
+                )
+
+        candidates = []
+        for segment, segment_scores in scores.items():
+            if segment_scores is None:
+                continue
+            top = np.flatnonzero(segment_scores)
+            if len(top) > k:
+                top = top[np.argpartition(-segment_scores[top], k - 1)[:k]]
+            candidates.extend(
+                (float(segment_scores[position]), segment, int(position))
+                for position in top
+            )
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return [
+            (score, segment.document(position))
+            for score, segment, position in candidates[:k]
+        ]
+
+    def search_batch(
+        self, queries_terms: list[list[str]], k: int
+    ) -> list[list[tuple[float, Document]]]:
+        """
+        Поиск k наиболее релевантных документов для пакета запросов.
+
+        Постинги и веса BM25 каждого терма считаются один раз для всего
+        пакета, а не для каждого содержащего его запроса.
+        """
+        terms, rows, columns, query_tfs = query_term_matrix(queries_terms)
+        term_postings = {segment: [] for segment in self.segments}
+        for term, entries in zip(terms, split_columns(columns, len(terms))):
+            postings = self._live_postings(term)
+            df = sum(len(positions) for _, positions, _ in postings)
+            if not df:
+                continue
+            idf = self.idf(df)
+            for segment, positions, tfs in postings:
+                doc_len = segment.doc_len[positions]
+                norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+                term_postings[segment].append(
+                    (
+                        rows[entries],
+                        query_tfs[entries],
+                        positions,
+                        idf * tfs * (self.k1 + 1) / (tfs + norm),
+                    )
+                )
+
+        candidates = [[] for _ in queries_terms]
+        for segment, segment_postings in term_postings.items():
+            if not segment_postings:
+                continue
+            top = score_query_batch(
+                len(queries_terms), segment.n_docs, segment_postings, k
+            )
+            for query_candidates, (positions, scores) in zip(candidates, top):
+                query_candidates.extend(
+                    (float(score), segment, int(position))
+                    for position, score in zip(positions, scores)
+                )
+        results = []
+        for query_candidates in candidates:
+            query_candidates.sort(key=lambda candidate: -candidate[0])
+            results.append(
+                [
+                    (score, segment.document(position))
+                    for score, segment, position in query_candidates[:k]
+                ]
+            )
+        return results
+
+
+class SegmentedBM25Index:
+    """
+    BM25 индекс с инкрементальным добавлением и удалением документов.
+
+    Новые документы попадают в отдельный дельта-сегмент, удаленные
+    помечаются надгробиями, поэтому стоимость обновления зависит только
+    от размера изменения. Дельта-сегменты периодически сливаются фоновым
+    уплотнением, а базовый сегмент заменяется только целиком. Читатели
+    работают с неизменяемым снимком и не видят частично примененных
+    обновлений.
+    """
+
+    def __init__(
+        self,
+        base: AbstractBM25Segment,
+        preprocess_func: Callable[[str], list[str]] = preprocess_text,
+    ):
+        """Инициализация индекса базовым сегментом."""
+        self.preprocess_func = preprocess_func
+        self._lock = threading.Lock()
+        self._snapshot = BM25IndexSnapshot(
+            segments=(base,),
+            tombstones={},
+            next_chunk_id=int(base.chunk_ids.max(initial=-1)) + 1,
+            version=0,
+        )
+
+    @classmethod
+    def from_retriever(cls, retriever: BM25Retriever) -> "SegmentedBM25Index":
+        """Построение индекса из загруженного BM25Retriever."""
+        return cls(
+            BM25Segment.from_retriever(retriever),
+            preprocess_func=retriever.preprocess_func,
+        )
+
+    @classmethod
+    def from_directory(cls, directory: str) -> "SegmentedBM25Index":
+        """Построение индекса над сегментом, отображенным в память."""
+        segment = MmapBM25Segment(directory)
+        return cls(segment, preprocess_func=segment.preprocess_func)
+
+    def save(self, directory: str, delta_seq: int | None = None) -> None:
+        """
+        Сохранение живых документов всех сегментов одним сегментом.
+
+        Документы и их частоты термов по одному передаются в
+        ``BM25SegmentWriter``, поэтому копия корпуса в памяти не
+        собирается. Каталог публикуется целиком, и вместе с ним номер
+        delta_seq последней вошедшей в него записи журнала.
+        """
+        snapshot = self._snapshot
+        writer = BM25SegmentWriter(directory, self.preprocess_func, delta_seq)
+        for segment in snapshot.segments:
+            dead = snapshot.tombstones.get(segment)
+            alive = np.ones(segment.n_docs, dtype=bool)
+            if dead is not None:
+                alive[dead] = False
+            for position, term_frequencies in enumerate(
+                segment.iter_term_frequencies()
+            ):
+                if alive[position]:
+                    writer.add(
+                        segment.document(position),
+                        term_frequencies,
+                        int(segment.chunk_ids[position]),
+                    )
+        writer.close()
+
+    @property
+    def snapshot(self) -> BM25IndexSnapshot:
+        """Текущий согласованный снимок индекса."""
+        return self._snapshot
+
+    def search(self, query: str, k: int) -> list[Document]:
+        """Поиск k наиболее релевантных документов."""
+        return [document for _, document in self.search_with_scores(query, k)]
+
+    def search_with_scores(
+        self, query: str, k: int
+    ) -> list[tuple[float, Document]]:
+        """Поиск k наиболее релевантных документов с их скорами."""
+        return self._snapshot.search(self.preprocess_func(query), k)
+
+    def search_batch_with_scores(
+        self, queries: list[str], k: int
+    ) -> list[list[tuple[float, Document]]]:
+        """Поиск k наиболее релевантных документов для пакета запросов."""
+        return self._snapshot.search_batch(
+            [self.preprocess_func(query) for query in queries], k
+        )
+
+    def add_documents(self, documents: list[Document]) -> list[int]:
+        """Добавление документов отдельным дельта-сегментом."""
+        if not documents:
+            return []
+        term_frequencies = [
+            Counter(self.preprocess_func(document.page_content))
+            for document in documents
+        ]
+        with self._lock:
+            snapshot = self._snapshot
+            chunk_ids = list(
+                range(
+                    snapshot.next_chunk_id,
+                    snapshot.next_chunk_id + len(documents),
+                )
+            )
+            documents = [
+                Document(
+                    id=str(chunk_id),
+                    page_content=document.page_content,
+                    metadata={**document.metadata, "chunk_id": chunk_id},
+                )
+                for chunk_id, document in zip(chunk_ids, documents)
+            ]
+            segment = BM25Segment(documents, term_frequencies, chunk_ids)
+            self._snapshot = BM25IndexSnapshot(
+                segments=(*snapshot.segments, segment),
+                tombstones=snapshot.tombstones,
+                next_chunk_id=chunk_ids[-1] + 1,
+                version=snapshot.version + 1,
+            )
+        return chunk_ids
+
+    def _remove(
+        self, find_positions: Callable[[AbstractBM25Segment], list[int]]
+    ) -> int:
+        """Пометка документов удаленными в каждом сегменте."""
+        with self._lock:
+            snapshot = self._snapshot
+            tombstones = dict(snapshot.tombstones)
+            n_removed = 0
+            for segment in snapshot.segments:
+                positions = find_positions(segment)
+                if not positions:
+                    continue
+                dead = tombstones.get(segment, np.empty(0, np.int32))
+                merged = np.union1d(dead, np.asarray(positions, np.int32))
+                n_removed += len(merged) - len(dead)
+                tombstones[segment] = merged
+            if n_removed:
+                self._snapshot = BM25IndexSnapshot(
+                    segments=snapshot.segments,
+                    tombstones=tombstones,
+                    next_chunk_id=snapshot.next_chunk_id,
+                    version=snapshot.version + 1,
+                )
+        return n_removed
+
+    def remove_chunks(self, chunk_ids: list[int]) -> int:
+        """Удаление фрагментов по идентификаторам."""
+        return self._remove(
+            lambda segment: segment.find_chunks(chunk_ids)
+        )
+
+    def remove_sources(self, sources: list[str]) -> int:
+        """Удаление всех фрагментов исходных документов."""
+        return self._remove(
+            lambda segment: segment.find_sources(sources)
+        )
+
+    def needs_compaction(
+        self, max_segments: int, max_tombstone_ratio: float
+    ) -> bool:
+        """
+        Проверка, пора ли сливать дельта-сегменты.
+
+        Учитываются только дельта-сегменты и их надгробия: удаленные
+        документы базового сегмента вычищает команда update_index
+        compact.
+        """
+        snapshot = self._snapshot
+        deltas = snapshot.segments[1:]
+        n_dead = sum(
+            len(snapshot.tombstones.get(segment, ())) for segment in deltas
+        )
+        n_delta_docs = sum(segment.n_docs for segment in deltas)
+        return len(deltas) > max_segments or (
+            n_dead > max_tombstone_ratio * max(n_delta_docs, 1)
+        )
+
+    def compact(self) -> None:
+        """
+        Слияние дельта-сегментов в один без удаленных документов.
+
+        Базовый сегмент не пересобирается: стоимость слияния растет с
+        размером изменений, а не корпуса, и база, отображенная в память,
+        остается общей для всех воркеров. Базу с изменениями сливает
+        команда update_index compact, публикующая новый каталог.
+
+        Слияние идет без блокировки; обновления, пришедшие за это время,
+        переносятся поверх результата при публикации нового снимка.
+        """
+        snapshot = self._snapshot
+        deltas = snapshot.segments[1:]
+        if not deltas:
+            return
+        documents, term_frequencies, chunk_ids = [], [], []
+        for segment in deltas:
+            dead = set(snapshot.tombstones.get(segment, ()))
+            frequencies = segment.term_frequencies()
+            for position, document in enumerate(segment.documents()):
+                if position in dead:
+                    continue
+                documents.append(document)
+                term_frequencies.append(frequencies[position])
+                chunk_ids.append(int(segment.chunk_ids[position]))
+        merged = BM25Segment(documents, term_frequencies, chunk_ids)
+
+        with self._lock:
+            current = self._snapshot
+            compacted = set(deltas)
+            tombstones = {}
+            late_dead = []
+            for segment, dead in current.tombstones.items():
+                if segment not in compacted:
+                    tombstones[segment] = dead
+                    continue
+                already_dead = snapshot.tombstones.get(segment)
+                if already_dead is not None:
+                    dead = np.setdiff1d(dead, already_dead)
+                late_dead.extend(
+                    merged.find_chunks(segment.chunk_ids[dead].tolist())
+                )
+            if late_dead:
+                tombstones[merged] = np.unique(
+                    np.asarray(late_dead, np.int32)
+                )
+            self._snapshot = BM25IndexSnapshot(
+                segments=(
+                    current.segments[0],
+                    *((merged,) if merged.n_docs else ()),
+                    *(
+                        s
+                        for s in current.segments[1:]
+                        if s not in compacted
+                    ),
+                ),
+                tombstones=tombstones,
+                next_chunk_id=current.next_chunk_id,
+                version=current.version + 1,
+            )
+
+
+def write_delta_log_entry(
+    log_dir: str, action: DeltaLogAction, payload
+) -> int:
+    """
+    Запись изменения индекса в журнал.
+
+    Для ``add`` полезная нагрузка -- список Document без chunk_id, для
+    ``remove`` -- словарь со списками ``sources`` и ``chunk_ids``.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    last_seq = max(
+        (seq for seq, _, _ in iter_delta_log_files(log_dir)),
+        default=read_delta_log_state(log_dir),
+    )
+    seq = last_seq + 1
+    path = os.path.join(log_dir, f"{seq:08d}-{action}.pkl")
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)
+    return seq
+
+
+def read_delta_log_state(log_dir: str) -> int:
+    """Номер последней записи журнала, вошедшей в базовый индекс."""
+    try:
+        with open(os.path.join(log_dir, DELTA_LOG_STATE_FILE), "rb") as f:
+            return pickle.load(f)["base_seq"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_delta_log_state(log_dir: str, base_seq: int) -> None:
+    """Фиксация номера записи журнала, вошедшей в базовый индекс."""
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, DELTA_LOG_STATE_FILE)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump({"base_seq": base_seq}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def iter_delta_log_files(
+    log_dir: str,
+) -> Iterator[tuple[int, DeltaLogAction, str]]:
+    """Обход файлов журнала в порядке записи."""
+    if not os.path.isdir(log_dir):
+        return
+    for name in sorted(os.listdir(log_dir)):
+        if not name.endswith(".pkl") or name == DELTA_LOG_STATE_FILE:
+            continue
+        seq, action = name.removesuffix(".pkl").split("-", 1)
+        yield int(seq), action, os.path.join(log_dir, name)
+
+
+def apply_delta_log(
+    index: SegmentedBM25Index, log_dir: str, after_seq: int
+) -> int:
+    """Применение к индексу записей журнала после ``after_seq``."""
+    for seq, action, path in iter_delta_log_files(log_dir):
+        if seq <= after_seq:
+            continue
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+        match action:
+            case "add":
+                index.add_documents(payload)
+            case "remove":
+                index.remove_sources(payload.get("sources", []))
+                index.remove_chunks(payload.get("chunk_ids", []))
+        after_seq = seq
+    return after_seq
+
+
+class SegmentedBM25IndexManager:
+    """
+    Загрузка сегментированного индекса и его фоновое обслуживание.
+
+    Базовый индекс читается из каталога для отображения в память или из
+    pickle BM25Retriever, поверх него применяется журнал изменений.
+    Фоновый поток подхватывает новые записи журнала, перезагружает
+    индекс после внешнего уплотнения и сливает дельта-сегменты, когда их
+    становится слишком много. База, отображенная в память, остается
+    общей для воркеров все время работы процесса и заменяется только
+    новым опубликованным каталогом.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        log_dir: str,
+        max_segments: int,
+        max_tombstone_ratio: float,
+        pickle_path: str | None = None,
+    ):
+        """
+        Инициализация менеджера и загрузка индекса.
+
+        Если задан pickle_path, он читается, пока нет каталога base_path,
+        а после публикации каталога менеджер переходит на него.
+        """
+        self.base_path = base_path
+        self.pickle_path = pickle_path
+        self.log_dir = log_dir
+        self.max_segments = max_segments
+        self.max_tombstone_ratio = max_tombstone_ratio
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._load()
+
+    def _current_base_path(self) -> str:
+        """Путь до базового индекса, который нужно читать сейчас."""
+        if self.pickle_path is not None and not os.path.isdir(self.base_path):
+            return self.pickle_path
+        return self.base_path
+
+    def _base_signature(self) -> tuple[str, int, int]:
+        """Признак смены базового индекса на диске."""
+        path = self._current_base_path()
+        stat_path = path
+        if os.path.isdir(path):
+            stat_path = os.path.join(path, MMAP_META_FILE)
+        return (
+            path,
+            os.stat(stat_path).st_mtime_ns,
+            read_delta_log_state(self.log_dir),
+        )
+
+    def _load(self) -> None:
+        """
+        Полная загрузка базового индекса и журнала изменений.
+
+        Базовый индекс читается из каталога, сохраненного
+        ``save_bm25_segment``, или из pickle BM25Retriever. Записи журнала
+        применяются после номера, сохраненного в каталоге базы, а для
+        pickle и каталогов без номера - после номера из состояния
+        журнала.
+        """
+        signature = self._base_signature()
+        path, _, state_seq = signature
+        if os.path.isdir(path):
+            index = SegmentedBM25Index.from_directory(path)
+        else:
+            with open(path, "rb") as f:
+                index = SegmentedBM25Index.from_retriever(pickle.load(f))
+        base_seq = index.snapshot.segments[0].delta_seq
+        self.applied_seq = apply_delta_log(
+            index,
+            self.log_dir,
+            after_seq=state_seq if base_seq is None else base_seq,
+        )
+        self._signature = signature
+        self.index = index
+
+    def refresh(self) -> None:
+        """Применение новых изменений и уплотнение при необходимости."""
+        if self._base_signature() != self._signature:
+            self._load()
+            return
+        self.applied_seq = apply_delta_log(
+            self.index, self.log_dir, after_seq=self.applied_seq
+        )
+        if self.index.needs_compaction(
+            self.max_segments, self.max_tombstone_ratio
+        ):
+            self.index.compact()
+
+    def _run(self, interval: float) -> None:
+        """Цикл фонового обслуживания индекса."""
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Не удалось обновить BM25 индекс.")
+
+    def start(self, interval: float) -> None:
+        """Запуск фонового обслуживания."""
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Остановка фонового обслуживания."""
+        self._stop.set()
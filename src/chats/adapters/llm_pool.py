@@ -0,0 +1,414 @@
+"""Модуль пула реплик микросервиса большой языковой модели."""
+
+import asyncio
+from enum import Enum
+import logging
+import time
+
+import httpx
+
+from base.exceptions import (
+    DeadlineExceededException,
+    LLMUnavailableException,
+)
+from .llm_routing import ChatAffinityRouter, LLMSlot
+
+logger = logging.getLogger(__name__)
+
+LLM_UNAVAILABLE_EXC_MESSAGE = "Нет доступных реплик языковой модели."
+DEADLINE_EXC_MESSAGE = "Истек срок ожидания ответа языковой модели."
+# Оставшееся до срока время в миллисекундах, после которого реплике
+# следует прекратить генерацию.
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+DEFAULT_REQUEST_TIMEOUT = 5.0
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class CircuitStateChoice(Enum):
+    """Состояния автоматического выключателя реплики."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class LLMBackend:
+    """
+    Реплика микросервиса LLM с автоматическим выключателем.
+
+    После ``failure_threshold`` ошибок подряд выключатель размыкается, и
+    запросы к реплике не направляются ``open_seconds`` секунд. Затем
+    пропускается один пробный запрос: его успех замыкает выключатель,
+    ошибка снова размыкает.
+    """
+
+    def __init__(
+        self, base_url: str, failure_threshold: int, open_seconds: float
+    ):
+        """Инициализация реплики."""
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CircuitStateChoice.CLOSED
+        self.healthy = True
+        self.in_flight = 0
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._n_requests = 0
+        self._n_failures = 0
+        self._latency_ewma: float | None = None
+        self._last_error: str | None = None
+
+    def allows_request(self) -> bool:
+        """Можно ли направить запрос в реплику."""
+        if not self.healthy:
+            return False
+        if self.state == CircuitStateChoice.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                return False
+            self.state = CircuitStateChoice.HALF_OPEN
+        if self.state == CircuitStateChoice.HALF_OPEN:
+            return self.in_flight == 0
+        return True
+
+    def record_success(self, latency: float) -> None:
+        """Учет успешного запроса."""
+        self._n_requests += 1
+        self._consecutive_failures = 0
+        self.state = CircuitStateChoice.CLOSED
+        self._latency_ewma = (
+            latency
+            if self._latency_ewma is None
+            else LATENCY_EWMA_ALPHA * latency
+            + (1 - LATENCY_EWMA_ALPHA) * self._latency_ewma
+        )
+
+    def record_failure(self, error: Exception) -> None:
+        """Учет ошибки запроса и размыкание выключателя."""
+        self._n_requests += 1
+        self._n_failures += 1
+        self._consecutive_failures += 1
+        self._last_error = repr(error)
+        if (
+            self.state == CircuitStateChoice.HALF_OPEN
+            or self._consecutive_failures >= self.failure_threshold
+        ):
+            if self.state != CircuitStateChoice.OPEN:
+                logger.warning(
+                    "Реплика LLM %s отключена: %s", self.base_url, error
+                )
+            self.state = CircuitStateChoice.OPEN
+            self._opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        """Статистика реплики."""
+        return {
+            "state": self.state.value,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self._n_requests,
+            "failures": self._n_failures,
+            "latency_ewma_ms": (
+                round(self._latency_ewma * 1000, 1)
+                if self._latency_ewma is not None
+                else None
+            ),
+            "last_error": self._last_error,
+        }
+
+
+class LLMBackendPool:
+    """
+    Пул реплик микросервиса LLM.
+
+    Запросы распределяются маршрутизатором с учетом привязки чатов к
+    слотам только по репликам, которые прошли проверку здоровья и не
+    отключены выключателем. Если задан ``hedge_after_ms``, запрос, не
+    получивший ответа за это время, дублируется в другую реплику, и
+    используется первый успешный ответ.
+    """
+
+    def __init__(
+        self,
+        router: ChatAffinityRouter,
+        failure_threshold: int,
+        open_seconds: float,
+        hedge_after_ms: float | None,
+        health_check_path: str,
+        health_check_timeout: float = 2.0,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
+        """Инициализация пула."""
+        self.router = router
+        self.backends = {
+            slot.base_url: LLMBackend(
+                slot.base_url, failure_threshold, open_seconds
+            )
+            for slot in router.slots
+        }
+        self.hedge_after = hedge_after_ms / 1000 if hedge_after_ms else None
+        self.health_check_path = health_check_path
+        self.health_check_timeout = health_check_timeout
+        self.request_timeout = request_timeout
+        self._client: httpx.AsyncClient | None = None
+        self._health_task: asyncio.Task | None = None
+        self._n_hedges = 0
+        self._n_hedge_wins = 0
+        self._n_retries = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """HTTP клиент с переиспользованием соединений."""
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        return self._client
+
+    async def post(
+        self,
+        path: str,
+        payload: dict,
+        chat_id: int | None = None,
+        timeout: float | None = None,
+        hedge: bool = False,
+        deadline: float | None = None,
+    ) -> dict:
+        """
+        Отправка запроса в выбранную реплику.
+
+        Если реплика не ответила из-за сетевой ошибки или ошибки сервера,
+        запрос один раз повторяется в другой доступной реплике. Без
+        timeout действует request_timeout пула: None в httpx отключил бы
+        все таймауты, и зависшая реплика держала бы запрос бесконечно.
+        deadline задает срок по time.monotonic: оставшееся время
+        ограничивает таймаут и передается реплике в заголовке
+        DEADLINE_HEADER.
+        """
+        if timeout is None:
+            timeout = self.request_timeout
+        slot = self._select(chat_id)
+        try:
+            if hedge and self.hedge_after is not None:
+                return await self._post_hedged(
+                    slot, path, payload, chat_id, timeout, deadline
+                )
+            return await self._start(
+                slot, path, payload, chat_id, timeout, deadline
+            )
+        except httpx.HTTPError as exc:
+            retry_slot = self._select_other(chat_id, slot)
+            if not _is_backend_error(exc) or retry_slot is None:
+                raise
+            self._n_retries += 1
+            return await self._start(
+                retry_slot, path, payload, chat_id, timeout, deadline
+            )
+
+    async def _post_hedged(
+        self,
+        slot: LLMSlot,
+        path: str,
+        payload: dict,
+        chat_id: int | None,
+        timeout: float | None,
+        deadline: float | None,
+    ) -> dict:
+        """Запрос с дублированием в другую реплику после задержки."""
+        primary = self._start(
+            slot, path, payload, chat_id, timeout, deadline
+        )
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            hedge_slot = None if done else self._select_other(chat_id, slot)
+            if hedge_slot is not None:
+                self._n_hedges += 1
+                tasks.add(
+                    self._start(
+                        hedge_slot, path, payload, chat_id, timeout, deadline
+                    )
+                )
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._n_hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    raise primary.exception() or task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _is_available(self, slot: LLMSlot) -> bool:
+        """Доступен ли слот для запросов."""
+        return self.backends[slot.base_url].allows_request()
+
+    def _select(self, chat_id: int | None) -> LLMSlot:
+        """Выбор слота или ошибка, если все реплики недоступны."""
+        slot = self.router.select(chat_id, self._is_available)
+        if slot is None:
+            raise LLMUnavailableException(LLM_UNAVAILABLE_EXC_MESSAGE)
+        return slot
+
+    def _select_other(
+        self, chat_id: int | None, slot: LLMSlot
+    ) -> LLMSlot | None:
+        """Выбор слота в реплике, отличной от реплики slot."""
+        return self.router.select(
+            chat_id,
+            lambda candidate: candidate.base_url != slot.base_url
+            and self._is_available(candidate),
+        )
+
+    def _start(
+        self,
+        slot: LLMSlot,
+        path: str,
+        payload: dict,
+        chat_id: int | None,
+        timeout: float | None,
+        deadline: float | None,
+    ) -> asyncio.Task:
+        """
+        Запуск запроса к слоту с учетом загрузки.
+
+        Загрузка учитывается синхронно сразу после выбора слота, чтобы
+        параллельные запросы ее видели и пробный запрос полуоткрытого
+        выключателя был единственным. Снимается она по завершении задачи,
+        в том числе отмененной до начала выполнения.
+        """
+        backend = self.backends[slot.base_url]
+        self.router.reserve(slot)
+        backend.in_flight += 1
+
+        def release(_: asyncio.Task) -> None:
+            self.router.release(slot)
+            backend.in_flight -= 1
+
+        task = asyncio.create_task(
+            self._send(slot, path, payload, chat_id, timeout, deadline)
+        )
+        task.add_done_callback(release)
+        return task
+
+    async def _send(
+        self,
+        slot: LLMSlot,
+        path: str,
+        payload: dict,
+        chat_id: int | None,
+        timeout: float | None,
+        deadline: float | None,
+    ) -> dict:
+        """
+        Запрос к слоту с учетом результата в выключателе реплики.
+
+        Таймаут из-за истечения срока запроса не считается ошибкой
+        реплики: длинная генерация не должна отключать ее.
+        """
+        backend = self.backends[slot.base_url]
+        if chat_id is not None and slot.slot_id is not None:
+            payload = {**payload, "id_slot": slot.slot_id}
+        headers = {}
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededException(DEADLINE_EXC_MESSAGE)
+            timeout = min(timeout, remaining) if timeout else remaining
+            headers[DEADLINE_HEADER] = str(int(remaining * 1000))
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.post(
+                f"{slot.base_url}{path}",
+                json=payload,
+                headers=headers,
+                timeout=timeout,
+            )
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except httpx.TimeoutException as exc:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceededException(DEADLINE_EXC_MESSAGE) from exc
+            backend.record_failure(exc)
+            raise
+        except httpx.HTTPError as exc:
+            backend.record_failure(exc)
+            raise
+        backend.record_success(time.perf_counter() - started_at)
+        response.raise_for_status()
+        return response.json()
+
+    async def check_health(self) -> None:
+        """
+        Активная проверка всех реплик.
+
+        Репликой считается живой любой ответ с кодом меньше 500: сервер
+        llama.cpp отвечает 503, пока загружает модель, а микросервис без
+        отдельного эндпойнта здоровья - 404.
+        """
+
+        async def check(backend: LLMBackend) -> None:
+            try:
+                response = await self.client.get(
+                    f"{backend.base_url}{self.health_check_path}",
+                    timeout=self.health_check_timeout,
+                )
+                healthy = response.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning(
+                    "Реплика LLM %s %s",
+                    backend.base_url,
+                    "снова доступна" if healthy else "не прошла проверку",
+                )
+            backend.healthy = healthy
+
+        await asyncio.gather(
+            *(check(backend) for backend in self.backends.values())
+        )
+
+    def start_health_checks(self, interval: float) -> None:
+        """Запуск периодической проверки реплик в текущем цикле событий."""
+        if interval <= 0 or self._health_task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                await self.check_health()
+                await asyncio.sleep(interval)
+
+        self._health_task = asyncio.get_running_loop().create_task(run())
+
+    async def close(self) -> None:
+        """Остановка проверок и закрытие соединений."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_stats(self) -> dict:
+        """Статистика реплик, слотов и дублирования запросов."""
+        return {
+            "backends": {
+                base_url: backend.get_stats()
+                for base_url, backend in self.backends.items()
+            },
+            "hedges": self._n_hedges,
+            "hedge_wins": self._n_hedge_wins,
+            "retries": self._n_retries,
+            **self.router.get_stats(),
+        }
+
+
+def _is_backend_error(exc: httpx.HTTPError) -> bool:
+    """Ошибка на стороне реплики, а не некорректный запрос."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return True
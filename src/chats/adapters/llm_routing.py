@@ -0,0 +1,132 @@
+"""Модуль маршрутизации запросов чатов к слотам сервера LLM."""
+
+from bisect import bisect
+import hashlib
+from typing import Callable
+
+
+class LLMSlot:
+    """Слот сервера LLM со своим KV-кэшем."""
+
+    def __init__(self, base_url: str, slot_id: int | None):
+        """Инициализация слота."""
+        self.base_url = base_url
+        self.slot_id = slot_id
+        self.in_flight = 0
+        self.n_requests = 0
+
+    @property
+    def name(self) -> str:
+        """Имя слота для статистики."""
+        if self.slot_id is None:
+            return self.base_url
+        return f"{self.base_url}#{self.slot_id}"
+
+
+class ChatAffinityRouter:
+    """
+    Маршрутизатор с привязкой чата к слоту сервера LLM.
+
+    Слоты размещаются на кольце консистентного хэширования, и чат всегда
+    начинает поиск с одного и того же слота, где сервер хранит KV-кэш его
+    предыдущих ходов. Добавление или удаление реплики перемещает только
+    чаты соседних участков кольца. Если предпочтительный слот занят
+    ``max_in_flight`` запросами, выбирается следующий свободный по кольцу.
+    """
+
+    def __init__(
+        self,
+        base_urls: list[str],
+        slots_per_backend: int,
+        max_in_flight: int,
+        virtual_nodes: int = 160,
+    ):
+        """Построение кольца слотов."""
+        self.max_in_flight = max_in_flight
+        self.slots = [
+            LLMSlot(base_url, slot_id if slots_per_backend > 1 else None)
+            for base_url in base_urls
+            for slot_id in range(slots_per_backend)
+        ]
+        ring = sorted(
+            (_hash(f"{slot.name}-{node}"), index)
+            for index, slot in enumerate(self.slots)
+            for node in range(virtual_nodes)
+        )
+        self._ring_hashes = [ring_hash for ring_hash, _ in ring]
+        self._ring_slots = [index for _, index in ring]
+        self._n_fallbacks = 0
+
+    def get_preferred_slots(self, key: int) -> list[LLMSlot]:
+        """Слоты в порядке предпочтения для ключа по кольцу."""
+        start = bisect(self._ring_hashes, _hash(str(key)))
+        preferred: dict[int, LLMSlot] = {}
+        for offset in range(len(self._ring_slots)):
+            index = self._ring_slots[(start + offset) % len(self._ring_slots)]
+            preferred.setdefault(index, self.slots[index])
+            if len(preferred) == len(self.slots):
+                break
+        return list(preferred.values())
+
+    def select(
+        self,
+        chat_id: int | None,
+        is_available: Callable[[LLMSlot], bool] = lambda slot: True,
+    ) -> LLMSlot | None:
+        """
+        Выбор слота для запроса среди доступных.
+
+        Запрос без чата уходит в наименее загруженный слот, запрос чата -
+        в первый по кольцу слот, у которого есть свободная емкость. Если
+        заняты все, выбирается наименее загруженный доступный слот.
+        """
+        available = [slot for slot in self.slots if is_available(slot)]
+        if not available:
+            return None
+        least_loaded = min(available, key=lambda slot: slot.in_flight)
+        if chat_id is None:
+            return least_loaded
+        ring_order = self.get_preferred_slots(chat_id)
+        preferred = [slot for slot in ring_order if slot in available]
+        slot = next(
+            (
+                slot
+                for slot in preferred
+                if slot.in_flight < self.max_in_flight
+            ),
+            least_loaded,
+        )
+        if slot is not ring_order[0]:
+            self._n_fallbacks += 1
+        return slot
+
+    @staticmethod
+    def reserve(slot: LLMSlot) -> None:
+        """Учет начала запроса к слоту."""
+        slot.in_flight += 1
+        slot.n_requests += 1
+
+    @staticmethod
+    def release(slot: LLMSlot) -> None:
+        """Учет завершения запроса к слоту."""
+        slot.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        """Статистика распределения запросов по слотам."""
+        return {
+            "fallbacks": self._n_fallbacks,
+            "slots": {
+                slot.name: {
+                    "in_flight": slot.in_flight,
+                    "requests": slot.n_requests,
+                }
+                for slot in self.slots
+            },
+        }
+
+
+def _hash(value: str) -> int:
+    """Стабильный между процессами 64-битный хэш строки."""
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
@@ -0,0 +1,64 @@
+"""Модуль кэша метаданных чатов."""
+
+from collections import OrderedDict
+import time
+
+from ..domain.models import ChatMetadata
+
+
+class ChatMetadataCache:
+    """
+    LRU-кэш владельца и типа чатов в памяти процесса.
+
+    Владелец и тип чата не меняются, поэтому запись устаревает только
+    при удалении или архивации чата. Их выполнение другим процессом кэш
+    не видит до истечения ttl секунд: удаленный там чат проходит проверку
+    доступа, а записанные в него сообщения отклоняет внешний ключ после
+    удаления чата или удаляет вместе с ним фоновая очистка помеченных
+    чатов. Сообщения архивированного чата возвращаются из архива вместе
+    с записанными за это время.
+
+    Записи сбрасываются после фиксации транзакции удаления: сброс до нее
+    позволил бы параллельному запросу снова закэшировать еще не
+    удаленный чат.
+    """
+
+    def __init__(self, max_chats: int, ttl: float):
+        """Инициализация кэша."""
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._metadata: OrderedDict[int, tuple[ChatMetadata, float]] = (
+            OrderedDict()
+        )
+
+    def get(self, chat_id: int) -> ChatMetadata | None:
+        """Получение метаданных чата, если они есть в кэше."""
+        entry = self._metadata.get(chat_id)
+        if entry is None:
+            return None
+        metadata, cached_at = entry
+        if time.monotonic() - cached_at >= self.ttl:
+            del self._metadata[chat_id]
+            return None
+        self._metadata.move_to_end(chat_id)
+        return metadata
+
+    def put(self, chat_id: int, metadata: ChatMetadata) -> None:
+        """Сохранение метаданных чата, загруженных из БД."""
+        self._metadata[chat_id] = (metadata, time.monotonic())
+        self._metadata.move_to_end(chat_id)
+        while len(self._metadata) > self.max_chats:
+            self._metadata.popitem(last=False)
+
+    def invalidate(self, chat_id: int) -> None:
+        """Удаление чата из кэша."""
+        self._metadata.pop(chat_id, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Удаление из кэша всех чатов пользователя."""
+        for chat_id in [
+            chat_id
+            for chat_id, (metadata, _) in self._metadata.items()
+            if metadata.user_id == user_id
+        ]:
+            del self._metadata[chat_id]
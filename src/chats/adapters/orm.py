@@ -2,12 +2,14 @@
 
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import ForeignKey, func, Index, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from base.config import ChatTypeChoice
 from base.orm import Base
 
+EMPTY_CHAT_FIRST_MESSAGE = "Пустой чат"
+
 
 class ChatORM(Base):
     """Модель чата."""
@@ -22,9 +24,14 @@ class ChatORM(Base):
     type: Mapped[ChatTypeChoice] = mapped_column(
         default=ChatTypeChoice.ONLY_RAG
     )
+    # Время удаления чата, сообщения которого удаляются фоновой задачей.
+    deleted_at: Mapped[datetime | None] = mapped_column(default=None)
+    # Версия сообщений чата, растет при каждой их вставке и удалении.
+    # Токены версий для ETag читаются по ней без обращения к сообщениям.
+    version: Mapped[int] = mapped_column(default=0, server_default="0")
     user: Mapped["UserORM"] = relationship(back_populates="chats")
     messages: Mapped[list["MessageORM"]] = relationship(
-        back_populates="chat", lazy="selectin"
+        back_populates="chat", lazy="selectin", passive_deletes=True
     )
 
     @property
@@ -32,7 +39,7 @@ class ChatORM(Base):
         """Вывод первого сообщения."""
         if self.messages:
             return self.messages[0].content
-        return "Пустой чат"
+        return EMPTY_CHAT_FIRST_MESSAGE
 
     @property
     def last_message_timestamp(self):
@@ -46,6 +53,12 @@ class MessageORM(Base):
     """Модель сообщения."""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_timestamp", "chat_id", "timestamp"),
+        # Секции по месяцам создаются в модуле partitions. Ключ секций
+        # должен входить в первичный ключ.
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(
@@ -57,8 +70,39 @@ class MessageORM(Base):
     )
     role: Mapped[str]
     content: Mapped[str]
+    n_tokens: Mapped[int] = mapped_column(default=0, server_default="0")
     timestamp: Mapped[datetime] = mapped_column(
-        default=func.now(), nullable=False
+        primary_key=True, default=func.now(), nullable=False
+    )
+    # Пары (хэш текста, скор) фрагментов, из которых составлен ответ
+    # RAG-системы. Текст такого сообщения хранится в таблице фрагментов.
+    chunk_refs: Mapped[list | None] = mapped_column(
+        JSON(none_as_null=True), default=None
     )
 
     chat: Mapped["ChatORM"] = relationship(back_populates="messages")
+
+
+class ChunkORM(Base):
+    """Модель текста фрагмента, на который ссылаются сообщения."""
+
+    __tablename__ = "chunks"
+
+    digest: Mapped[str] = mapped_column(primary_key=True)
+    content: Mapped[str]
+
+
+class ChatArchiveORM(Base):
+    """Модель архива сообщений неактивного чата."""
+
+    __tablename__ = "chat_archives"
+
+    chat_id: Mapped[int] = mapped_column(
+        ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True
+    )
+    archived_at: Mapped[datetime] = mapped_column(default=func.now())
+    n_messages: Mapped[int]
+    first_message: Mapped[str]
+    last_message_timestamp: Mapped[datetime]
+    # Строки сообщений в JSON, сжатые zlib.
+    data: Mapped[bytes]
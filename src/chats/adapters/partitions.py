@@ -0,0 +1,279 @@
+"""Модуль секционирования таблицы сообщений по месяцам."""
+
+from datetime import date, datetime
+import logging
+import re
+
+from sqlalchemy import Connection, inspect, Table, text
+from sqlalchemy.schema import CreateColumn
+
+from base.utils import CHARS_PER_TOKEN
+from .orm import ChatORM, MessageORM
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_TABLE = MessageORM.__tablename__
+DEFAULT_PARTITION = f"{MESSAGES_TABLE}_default"
+PARTITION_NAME_RE = re.compile(rf"^{MESSAGES_TABLE}_p(\d{{4}})(\d{{2}})$")
+# Имя, под которым преобразование оставляет прежнюю несекционированную
+# таблицу сообщений.
+UNPARTITIONED_TABLE = f"{MESSAGES_TABLE}_unpartitioned"
+# Значения pg_class.relkind секционированной и обычной таблиц.
+PARTITIONED_RELKIND = "p"
+ORDINARY_RELKIND = "r"
+
+
+def month_start(moment: date) -> date:
+    """Первый день месяца."""
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month: date, n_months: int) -> date:
+    """Первый день месяца через n_months месяцев."""
+    index = month.year * 12 + month.month - 1 + n_months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Имя секции сообщений за месяц."""
+    return f"{MESSAGES_TABLE}_p{month:%Y%m}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """Секционирована ли таблица сообщений в БД соединения."""
+    return _get_relkind(connection) == PARTITIONED_RELKIND
+
+
+def create_message_partitions(
+    connection: Connection,
+    months_ahead: int,
+    now: datetime | None = None,
+    since: date | None = None,
+) -> list[str]:
+    """
+    Создание секций сообщений с текущего месяца на months_ahead вперед.
+
+    Если задан since, секции создаются начиная с его месяца. Строки вне
+    созданных секций, например восстановленные из архива за давние
+    месяцы, попадают в секцию по умолчанию. Секция месяца, строки
+    которого уже есть в секции по умолчанию, не создается: PostgreSQL
+    отклонил бы ее создание. Таблица, созданная до секционирования,
+    пропускается с предупреждением, пока ее не преобразует
+    convert_messages_to_partitioned. Функция синхронная для вызова через
+    run_sync асинхронного соединения.
+    """
+    relkind = _get_relkind(connection)
+    if relkind == ORDINARY_RELKIND:
+        logger.warning(
+            "Таблица %s не секционирована, секции не созданы. Преобразуйте "
+            "ее командой: python -m chats.entrypoints.cli.archive convert",
+            MESSAGES_TABLE,
+        )
+    if relkind != PARTITIONED_RELKIND:
+        return []
+    connection.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+            f"PARTITION OF {MESSAGES_TABLE} DEFAULT"
+        )
+    )
+    existing = set(_get_partition_months(connection))
+    created = []
+    current = month_start(now or datetime.now())
+    month = month_start(since) if since else current
+    while month <= add_months(current, months_ahead):
+        next_month = add_months(month, 1)
+        if month not in existing:
+            if _has_default_rows(connection, month, next_month):
+                logger.warning(
+                    "Секция %s не создана: ее строки уже в секции %s",
+                    partition_name(month),
+                    DEFAULT_PARTITION,
+                )
+            else:
+                connection.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+                        f"PARTITION OF {MESSAGES_TABLE} "
+                        f"FOR VALUES FROM ('{month}') TO ('{next_month}')"
+                    )
+                )
+                created.append(partition_name(month))
+        month = next_month
+    return created
+
+
+def drop_empty_message_partitions(
+    connection: Connection, before: date
+) -> list[str]:
+    """
+    Удаление пустых секций сообщений за месяцы до before.
+
+    После архивации неактивных чатов старые секции пустеют, и их
+    удаление сохраняет индексы таблицы сообщений небольшими.
+    """
+    if not is_partitioned(connection):
+        return []
+    dropped = []
+    for month in sorted(_get_partition_months(connection)):
+        if add_months(month, 1) > before:
+            continue
+        name = partition_name(month)
+        if connection.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name})")):
+            continue
+        connection.execute(
+            text(f"ALTER TABLE {MESSAGES_TABLE} DETACH PARTITION {name}")
+        )
+        connection.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    return dropped
+
+
+def convert_messages_to_partitioned(
+    connection: Connection,
+    months_ahead: int,
+    drop_old: bool = False,
+    now: datetime | None = None,
+) -> int | None:
+    """
+    Преобразование таблицы сообщений в секционированную по месяцам.
+
+    Metadata.create_all не меняет существующие таблицы, поэтому таблица
+    сообщений, созданная до секционирования, остается обычной, а в
+    таблицах чатов и сообщений нет новых столбцов. Функция добавляет
+    недостающие столбцы чатов, в том числе в уже секционированной БД.
+    Затем она переименовывает прежнюю таблицу сообщений в
+    UNPARTITIONED_TABLE, создает на ее месте секционированную с секциями
+    за все месяцы ее строк, копирует строки и продолжает
+    последовательность идентификаторов. Оценка числа токенов считается
+    так же, как в estimate_tokens. Прежняя таблица удаляется при
+    drop_old. Все выполняется в транзакции соединения под исключительной
+    блокировкой таблицы. Возвращает число скопированных строк или None,
+    если таблица уже секционирована или преобразование недоступно.
+    """
+    if connection.dialect.name != "postgresql":
+        return None
+    _add_missing_columns(connection, ChatORM.__table__)
+    if _get_relkind(connection) != ORDINARY_RELKIND:
+        return None
+    connection.execute(
+        text(f"LOCK TABLE {MESSAGES_TABLE} IN ACCESS EXCLUSIVE MODE")
+    )
+    # Имена индексов и последовательности уникальны в схеме и нужны
+    # новой таблице.
+    for old_name, new_name in (
+        (f"{MESSAGES_TABLE}_pkey", f"{UNPARTITIONED_TABLE}_pkey"),
+        (
+            "ix_messages_chat_id_timestamp",
+            f"ix_{UNPARTITIONED_TABLE}_chat_id_timestamp",
+        ),
+    ):
+        connection.execute(
+            text(f"ALTER INDEX IF EXISTS {old_name} RENAME TO {new_name}")
+        )
+    connection.execute(
+        text(
+            f"ALTER SEQUENCE IF EXISTS {MESSAGES_TABLE}_id_seq "
+            f"RENAME TO {UNPARTITIONED_TABLE}_id_seq"
+        )
+    )
+    connection.execute(
+        text(f"ALTER TABLE {MESSAGES_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+    )
+    MessageORM.__table__.create(connection)
+    since = connection.scalar(
+        text(f"SELECT MIN(timestamp) FROM {UNPARTITIONED_TABLE}")
+    )
+    create_message_partitions(connection, months_ahead, now, since)
+
+    old_columns = {
+        column["name"]
+        for column in inspect(connection).get_columns(UNPARTITIONED_TABLE)
+    }
+    columns, values = [], []
+    for column in MessageORM.__table__.c:
+        if column.name in old_columns:
+            columns.append(column.name)
+            values.append(column.name)
+        elif column.name == "n_tokens":
+            columns.append(column.name)
+            values.append(
+                f"CEIL(LENGTH(content) / {CHARS_PER_TOKEN}.0)::integer"
+            )
+    copied = connection.execute(
+        text(
+            f"INSERT INTO {MESSAGES_TABLE} ({', '.join(columns)}) "
+            f"SELECT {', '.join(values)} FROM {UNPARTITIONED_TABLE}"
+        )
+    ).rowcount
+    connection.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence(:table, 'id'), MAX(id)) "
+            f"FROM {MESSAGES_TABLE}"
+        ),
+        {"table": MESSAGES_TABLE},
+    )
+    if drop_old:
+        connection.execute(text(f"DROP TABLE {UNPARTITIONED_TABLE}"))
+    return copied
+
+
+def _get_relkind(connection: Connection) -> str | None:
+    """
+    Вид таблицы сообщений в pg_class.
+
+    None, если БД не PostgreSQL или таблица еще не создана.
+    """
+    if connection.dialect.name != "postgresql":
+        return None
+    return connection.scalar(
+        text(
+            "SELECT relkind::text FROM pg_class "
+            "WHERE oid = to_regclass(:table)"
+        ),
+        {"table": MESSAGES_TABLE},
+    )
+
+
+def _add_missing_columns(connection: Connection, table: Table) -> None:
+    """Добавление в существующую таблицу столбцов модели, которых нет."""
+    inspector = inspect(connection)
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.c:
+        if column.name not in existing:
+            definition = CreateColumn(column).compile(
+                dialect=connection.dialect
+            )
+            connection.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+            )
+
+
+def _get_partition_months(connection: Connection) -> list[date]:
+    """Месяцы существующих секций сообщений."""
+    names = connection.scalars(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": MESSAGES_TABLE},
+    )
+    months = []
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return months
+
+
+def _has_default_rows(connection: Connection, start: date, end: date) -> bool:
+    """Есть ли в секции по умолчанию строки за период."""
+    return connection.scalar(
+        text(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+            "WHERE timestamp >= :start AND timestamp < :end)"
+        ),
+        {"start": start, "end": end},
+    )
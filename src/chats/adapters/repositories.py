@@ -1,23 +1,96 @@
 """Модуль реализации паттерна репозиторий."""
 
 import abc
+import asyncio
+from datetime import datetime
+import hashlib
+from typing import AsyncIterator, Hashable, Iterable, Sequence
+import zlib
 
-import httpx
 from langchain_community.retrievers import BM25Retriever
-from sqlalchemy import select
+from langchain_core.documents import Document
+import numpy as np
+import orjson
+from sqlalchemy import (
+    case,
+    cast,
+    delete,
+    func,
+    insert,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from base.exceptions import DoesntExistException, PermissionException
-from .orm import ChatORM, MessageORM
-from ..domain.models import Chat, ChatType, Message, MessageData
+from base.utils import estimate_tokens
+from .dense_indexes import DenseIndex
+from .embeddings import EmbeddingService
+from .indexes import (
+    AbstractBM25Segment,
+    BM25Segment,
+    query_term_matrix,
+    score_query_batch,
+    SegmentedBM25Index,
+    SegmentedBM25IndexManager,
+    split_columns,
+)
+from .llm_pool import LLMBackendPool
+from .metadata_cache import ChatMetadataCache
+from .orm import (
+    ChatArchiveORM,
+    ChatORM,
+    ChunkORM,
+    EMPTY_CHAT_FIRST_MESSAGE,
+    MessageORM,
+)
+from ..domain.models import (
+    Chat,
+    ChatMetadata,
+    ChatType,
+    HistoryTail,
+    Message,
+    MessageData,
+    RetrievedChunk,
+    RetrievedContext,
+)
 
 DOESNT_EXISTS_EXC_MESSAGE = "Чат не найден."
 PERMISSION_EXC_MESSAGE = "Невозможно получить доступ."
+MESSAGE_EXPORT_FIELDS = ["chat_id", "id", "role", "content", "timestamp"]
+# Поля строк в порядке полей моделей ответа Chat и Message.
+CHAT_FIELDS = ["type", "id", "first_message", "last_message_timestamp"]
+MESSAGE_FIELDS = ["id", "chat_id", "timestamp", "role", "content"]
+# Поля сообщений в архиве чата.
+ARCHIVE_FIELDS = [
+    "id",
+    "role",
+    "content",
+    "n_tokens",
+    "timestamp",
+    "chunk_refs",
+]
+# Таймауты запросов к микросервису Llama в секундах: генерация ответа
+# длится минуты, обрезка контекста только токенизирует сообщения.
+ANSWER_REQUEST_TIMEOUT = 300
+CONTEXT_REQUEST_TIMEOUT = 5
 
 
 class ChatAbstractDatabaseRepository(abc.ABC):
     """Абстрактный репозиторий базы данных."""
 
+    @abc.abstractmethod
+    async def check_access(self, chat_id: int, user_id: int | None) -> None:
+        """Проверка доступа к чату без загрузки его сообщений."""
+
+    @abc.abstractmethod
+    async def get_metadata(
+        self, chat_id: int, user_id: int | None
+    ) -> ChatMetadata:
+        """Получение владельца и типа чата с проверкой доступа."""
+
     @abc.abstractmethod
     async def get(self, chat_id: int) -> Chat:
         """Получение объекта-чата из БД."""
@@ -30,6 +103,38 @@ class ChatAbstractDatabaseRepository(abc.ABC):
     async def delete(self, chat_id: int, user_id: int | None = None) -> None:
         """Удаление объекта-чата из БД."""
 
+    @abc.abstractmethod
+    async def mark_deleted(self, chat_id: int, user_id: int) -> None:
+        """Пометка чата удаленным для фонового удаления сообщений."""
+
+    @abc.abstractmethod
+    async def get_deleted_chat_ids(self, limit: int) -> list[int]:
+        """Получение идентификаторов помеченных удаленными чатов."""
+
+    @abc.abstractmethod
+    async def delete_messages_batch(
+        self, chat_id: int, batch_size: int
+    ) -> int:
+        """Удаление пачки сообщений чата и получение их числа."""
+
+    @abc.abstractmethod
+    async def delete_marked(self, chat_id: int) -> None:
+        """Удаление помеченного удаленным чата."""
+
+    @abc.abstractmethod
+    async def get_idle_chat_ids(
+        self, idle_before: datetime, limit: int, after_chat_id: int = 0
+    ) -> list[int]:
+        """Получение чатов после after_chat_id без новых сообщений."""
+
+    @abc.abstractmethod
+    async def archive(self, chat_id: int) -> int:
+        """Перенос сообщений чата в архив и получение их числа."""
+
+    @abc.abstractmethod
+    async def rehydrate(self, chat_id: int) -> int:
+        """Возврат сообщений чата из архива и получение их числа."""
+
     @abc.abstractmethod
     async def get_chats_by_user_id(self, user_id: int) -> list[Chat]:
         """Получение списка объектов-чатов для пользователя из БД."""
@@ -43,19 +148,72 @@ class ChatAbstractDatabaseRepository(abc.ABC):
     ) -> None:
         """Добавление объекта-сообщения для чата в БД."""
 
+    @abc.abstractmethod
+    async def add_messages_to_chat(
+        self,
+        chat_id: int,
+        messages: list[MessageData],
+        user_id: int | None = None,
+    ) -> None:
+        """Добавление в чат нескольких сообщений одним запросом."""
+
+    @abc.abstractmethod
+    async def get_chat_rows_by_user_id(
+        self, user_id: int
+    ) -> Sequence[Sequence]:
+        """Получение строк списка чатов пользователя."""
+
+    @abc.abstractmethod
+    async def get_message_rows_by_chat_id(
+        self, chat_id: int, user_id: int
+    ) -> Sequence[Sequence]:
+        """Получение строк сообщений чата."""
+
+    @abc.abstractmethod
+    async def get_chats_version(self, user_id: int) -> tuple[int, ...]:
+        """Получение токена версии списка чатов пользователя."""
+
+    @abc.abstractmethod
+    async def get_chat_version(
+        self, chat_id: int, user_id: int
+    ) -> tuple[int, ...]:
+        """Получение токена версии сообщений чата."""
+
     @abc.abstractmethod
     async def get_messages_by_chat_id(
         self, chat_id: int, user_id: int
     ) -> list[Message]:
         """Получение списка объектов-сообщений из чата."""
 
+    @abc.abstractmethod
+    async def get_history_tail(
+        self, chat_id: int, user_id: int, n_tokens: int, trim_step: int
+    ) -> HistoryTail:
+        """Получение последних сообщений чата в пределах n_tokens."""
+
+    @abc.abstractmethod
+    def stream_messages(
+        self, user_id: int, chat_id: int | None, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """Потоковое чтение сообщений пользователя пачками строк."""
+
 
 class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
     """Репозиторий базы данных SQLAlchemy."""
 
-    def __init__(self, session: AsyncSession):
-        """Инициализация репозитория."""
+    def __init__(
+        self,
+        session: AsyncSession,
+        metadata_cache: ChatMetadataCache | None = None,
+    ):
+        """
+        Инициализация репозитория.
+
+        С metadata_cache проверки доступа к чату берут владельца из кэша
+        и не обращаются к БД.
+        """
         self.session = session
+        self.metadata_cache = metadata_cache
 
     async def _get(
         self,
@@ -71,6 +229,7 @@ class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
         chat = await self.session.execute(
             select(ChatORM).filter_by(
                 id=chat_id,
+                deleted_at=None,
             )
         )
         chat = chat.scalars().one_or_none()
@@ -80,6 +239,51 @@ class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
             raise PermissionException(PERMISSION_EXC_MESSAGE)
         return chat
 
+    async def check_access(self, chat_id: int, user_id: int | None) -> None:
+        """Проверка доступа к чату без загрузки его сообщений."""
+        await self.get_metadata(chat_id=chat_id, user_id=user_id)
+
+    async def get_metadata(
+        self, chat_id: int, user_id: int | None
+    ) -> ChatMetadata:
+        """
+        Получение владельца и типа чата с проверкой доступа.
+
+        Выбираются только столбцы строки чата и наличие архива по
+        первичным ключам, поэтому время проверки не зависит от длины
+        чата. Архивированные чаты не кэшируются, чтобы их возврат из
+        архива не пропускался.
+        """
+        metadata = (
+            self.metadata_cache.get(chat_id)
+            if self.metadata_cache is not None
+            else None
+        )
+        if metadata is None:
+            row = (
+                await self.session.execute(
+                    select(
+                        ChatORM.user_id,
+                        ChatORM.type,
+                        ChatArchiveORM.chat_id.is_not(None).label("archived"),
+                    )
+                    .outerjoin(
+                        ChatArchiveORM, ChatArchiveORM.chat_id == ChatORM.id
+                    )
+                    .where(ChatORM.id == chat_id, ChatORM.deleted_at.is_(None))
+                )
+            ).one_or_none()
+            if row is None:
+                raise DoesntExistException(DOESNT_EXISTS_EXC_MESSAGE)
+            metadata = ChatMetadata(
+                user_id=row.user_id, type=row.type, archived=row.archived
+            )
+            if self.metadata_cache is not None and not metadata.archived:
+                self.metadata_cache.put(chat_id, metadata)
+        if user_id and metadata.user_id != user_id:
+            raise PermissionException(PERMISSION_EXC_MESSAGE)
+        return metadata
+
     async def get(self, chat_id: int) -> Chat:
         """Получение объекта-чата из БД."""
         chat = await self._get(chat_id=chat_id)
@@ -97,15 +301,162 @@ class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
         return Chat(**chat.to_dict_with_property())
 
     async def delete(self, chat_id: int, user_id: int | None = None) -> None:
-        """Удаление объекта-чата из БД."""
-        chat = await self._get(chat_id=chat_id, user_id=user_id)
-        await self.session.delete(chat)
+        """
+        Удаление объекта-чата из БД.
+
+        Чат удаляется одним запросом без загрузки сообщений, которые
+        удаляет каскадный внешний ключ в БД. Кэш метаданных чата
+        сбрасывает сервис после фиксации транзакции.
+        """
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        await self.session.execute(
+            delete(ChatORM).where(ChatORM.id == chat_id)
+        )
+
+    async def mark_deleted(self, chat_id: int, user_id: int) -> None:
+        """
+        Пометка чата удаленным для фонового удаления сообщений.
+
+        Помеченный чат сразу перестает быть доступен, а его сообщения
+        удаляются пачками, чтобы не держать блокировки и не писать весь
+        журнал одной транзакцией. Строка чата остается до конца очистки,
+        поэтому каскадный внешний ключ сообщения не удаляет. Кэш
+        метаданных чата сбрасывает сервис после фиксации транзакции.
+        """
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        await self.session.execute(
+            update(ChatORM)
+            .where(ChatORM.id == chat_id)
+            .values(deleted_at=func.now())
+        )
+
+    async def get_deleted_chat_ids(self, limit: int) -> list[int]:
+        """Получение идентификаторов помеченных удаленными чатов."""
+        chat_ids = await self.session.scalars(
+            select(ChatORM.id)
+            .where(ChatORM.deleted_at.is_not(None))
+            .order_by(ChatORM.deleted_at)
+            .limit(limit)
+        )
+        return list(chat_ids)
+
+    async def delete_messages_batch(
+        self, chat_id: int, batch_size: int
+    ) -> int:
+        """Удаление пачки сообщений чата и получение их числа."""
+        result = await self.session.execute(
+            delete(MessageORM).where(
+                MessageORM.id.in_(
+                    select(MessageORM.id)
+                    .filter_by(chat_id=chat_id)
+                    .limit(batch_size)
+                )
+            )
+        )
+        return result.rowcount
+
+    async def delete_marked(self, chat_id: int) -> None:
+        """Удаление помеченного удаленным чата."""
+        await self.session.execute(
+            delete(ChatORM).where(
+                ChatORM.id == chat_id, ChatORM.deleted_at.is_not(None)
+            )
+        )
+
+    async def get_idle_chat_ids(
+        self, idle_before: datetime, limit: int, after_chat_id: int = 0
+    ) -> list[int]:
+        """
+        Получение чатов после after_chat_id без сообщений после idle_before.
+
+        Чаты перебираются по первичному ключу от after_chat_id, а время
+        последнего сообщения каждого чата берется из индекса сообщений
+        чата, поэтому пачка не группирует всю таблицу сообщений, а
+        следующая пачка продолжает перебор с последнего чата предыдущей.
+        Архивированные, удаленные и пустые чаты не выбираются.
+        """
+        last_message_at = (
+            select(func.max(MessageORM.timestamp))
+            .where(MessageORM.chat_id == ChatORM.id)
+            .scalar_subquery()
+        )
+        chat_ids = await self.session.scalars(
+            select(ChatORM.id)
+            .outerjoin(ChatArchiveORM, ChatArchiveORM.chat_id == ChatORM.id)
+            .where(
+                ChatORM.id > after_chat_id,
+                ChatORM.deleted_at.is_(None),
+                ChatArchiveORM.chat_id.is_(None),
+                last_message_at < idle_before,
+            )
+            .order_by(ChatORM.id)
+            .limit(limit)
+        )
+        return list(chat_ids)
+
+    async def archive(self, chat_id: int) -> int:
+        """
+        Перенос сообщений чата в архив и получение их числа.
+
+        Сообщения удаляются из таблицы одним запросом с возвратом строк,
+        поэтому в архив попадают ровно удаленные сообщения, даже если
+        параллельно в чат пишут. Строки хранятся одним сжатым JSON.
+        """
+        rows = (
+            await self.session.execute(
+                delete(MessageORM)
+                .where(MessageORM.chat_id == chat_id)
+                .returning(
+                    *(getattr(MessageORM, field) for field in ARCHIVE_FIELDS)
+                )
+            )
+        ).all()
+        if not rows:
+            return 0
+        await self._bump_versions([chat_id])
+        rows.sort(key=lambda row: row.id)
+        self.session.add(
+            ChatArchiveORM(
+                chat_id=chat_id,
+                n_messages=len(rows),
+                first_message=rows[0].content,
+                last_message_timestamp=max(row.timestamp for row in rows),
+                data=zlib.compress(
+                    orjson.dumps([list(row) for row in rows])
+                ),
+            )
+        )
+        await self.session.flush()
+        return len(rows)
+
+    async def rehydrate(self, chat_id: int) -> int:
+        """
+        Возврат сообщений чата из архива и получение их числа.
+
+        Архив удаляется запросом с возвратом данных, поэтому при
+        одновременном открытии чата сообщения возвращает только один
+        запрос. Сообщения сохраняют свои идентификаторы и время.
+        """
+        data = await self.session.scalar(
+            delete(ChatArchiveORM)
+            .where(ChatArchiveORM.chat_id == chat_id)
+            .returning(ChatArchiveORM.data)
+        )
+        if data is None:
+            return 0
+        rows = [
+            dict(row, chat_id=chat_id) for row in _load_archive(data)
+        ]
+        await self.session.execute(insert(MessageORM), rows)
+        await self._bump_versions([chat_id])
+        return len(rows)
 
     async def get_chats_by_user_id(self, user_id: int) -> list[Chat]:
         """Получение списка объектов-чатов для пользователя из БД."""
         chats = await self.session.execute(
             select(ChatORM).filter_by(
                 user_id=user_id,
+                deleted_at=None,
             )
         )
         return [
@@ -113,6 +464,108 @@ class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
             for chat in chats.scalars().all()
         ]
 
+    async def get_chat_rows_by_user_id(
+        self, user_id: int
+    ) -> Sequence[Sequence]:
+        """
+        Получение строк списка чатов пользователя.
+
+        Первое сообщение и время последнего выбираются подзапросами по
+        индексу сообщений чата, поэтому сообщения не загружаются, а для
+        архивированных чатов берутся из архива. Поля строк совпадают с
+        CHAT_FIELDS.
+        """
+        first_message = (
+            select(MessageORM.content)
+            .where(MessageORM.chat_id == ChatORM.id)
+            .order_by(MessageORM.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        last_message_timestamp = (
+            select(func.max(MessageORM.timestamp))
+            .where(MessageORM.chat_id == ChatORM.id)
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            select(
+                ChatORM.type,
+                ChatORM.id,
+                func.coalesce(
+                    first_message,
+                    ChatArchiveORM.first_message,
+                    EMPTY_CHAT_FIRST_MESSAGE,
+                ),
+                func.coalesce(
+                    last_message_timestamp,
+                    ChatArchiveORM.last_message_timestamp,
+                ),
+            )
+            .outerjoin(ChatArchiveORM, ChatArchiveORM.chat_id == ChatORM.id)
+            .where(ChatORM.user_id == user_id, ChatORM.deleted_at.is_(None))
+            .order_by(ChatORM.id)
+        )
+        return result.all()
+
+    async def get_message_rows_by_chat_id(
+        self, chat_id: int, user_id: int
+    ) -> Sequence[Sequence]:
+        """
+        Получение строк сообщений чата.
+
+        Поля строк совпадают с MESSAGE_FIELDS.
+        """
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        result = await self.session.execute(
+            select(
+                MessageORM.id,
+                MessageORM.chat_id,
+                MessageORM.timestamp,
+                MessageORM.role,
+                MessageORM.content,
+                MessageORM.chunk_refs,
+            )
+            .filter_by(chat_id=chat_id)
+            .order_by(MessageORM.timestamp, MessageORM.id)
+        )
+        return await self._resolve_chunk_refs(
+            result.all(), MESSAGE_FIELDS.index("content")
+        )
+
+    async def get_chats_version(self, user_id: int) -> tuple[int, ...]:
+        """
+        Получение токена версии списка чатов пользователя.
+
+        Создание и удаление чатов меняет число и максимальный
+        идентификатор чатов, новые сообщения - сумму версий чатов.
+        Запрос читает только строки чатов, не обращаясь к сообщениям.
+        """
+        result = await self.session.execute(
+            select(
+                func.count(ChatORM.id),
+                func.coalesce(func.max(ChatORM.id), 0),
+                func.coalesce(func.sum(ChatORM.version), 0),
+            ).where(ChatORM.user_id == user_id, ChatORM.deleted_at.is_(None))
+        )
+        return tuple(result.one())
+
+    async def get_chat_version(
+        self, chat_id: int, user_id: int
+    ) -> tuple[int, ...]:
+        """Получение токена версии сообщений чата с проверкой доступа."""
+        result = await self.session.execute(
+            select(ChatORM.user_id, ChatORM.version).where(
+                ChatORM.id == chat_id, ChatORM.deleted_at.is_(None)
+            )
+        )
+        row = result.one_or_none()
+        if row is None:
+            raise DoesntExistException(DOESNT_EXISTS_EXC_MESSAGE)
+        owner_id, *version = row
+        if owner_id != user_id:
+            raise PermissionException(PERMISSION_EXC_MESSAGE)
+        return tuple(version)
+
     async def add_message_to_chat(
         self,
         chat_id: int,
@@ -120,108 +573,774 @@ class ChatSQLAlchemyRepository(ChatAbstractDatabaseRepository):
         user_id: int | None = None,
     ) -> None:
         """Добавление объекта-сообщения для чата в БД."""
-        await self._get(chat_id=chat_id, user_id=user_id)
-        message = MessageORM(
-            chat_id=chat_id,
-            **message_data.model_dump(),
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        await self._add_chunks([message_data])
+        self.session.add(MessageORM(**message_row(chat_id, message_data)))
+        await self._bump_versions([chat_id])
+
+    async def add_messages_to_chat(
+        self,
+        chat_id: int,
+        messages: list[MessageData],
+        user_id: int | None = None,
+    ) -> None:
+        """
+        Добавление в чат нескольких сообщений одним запросом.
+
+        Сообщения вставляются без создания ORM-объектов и получают
+        идентификаторы в порядке списка, по которому упорядочиваются
+        сообщения с одинаковым временем.
+        """
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        await self._add_chunks(messages)
+        await self.session.execute(
+            insert(MessageORM),
+            [
+                message_row(chat_id, message_data)
+                for message_data in messages
+            ],
         )
-        self.session.add(message)
+        await self._bump_versions([chat_id])
+
+    async def _bump_versions(self, chat_ids: Iterable[int]) -> None:
+        """Увеличение версий чатов, сообщения которых изменились."""
+        await bump_chat_versions(self.session, chat_ids)
+
+    async def _add_chunks(self, messages: list[MessageData]) -> None:
+        """
+        Сохранение текстов фрагментов, на которые ссылаются сообщения.
+
+        Уже сохраненные фрагменты пропускаются без записи строк.
+        """
+        rows = chunk_rows(messages)
+        if rows:
+            await self.session.execute(
+                pg_insert(ChunkORM).on_conflict_do_nothing(), rows
+            )
+
+    async def _resolve_chunk_refs(
+        self, rows: Sequence[Sequence], content_index: int
+    ) -> list[tuple]:
+        """
+        Подстановка текста ответов RAG-системы по ссылкам на фрагменты.
+
+        Последний столбец строк - ссылки на фрагменты, в результат он не
+        входит. Тексты фрагментов всех строк выбираются одним запросом.
+        """
+        digests = {
+            digest for *_, refs in rows if refs for digest, _ in refs
+        }
+        contents = {}
+        if digests:
+            contents = dict(
+                (
+                    await self.session.execute(
+                        select(ChunkORM.digest, ChunkORM.content).where(
+                            ChunkORM.digest.in_(digests)
+                        )
+                    )
+                ).all()
+            )
+        resolved = []
+        for *row, refs in rows:
+            if refs is not None:
+                row[content_index] = "\n".join(
+                    contents.get(digest, "") for digest, _ in refs
+                )
+            resolved.append(tuple(row))
+        return resolved
 
     async def get_messages_by_chat_id(
         self, chat_id: int, user_id: int
     ) -> list[Message]:
         """Получение списка объектов-сообщений из чата."""
-        await self._get(chat_id=chat_id, user_id=user_id)
-        messages = await self.session.execute(
-            select(MessageORM).filter_by(
-                chat_id=chat_id,
+        rows = await self.get_message_rows_by_chat_id(chat_id, user_id)
+        return [Message(**dict(zip(MESSAGE_FIELDS, row))) for row in rows]
+
+    async def get_history_tail(
+        self, chat_id: int, user_id: int, n_tokens: int, trim_step: int
+    ) -> HistoryTail:
+        """
+        Получение последних сообщений чата в пределах n_tokens.
+
+        Суммы токенов считаются оконными функциями в БД, поэтому старые
+        сообщения не загружаются. Начало истории сдвигается не на каждом
+        ходе, а блоками по trim_step токенов от начала чата: так префикс
+        запроса к LLM остается неизменным между ходами и переиспользуется
+        кэшем сервера модели.
+        """
+        await self.check_access(chat_id=chat_id, user_id=user_id)
+        older_tokens = func.coalesce(
+            func.sum(MessageORM.n_tokens).over(
+                order_by=(MessageORM.timestamp, MessageORM.id),
+                rows=(None, -1),
+            ),
+            0,
+        ).label("older_tokens")
+        total_tokens = func.sum(MessageORM.n_tokens).over().label(
+            "total_tokens"
+        )
+        tail = (
+            select(
+                MessageORM.id,
+                MessageORM.role,
+                MessageORM.content,
+                MessageORM.chunk_refs,
+                MessageORM.timestamp,
+                older_tokens,
+                total_tokens,
             )
+            .filter_by(chat_id=chat_id)
+            .subquery()
         )
-        return [
-            Message(**message.__dict__) for message in messages.scalars().all()
-        ]
+        n_skipped_tokens = case(
+            (
+                tail.c.total_tokens > n_tokens,
+                (tail.c.total_tokens - n_tokens + trim_step - 1)
+                // trim_step
+                * trim_step,
+            ),
+            else_=0,
+        )
+        rows = await self._resolve_chunk_refs(
+            (
+                await self.session.execute(
+                    select(
+                        tail.c.role,
+                        tail.c.content,
+                        tail.c.older_tokens,
+                        tail.c.chunk_refs,
+                    )
+                    .where(tail.c.older_tokens >= n_skipped_tokens)
+                    .order_by(tail.c.timestamp, tail.c.id)
+                )
+            ).all(),
+            1,
+        )
+        return HistoryTail(
+            messages=[
+                MessageData(role=role, content=content)
+                for role, content, _ in rows
+            ],
+            n_skipped_tokens=rows[0][2] if rows else 0,
+        )
+
+    async def stream_messages(
+        self, user_id: int, chat_id: int | None, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """
+        Потоковое чтение сообщений пользователя пачками строк.
+
+        Строки читаются курсором на стороне сервера по batch_size штук
+        без создания ORM-объектов, поэтому память не зависит от размера
+        истории. Поля строк совпадают с MESSAGE_EXPORT_FIELDS.
+
+        Архивы чатов читаются тем же запросом, что и сообщения, и
+        распаковываются в строки без возврата сообщений в таблицу, а
+        один снимок БД не дает потерять или повторить чат, который
+        архивируется или возвращается из архива во время выгрузки.
+        Сообщения архива идут перед сообщениями чата, записанными после
+        архивации.
+        """
+        messages = (
+            select(
+                MessageORM.chat_id,
+                MessageORM.id,
+                MessageORM.role,
+                MessageORM.content,
+                MessageORM.timestamp,
+                MessageORM.chunk_refs,
+                cast(None, ChatArchiveORM.data.type).label("data"),
+            )
+            .join(ChatORM, ChatORM.id == MessageORM.chat_id)
+            .where(ChatORM.user_id == user_id, ChatORM.deleted_at.is_(None))
+        )
+        archives = (
+            select(
+                ChatArchiveORM.chat_id,
+                cast(None, MessageORM.id.type),
+                cast(None, MessageORM.role.type),
+                cast(None, MessageORM.content.type),
+                cast(None, MessageORM.timestamp.type),
+                cast(None, MessageORM.chunk_refs.type),
+                ChatArchiveORM.data,
+            )
+            .join(ChatORM, ChatORM.id == ChatArchiveORM.chat_id)
+            .where(ChatORM.user_id == user_id, ChatORM.deleted_at.is_(None))
+        )
+        if chat_id is not None:
+            await self.check_access(chat_id=chat_id, user_id=user_id)
+            messages = messages.where(MessageORM.chat_id == chat_id)
+            archives = archives.where(ChatArchiveORM.chat_id == chat_id)
+        rows = union_all(messages, archives).subquery()
+        result = await self.session.stream(
+            select(rows)
+            .order_by(rows.c.chat_id, rows.c.id.nulls_first())
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            yield await self._resolve_chunk_refs(
+                [
+                    message
+                    for *row, data in partition
+                    for message in (
+                        [row] if data is None else _unpack_archive(row, data)
+                    )
+                ],
+                MESSAGE_EXPORT_FIELDS.index("content"),
+            )
 
 
 class LLMAbstractRepository(abc.ABC):
     """Абстрактный репозиторий большой языковой модели."""
 
     @abc.abstractmethod
-    def get_answer(self, context: list[MessageData]) -> MessageData:
+    def get_answer(
+        self,
+        context: list[MessageData],
+        chat_id: int | None = None,
+        deadline: float | None = None,
+    ) -> MessageData:
         """Получение ответа на переданный контекст."""
 
     @abc.abstractmethod
     def get_context(
-        self, messages: list[MessageData], n_tokens: int
+        self,
+        messages: list[MessageData],
+        n_tokens: int,
+        deadline: float | None = None,
     ) -> list[MessageData]:
         """Получение контекста допустимого размера."""
 
 
 class LlamaCppRepository(LLMAbstractRepository):
-    """Репозиторий, взаимодействующий с микросервисом Llama."""
+    """Репозиторий, взаимодействующий с репликами микросервиса Llama."""
 
-    def __init__(self, base_url: str):
+    def __init__(self, pool: LLMBackendPool):
         """Инициализация репозитория."""
-        self.base_url = base_url
-
-    async def get_answer(self, context: list[MessageData]) -> MessageData:
-        """Получение ответа от микросервиса Llama."""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/get_answer",
-                json={
-                    "context": [message.model_dump() for message in context]
-                },
-                timeout=300,
-            )
-            response.raise_for_status()
-            data = response.json()
-            return MessageData(**data["message"])
+        self.pool = pool
+
+    async def get_answer(
+        self,
+        context: list[MessageData],
+        chat_id: int | None = None,
+        deadline: float | None = None,
+    ) -> MessageData:
+        """
+        Получение ответа от микросервиса Llama.
+
+        Запрос чата направляется в закрепленный за ним слот, а
+        ``cache_prompt`` разрешает серверу переиспользовать KV-кэш общего
+        префикса с предыдущим ходом.
+        """
+        data = await self.pool.post(
+            "/get_answer",
+            {
+                "context": [message.model_dump() for message in context],
+                "cache_prompt": True,
+            },
+            chat_id=chat_id,
+            timeout=ANSWER_REQUEST_TIMEOUT,
+            hedge=True,
+            deadline=deadline,
+        )
+        return MessageData(**data["message"])
 
     async def get_context(
-        self, messages: list[MessageData], n_tokens: int
+        self,
+        messages: list[MessageData],
+        n_tokens: int,
+        deadline: float | None = None,
     ) -> list[MessageData]:
         """Получение контекста от микросервиса Llama."""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/get_context",
-                json={
-                    "messages": [message.model_dump() for message in messages],
-                    "n_tokens": n_tokens,
-                },
-            )
-            response.raise_for_status()
-            data = response.json()
-            return [MessageData(**msg) for msg in data["context"]]
+        data = await self.pool.post(
+            "/get_context",
+            {
+                "messages": [message.model_dump() for message in messages],
+                "n_tokens": n_tokens,
+            },
+            timeout=CONTEXT_REQUEST_TIMEOUT,
+            deadline=deadline,
+        )
+        return [MessageData(**msg) for msg in data["context"]]
 
 
 class RAGAbstractsRepository(abc.ABC):
     """Абстрактный репозиторий RAG-системы."""
 
     @abc.abstractmethod
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Получение n_docs релевантных фрагментов в порядке скора."""
+
+    async def get_relevant_chunks_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """Получение релевантных фрагментов для пакета запросов."""
+        return [
+            await self.get_relevant_chunks(query, n_docs) for query in queries
+        ]
+
     async def get_relevant_context(self, query: str, n_docs: int) -> str:
         """Получение контекста из n_docs релевантных документов."""
+        chunks = await self.get_relevant_chunks(query, n_docs)
+        return "\n".join([chunk.content for chunk in chunks])
+
+    def get_index_version(self) -> Hashable:
+        """Версия индекса, меняющаяся при обновлении его содержимого."""
+        return 0
+
+    def get_stats(self) -> dict:
+        """Статистика работы ретривера."""
+        return {}
 
     @staticmethod
     def get_augmented_prompt(query: str, context: str) -> str:
         """Дополнение запроса релевантным контекстом."""
-        return f"""
-            Используя информацию ниже, ответь на следующий запрос:
-            Контекст:
-            {context}
-            Вопрос:
-            {query}
-        """
+        return (
+            "Используя информацию ниже, ответь на следующий запрос.\n"
+            f"Контекст:\n{context}\n"
+            f"Вопрос:\n{query}"
+        )
 
 
 class BM25RetrieverRepository(RAGAbstractsRepository):
     """Репозитоорий ретривера BM25."""
 
     def __init__(self, retriever: BM25Retriever):
-        """Инициализация репозитория."""
+        """
+        Инициализация репозитория.
+
+        Инвертированный индекс для пакетного поиска строится здесь, при
+        запуске воркера, а не в первом пакетном запросе.
+        """
         self.retriever = retriever
+        self._segment = BM25Segment.from_retriever(retriever)
 
-    async def get_relevant_context(self, query: str, n_docs: int) -> str:
-        """Поиск релевантных фрагментов текста через BM25Retriever."""
-        relevant_documents = self.retriever.get_relevant_documents(query)
-        relevant_documents = relevant_documents[:n_docs]
-        return "\n".join([doc.page_content for doc in relevant_documents])
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """
+        Поиск релевантных фрагментов текста через BM25Retriever.
+
+        Подсчет скоров выполняется в потоке, чтобы не блокировать цикл
+        событий и дать одновременным одинаковым запросам дождаться
+        общего результата.
+        """
+        return await asyncio.to_thread(self._search, query, n_docs)
+
+    def _search(self, query: str, n_docs: int) -> list[RetrievedChunk]:
+        """
+        Синхронный поиск n_docs фрагментов с наибольшим скором.
+
+        Как и пакетный поиск, возвращает только фрагменты с ненулевым
+        скором: фрагменты без общих с запросом термов не релевантны, и
+        на запрос без совпадений выдача пуста.
+        """
+        scores = self.retriever.vectorizer.get_scores(
+            self.retriever.preprocess_func(query)
+        )
+        top = np.flatnonzero(scores)
+        if len(top) > n_docs:
+            top = top[np.argpartition(-scores[top], n_docs - 1)[:n_docs]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            _document_to_chunk(self.retriever.docs[i], scores[i]) for i in top
+        ]
+
+    async def get_relevant_chunks_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """Поиск релевантных фрагментов для пакета запросов в потоке."""
+        return await asyncio.to_thread(self._search_batch, queries, n_docs)
+
+    def _search_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """
+        Синхронный поиск для пакета запросов.
+
+        BM25Okapi хранит частоты термов по документам, поэтому пакет
+        ищется по инвертированному индексу, построенному при создании
+        репозитория. Веса считаются по формуле и IDF BM25Okapi, и скоры
+        совпадают с одиночным поиском.
+        """
+        vectorizer = self.retriever.vectorizer
+        terms, rows, columns, query_tfs = query_term_matrix(
+            [self.retriever.preprocess_func(query) for query in queries]
+        )
+        norm = vectorizer.k1 * (
+            1
+            - vectorizer.b
+            + vectorizer.b * self._segment.doc_len / vectorizer.avgdl
+        )
+        term_postings = []
+        for term, entries in zip(terms, split_columns(columns, len(terms))):
+            postings = self._segment.postings(term)
+            idf = vectorizer.idf.get(term) or 0
+            if postings is None or not idf:
+                continue
+            positions, tfs = postings
+            term_postings.append(
+                (
+                    rows[entries],
+                    query_tfs[entries],
+                    positions,
+                    idf
+                    * tfs
+                    * (vectorizer.k1 + 1)
+                    / (tfs + norm[positions]),
+                )
+            )
+        return [
+            [
+                _document_to_chunk(self.retriever.docs[position], score)
+                for position, score in zip(positions, scores)
+            ]
+            for positions, scores in score_query_batch(
+                len(queries), self._segment.n_docs, term_postings, n_docs
+            )
+        ]
+
+
+class SegmentedBM25RetrieverRepository(RAGAbstractsRepository):
+    """Репозиторий BM25 индекса с инкрементальными обновлениями."""
+
+    def __init__(self, manager: SegmentedBM25IndexManager):
+        """Инициализация репозитория."""
+        self.manager = manager
+
+    @property
+    def index(self) -> SegmentedBM25Index:
+        """Текущий загруженный индекс."""
+        return self.manager.index
+
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Поиск релевантных фрагментов по текущему снимку индекса."""
+        results = await asyncio.to_thread(
+            self.index.search_with_scores, query, n_docs
+        )
+        return [
+            _document_to_chunk(document, score) for score, document in results
+        ]
+
+    async def get_relevant_chunks_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """Поиск для пакета запросов по одному снимку индекса."""
+        results = await asyncio.to_thread(
+            self.index.search_batch_with_scores, queries, n_docs
+        )
+        return [
+            [
+                _document_to_chunk(document, score)
+                for score, document in query_results
+            ]
+            for query_results in results
+        ]
+
+    def get_index_version(self) -> Hashable:
+        """
+        Версия текущего снимка индекса.
+
+        Нумерация снимков начинается заново при перезагрузке индекса,
+        поэтому версия включает и сам загруженный индекс.
+        """
+        index = self.index
+        return id(index), index.snapshot.version
+
+
+class MmapBM25RetrieverRepository(SegmentedBM25RetrieverRepository):
+    """
+    Репозиторий BM25 по индексу, отображенному в память, без обновлений.
+
+    Скоры совпадают с BM25Retriever из pickle, но индекс не копируется в
+    память каждого воркера, а разделяется ими через страничный кэш ОС.
+    """
+
+    def __init__(self, index: SegmentedBM25Index):
+        """Инициализация репозитория."""
+        self._index = index
+
+    @property
+    def index(self) -> SegmentedBM25Index:
+        """Загруженный индекс."""
+        return self._index
+
+
+class DenseRetrieverRepository(RAGAbstractsRepository):
+    """Репозиторий векторного поиска по эмбеддингам фрагментов."""
+
+    def __init__(
+        self,
+        embedding_service: EmbeddingService,
+        dense_index: DenseIndex,
+        chunk_store: AbstractBM25Segment,
+    ):
+        """Инициализация репозитория."""
+        self.embedding_service = embedding_service
+        self.dense_index = dense_index
+        self.chunk_store = chunk_store
+
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Поиск фрагментов, ближайших к запросу по косинусной мере."""
+        query_embedding = await self.embedding_service.embed_query(query)
+        scores, chunk_ids = self.dense_index.search(
+            query_embedding[None], n_docs
+        )
+        return self._to_chunks(scores[0], chunk_ids[0])
+
+    async def get_relevant_chunks_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """
+        Поиск для пакета запросов.
+
+        Эмбеддинги запрашиваются одновременно и объединяются сервисом в
+        батчи модели, а поиск по индексу выполняется одной матрицей.
+        """
+        query_embeddings = await asyncio.gather(
+            *(self.embedding_service.embed_query(query) for query in queries)
+        )
+        scores, chunk_ids = self.dense_index.search(
+            np.stack(query_embeddings), n_docs
+        )
+        return [
+            self._to_chunks(row_scores, row_chunk_ids)
+            for row_scores, row_chunk_ids in zip(scores, chunk_ids)
+        ]
+
+    def _to_chunks(
+        self, scores: np.ndarray, chunk_ids: np.ndarray
+    ) -> list[RetrievedChunk]:
+        """Загрузка найденных фрагментов по их идентификаторам."""
+        score_by_chunk_id = {
+            chunk_id: score
+            for chunk_id, score in zip(chunk_ids.tolist(), scores)
+            if chunk_id >= 0
+        }
+        return [
+            _document_to_chunk(
+                document, score_by_chunk_id[document.metadata["chunk_id"]]
+            )
+            for document in self.chunk_store.documents_by_chunk_ids(
+                list(score_by_chunk_id)
+            )
+        ]
+
+    def get_stats(self) -> dict:
+        """Статистика модели эмбеддингов и индекса."""
+        return {
+            "embeddings": self.embedding_service.get_stats(),
+            "dense_index": self.dense_index.params.model_dump(mode="json"),
+        }
+
+
+class HybridRetrieverRepository(RAGAbstractsRepository):
+    """
+    Гибридный поиск объединением выдач нескольких ретриверов.
+
+    Каждый ретривер возвращает n_docs * candidates_factor кандидатов, и
+    выдачи объединяются по Reciprocal Rank Fusion: скор фрагмента равен
+    сумме 1 / (rrf_k + ранг) по выдачам, где он встретился. RRF
+    использует только ранги, поэтому несравнимые скоры BM25 и
+    косинусной меры не нужно нормировать. Скоры RRF группируются по
+    числу нашедших фрагмент ретриверов, поэтому отсечение выдачи по
+    разрыву скоров для них задается отдельно.
+    """
+
+    def __init__(
+        self,
+        retrievers: list[RAGAbstractsRepository],
+        candidates_factor: int,
+        rrf_k: int = 60,
+    ):
+        """Инициализация репозитория."""
+        self.retrievers = retrievers
+        self.candidates_factor = candidates_factor
+        self.rrf_k = rrf_k
+
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Одновременный поиск всеми ретриверами и объединение выдач."""
+        rankings = await asyncio.gather(
+            *(
+                retriever.get_relevant_chunks(
+                    query, n_docs * self.candidates_factor
+                )
+                for retriever in self.retrievers
+            )
+        )
+        return self._fuse(rankings, n_docs)
+
+    async def get_relevant_chunks_batch(
+        self, queries: list[str], n_docs: int
+    ) -> list[list[RetrievedChunk]]:
+        """Пакетный поиск каждым ретривером и объединение выдач."""
+        batches = await asyncio.gather(
+            *(
+                retriever.get_relevant_chunks_batch(
+                    queries, n_docs * self.candidates_factor
+                )
+                for retriever in self.retrievers
+            )
+        )
+        return [
+            self._fuse(rankings, n_docs) for rankings in zip(*batches)
+        ]
+
+    def _fuse(
+        self, rankings: Sequence[list[RetrievedChunk]], n_docs: int
+    ) -> list[RetrievedChunk]:
+        """
+        Объединение выдач по RRF.
+
+        Фрагменты сопоставляются по идентификатору, а без него - по хэшу
+        текста. Скор итогового фрагмента заменяется скором RRF.
+        """
+        chunks = {}
+        scores = {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking, start=1):
+                key = (
+                    chunk.chunk_id
+                    if chunk.chunk_id is not None
+                    else chunk_digest(chunk.content)
+                )
+                chunks.setdefault(key, chunk)
+                scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank)
+        top = sorted(scores, key=scores.get, reverse=True)[:n_docs]
+        return [
+            chunks[key].model_copy(update={"score": scores[key]})
+            for key in top
+        ]
+
+    def get_index_version(self) -> Hashable:
+        """Версии индексов всех ретриверов."""
+        return tuple(
+            retriever.get_index_version() for retriever in self.retrievers
+        )
+
+    def get_stats(self) -> dict:
+        """Статистика ретриверов."""
+        return {
+            "rrf_k": self.rrf_k,
+            "retrievers": [
+                {
+                    "type": type(retriever).__name__,
+                    **retriever.get_stats(),
+                }
+                for retriever in self.retrievers
+            ],
+        }
+
+
+def message_row(chat_id: int, message_data: MessageData) -> dict:
+    """
+    Значения столбцов таблицы сообщений для вставки сообщения.
+
+    Ответ RAG-системы хранится ссылками на фрагменты из chunk_rows.
+    """
+    row = {
+        "chat_id": chat_id,
+        "n_tokens": estimate_tokens(message_data.content),
+        "role": message_data.role,
+        "content": message_data.content,
+        "chunk_refs": None,
+    }
+    if isinstance(message_data, RetrievedContext):
+        row["content"] = ""
+        row["chunk_refs"] = [
+            [chunk_digest(chunk.content), chunk.score]
+            for chunk in message_data.chunks
+        ]
+    return row
+
+
+async def bump_chat_versions(
+    session: AsyncSession, chat_ids: Iterable[int]
+) -> None:
+    """Увеличение версий чатов в транзакции сессии."""
+    chat_ids = set(chat_ids)
+    if chat_ids:
+        await session.execute(
+            update(ChatORM)
+            .where(ChatORM.id.in_(chat_ids))
+            .values(version=ChatORM.version + 1)
+        )
+
+
+async def bump_inserted_chat_versions(
+    session: AsyncSession, rows: dict[type, list[dict]]
+) -> None:
+    """Увеличение версий чатов записанных буфером сообщений."""
+    await bump_chat_versions(
+        session, (row["chat_id"] for row in rows.get(MessageORM, ()))
+    )
+
+
+def chunk_rows(messages: list[MessageData]) -> list[dict]:
+    """Значения столбцов таблицы фрагментов для ответов RAG-системы."""
+    rows = {}
+    for message_data in messages:
+        if isinstance(message_data, RetrievedContext):
+            for chunk in message_data.chunks:
+                digest = chunk_digest(chunk.content)
+                rows[digest] = {"digest": digest, "content": chunk.content}
+    return list(rows.values())
+
+
+def chunk_digest(content: str) -> str:
+    """
+    Ключ текста фрагмента в таблице фрагментов.
+
+    Идентификаторы фрагментов индекса назначаются заново при повторной
+    загрузке корпуса, поэтому сообщения ссылаются на хэш текста.
+    """
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _load_archive(data: bytes) -> list[dict]:
+    """Значения столбцов сообщений из сжатого архива чата."""
+    rows = [
+        dict(zip(ARCHIVE_FIELDS, row))
+        for row in orjson.loads(zlib.decompress(data))
+    ]
+    for row in rows:
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return rows
+
+
+def _unpack_archive(row: Sequence, data: bytes) -> list[list]:
+    """
+    Строки выгрузки сообщений из архива чата.
+
+    row - строка архива в запросе выгрузки, первое поле которой -
+    идентификатор чата. Поля строк совпадают с MESSAGE_EXPORT_FIELDS и
+    ссылками на фрагменты в конце.
+    """
+    return [
+        [
+            row[0],
+            *(message[field] for field in MESSAGE_EXPORT_FIELDS[1:]),
+            message["chunk_refs"],
+        ]
+        for message in _load_archive(data)
+    ]
+
+
+def _document_to_chunk(document: Document, score: float) -> RetrievedChunk:
+    """Преобразование документа langchain в найденный фрагмент."""
+    return RetrievedChunk(
+        chunk_id=document.metadata.get("chunk_id"),
+        source=document.metadata.get("source"),
+        start_index=document.metadata.get("start_index"),
+        content=document.page_content,
+        score=float(score),
+    )
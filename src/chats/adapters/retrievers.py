@@ -0,0 +1,127 @@
+"""Модуль создания репозиториев RAG-системы по конфигурации."""
+
+import os
+
+import numpy as np
+
+from base.config import (
+    get_bm25_delta_log_path,
+    get_bm25_max_segments,
+    get_bm25_max_tombstone_ratio,
+    get_bm25_mmap_index_path,
+    get_bm25_retriever_path,
+    get_embedding_cache_size,
+    get_embedding_chunk_ids_path,
+    get_embedding_max_batch_size,
+    get_embedding_max_wait_ms,
+    get_embedding_model_path,
+    get_embedding_threads,
+    get_embeddings_path,
+    get_faiss_index_path,
+    get_index_refresh_interval,
+    get_retrieval_candidates_factor,
+    get_rrf_k,
+    is_embedding_model_quantized,
+    RetrieverTypeChoice,
+)
+from base.utils import load_retriever
+from .dense_indexes import DenseIndex, DenseIndexParams
+from .embeddings import EmbeddingService, MiniLMEncoder
+from .indexes import (
+    MmapBM25Segment,
+    SegmentedBM25Index,
+    SegmentedBM25IndexManager,
+)
+from .repositories import (
+    BM25RetrieverRepository,
+    DenseRetrieverRepository,
+    HybridRetrieverRepository,
+    MmapBM25RetrieverRepository,
+    RAGAbstractsRepository,
+    SegmentedBM25RetrieverRepository,
+)
+
+
+def create_bm25_repository() -> RAGAbstractsRepository:
+    """
+    Создание репозитория BM25 без обновлений индекса.
+
+    По умолчанию поиск идет по каталогу индекса в mmap-формате, который
+    строит загрузка корпуса: воркеры разделяют одну копию индекса, а
+    скоры совпадают с pickle. Pickle BM25Retriever, копия которого
+    загружается в память каждого воркера, читается, только если
+    каталога нет, например для индексов, построенных до его появления.
+    """
+    mmap_path = get_bm25_mmap_index_path()
+    if os.path.isdir(mmap_path):
+        return MmapBM25RetrieverRepository(
+            SegmentedBM25Index.from_directory(mmap_path)
+        )
+    return BM25RetrieverRepository(load_retriever(get_bm25_retriever_path()))
+
+
+def create_segmented_bm25_repository() -> SegmentedBM25RetrieverRepository:
+    """Создание репозитория BM25 индекса с инкрементальными обновлениями."""
+    # Каталог с индексом в mmap-формате разделяется всеми воркерами,
+    # pickle загружается в память каждого из них, пока каталога нет.
+    manager = SegmentedBM25IndexManager(
+        base_path=get_bm25_mmap_index_path(),
+        log_dir=get_bm25_delta_log_path(),
+        max_segments=get_bm25_max_segments(),
+        max_tombstone_ratio=get_bm25_max_tombstone_ratio(),
+        pickle_path=get_bm25_retriever_path(),
+    )
+    manager.start(get_index_refresh_interval())
+    return SegmentedBM25RetrieverRepository(manager)
+
+
+def create_dense_repository() -> DenseRetrieverRepository:
+    """Создание репозитория векторного поиска."""
+    chunk_ids_path = get_embedding_chunk_ids_path()
+    return DenseRetrieverRepository(
+        embedding_service=EmbeddingService(
+            MiniLMEncoder(
+                get_embedding_model_path(),
+                quantized=is_embedding_model_quantized(),
+                n_threads=get_embedding_threads(),
+            ),
+            max_batch_size=get_embedding_max_batch_size(),
+            max_wait_ms=get_embedding_max_wait_ms(),
+            cache_size=get_embedding_cache_size(),
+        ),
+        dense_index=DenseIndex.load(
+            get_faiss_index_path(),
+            np.load(get_embeddings_path(), mmap_mode="r"),
+            DenseIndexParams.from_config(),
+            chunk_ids=(
+                np.load(chunk_ids_path, mmap_mode="r")
+                if os.path.exists(chunk_ids_path)
+                else None
+            ),
+        ),
+        chunk_store=MmapBM25Segment(get_bm25_mmap_index_path()),
+    )
+
+
+def create_hybrid_repository() -> HybridRetrieverRepository:
+    """Создание репозитория гибридного поиска BM25 и векторного."""
+    return HybridRetrieverRepository(
+        [create_segmented_bm25_repository(), create_dense_repository()],
+        candidates_factor=get_retrieval_candidates_factor(),
+        rrf_k=get_rrf_k(),
+    )
+
+
+def create_rag_repository(
+    retriever_type: RetrieverTypeChoice,
+) -> RAGAbstractsRepository:
+    """Создание репозитория RAG-системы по типу ретривера."""
+    match retriever_type:
+        case RetrieverTypeChoice.SEGMENTED_BM25:
+            return create_segmented_bm25_repository()
+        case RetrieverTypeChoice.DENSE:
+            return create_dense_repository()
+        case RetrieverTypeChoice.HYBRID:
+            return create_hybrid_repository()
+        case _:
+            return create_bm25_repository()
@@ -11,6 +11,13 @@ class ChatType(BaseModel):
     type: ChatTypeChoice
 
 
+class ChatMetadata(ChatType):
+    """Модель владельца и типа чата."""
+
+    user_id: int
+    archived: bool = False
+
+
 class Chat(ChatType):
     """Модель чата."""
 
@@ -26,6 +33,13 @@ class MessageData(BaseModel):
     content: str
 
 
+class HistoryTail(BaseModel):
+    """Модель последних сообщений чата."""
+
+    messages: list[MessageData]
+    n_skipped_tokens: int
+
+
 class MessageMetadata(BaseModel):
     """Модель метаданных сообщения."""
 
@@ -38,9 +52,36 @@ class Message(MessageData, MessageMetadata):
     """Модель сообщения."""
 
 
+class RetrievedChunk(BaseModel):
+    """Модель фрагмента документа, найденного RAG-системой."""
+
+    chunk_id: int | None = None
+    source: str | None = None
+    start_index: int | None = None
+    content: str
+    score: float
+
+
+class RetrievedContext(MessageData):
+    """
+    Модель ответа RAG-системы.
+
+    Текст ответа составлен из найденных фрагментов, поэтому сообщение
+    хранится ссылками на них.
+    """
+
+    chunks: list[RetrievedChunk]
+
+
 class MessageRequest(BaseModel):
     message: str
 
 
+class BatchMessageRequest(BaseModel):
+    """Модель пакета вопросов к чату."""
+
+    messages: list[str]
+
+
 class MessageResponse(BaseModel):
     content: str
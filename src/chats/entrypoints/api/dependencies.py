@@ -3,50 +3,199 @@
 from typing import Annotated
 
 from fastapi import Depends
-from langchain_community.retrievers import BM25Retriever
 
 from base.config import (
-    get_bm25_retriever_path,
-    get_llm_url,
-    get_max_tokens_for_model, get_n_relevant_docs,
+    get_chat_purge_batch_size,
+    get_duplicate_similarity_threshold,
+    get_history_cache_size,
+    get_history_trim_step,
+    get_hybrid_relevance_score_gap,
+    get_llm_backend_urls,
+    get_llm_circuit_failure_threshold,
+    get_llm_circuit_open_seconds,
+    get_llm_health_check_path,
+    get_llm_hedge_after_ms,
+    get_llm_max_concurrency,
+    get_llm_max_in_flight_per_slot,
+    get_llm_max_queue_wait,
+    get_llm_slots_per_backend,
+    get_llm_system_prompt,
+    get_max_context_tokens,
+    get_max_queued_requests_per_user,
+    get_max_tokens_for_model,
+    get_mmr_lambda,
+    get_n_relevant_docs,
+    get_rag_max_concurrency,
+    get_rag_max_queue_wait,
+    get_relevance_score_gap,
+    get_retrieval_candidates_factor,
+    get_retriever_type,
+    RetrieverTypeChoice,
 )
-from base.dependencies import SessionFactoryDependency
-from base.utils import load_retriever
+from base.dependencies import (
+    get_session_factory,
+    metadata_cache,
+    MetadataCacheDependency,
+    ReadSessionFactoryDependency,
+    SessionFactoryDependency,
+    WriteBufferDependency,
+    WriteTrackerDependency,
+)
+from base.utils import SingleFlight
+from chats.adapters.history_cache import ChatHistoryTailCache
+from chats.adapters.llm_pool import LLMBackendPool
+from chats.adapters.llm_routing import ChatAffinityRouter
+from chats.adapters.repositories import RAGAbstractsRepository
+from chats.adapters.retrievers import create_rag_repository
+from chats.services.compression import ContextCompressor
+from chats.services.purge import ChatPurger
+from chats.services.scheduler import FairScheduler, SchedulerLaneChoice
 from chats.services.services import ChatService, LLMService
 from chats.services.unit_of_work import ChatSqlAlchemyUnitOfWork
 
 
+history_cache = (
+    ChatHistoryTailCache(
+        get_history_cache_size(),
+        get_max_tokens_for_model(),
+        get_history_trim_step(),
+    )
+    if get_history_cache_size()
+    else None
+)
+
+chat_purger = (
+    ChatPurger(
+        ChatSqlAlchemyUnitOfWork(
+            get_session_factory(), metadata_cache=metadata_cache
+        ),
+        batch_size=get_chat_purge_batch_size(),
+    )
+    if get_chat_purge_batch_size()
+    else None
+)
+
+
 def get_chat_service(
     session_factory: SessionFactoryDependency,
+    read_session_factory: ReadSessionFactoryDependency,
+    write_tracker: WriteTrackerDependency,
+    write_buffer: WriteBufferDependency,
+    metadata_cache: MetadataCacheDependency,
 ) -> ChatService:
     """Получение сервиса чатов."""
-    return ChatService(uow=ChatSqlAlchemyUnitOfWork(session_factory))
+    return ChatService(
+        uow=ChatSqlAlchemyUnitOfWork(
+            session_factory,
+            read_session_factory,
+            write_tracker,
+            metadata_cache,
+        ),
+        history_cache=history_cache,
+        write_buffer=write_buffer,
+        purge_deleted=chat_purger is not None,
+        metadata_cache=metadata_cache,
+    )
 
 
 ChatServiceDependency = Annotated[ChatService, Depends(get_chat_service)]
 
 
-bm25_retriever = load_retriever(get_bm25_retriever_path())
+rag_repository = create_rag_repository(get_retriever_type())
 
 
-def get_bm25_retriever() -> BM25Retriever:
-    """Получение ретривера BM25."""
-    return bm25_retriever
+def get_rag_repository() -> RAGAbstractsRepository:
+    """Получение репозитория RAG-системы."""
+    return rag_repository
 
 
-def get_llm_service_with_bm25(
-    llama_url: Annotated[str, Depends(get_llm_url)],
-    store: Annotated[BM25Retriever, Depends(get_bm25_retriever)],
-) -> LLMService:
-    """Получение сервиса большой языковой модели с BM25 в качестве RAG."""
+RAGRepositoryDependency = Annotated[
+    RAGAbstractsRepository, Depends(get_rag_repository)
+]
+
+
+retrieval_flight = SingleFlight()
+
+
+def get_retrieval_flight() -> SingleFlight:
+    """Получение объединителя одновременных одинаковых запросов к RAG."""
+    return retrieval_flight
+
+
+RetrievalFlightDependency = Annotated[
+    SingleFlight, Depends(get_retrieval_flight)
+]
+
+
+llm_router = ChatAffinityRouter(
+    base_urls=get_llm_backend_urls(),
+    slots_per_backend=get_llm_slots_per_backend(),
+    max_in_flight=get_llm_max_in_flight_per_slot(),
+)
+llm_pool = LLMBackendPool(
+    router=llm_router,
+    failure_threshold=get_llm_circuit_failure_threshold(),
+    open_seconds=get_llm_circuit_open_seconds(),
+    hedge_after_ms=get_llm_hedge_after_ms(),
+    health_check_path=get_llm_health_check_path(),
+)
+
+
+def get_llm_pool() -> LLMBackendPool:
+    """Получение пула реплик большой языковой модели."""
+    return llm_pool
+
+
+LLMPoolDependency = Annotated[LLMBackendPool, Depends(get_llm_pool)]
+
+
+def get_llm_service(rag: RAGRepositoryDependency) -> LLMService:
+    """Получение сервиса большой языковой модели с RAG-системой."""
     return LLMService(
-        llama_url=llama_url,
-        store=store,
+        llm_pool=llm_pool,
+        rag=rag,
         max_tokens=get_max_tokens_for_model(),
         n_relevant_docs=get_n_relevant_docs(),
+        compressor=ContextCompressor(
+            max_tokens=get_max_context_tokens(),
+            mmr_lambda=get_mmr_lambda(),
+            duplicate_threshold=get_duplicate_similarity_threshold(),
+            score_gap=(
+                get_hybrid_relevance_score_gap()
+                if get_retriever_type() == RetrieverTypeChoice.HYBRID
+                else get_relevance_score_gap()
+            ),
+        ),
+        n_candidate_docs=(
+            get_n_relevant_docs() * get_retrieval_candidates_factor()
+        ),
+        history_trim_step=get_history_trim_step(),
+        system_prompt=get_llm_system_prompt(),
+        retrieval_flight=retrieval_flight,
     )
 
 
-LLMServiceBM25Dependency = Annotated[
-    LLMService, Depends(get_llm_service_with_bm25)
-]
+LLMServiceDependency = Annotated[LLMService, Depends(get_llm_service)]
+
+
+scheduler = FairScheduler(
+    limits={
+        SchedulerLaneChoice.LLM: (
+            get_llm_max_concurrency(),
+            get_llm_max_queue_wait(),
+        ),
+        SchedulerLaneChoice.RAG: (
+            get_rag_max_concurrency(),
+            get_rag_max_queue_wait(),
+        ),
+    },
+    max_queued_per_user=get_max_queued_requests_per_user(),
+)
+
+
+def get_scheduler() -> FairScheduler:
+    """Получение планировщика запросов к LLM и RAG-системе."""
+    return scheduler
+
+
+SchedulerDependency = Annotated[FairScheduler, Depends(get_scheduler)]
@@ -1,11 +1,26 @@
 """Эндпойнты модуля чата и сообщений."""
 
+import asyncio
 import logging
+import time
+from typing import Annotated, Sequence
 
 from fastapi import (
     APIRouter,
+    Header,
+    Request,
 )
+from fastapi.responses import Response, StreamingResponse
 
+from base.config import (
+    BillingPolicyChoice,
+    ExportFormatChoice,
+    get_billing_policy,
+    get_disconnect_poll_interval,
+    get_export_batch_size,
+    get_llm_request_timeout,
+    get_max_batch_messages,
+)
 from base.dependencies import (
     TokenDependency,
     UserServiceDependency,
@@ -14,34 +29,99 @@ from base.entities import TransactionType
 from base.exceptions import (
     EmptyMessageException,
     InsufficientFundsException,
+    InvalidBatchException,
+)
+from base.utils import (
+    cancel_on_disconnect,
+    dump_json_rows,
+    etag_matches,
+    EXPORT_MEDIA_TYPES,
+    JSON_MEDIA_TYPE,
+    make_etag,
+    prefetch,
+    serialize_export,
+)
+from chats.adapters.repositories import (
+    CHAT_FIELDS,
+    MESSAGE_EXPORT_FIELDS,
+    MESSAGE_FIELDS,
 )
 from chats.domain.models import (
+    BatchMessageRequest,
     Chat,
     ChatType,
     ChatTypeChoice,
     Message,
     MessageData,
-    MessageResponse,
     MessageRequest,
+    MessageResponse,
 )
 from chats.entrypoints.api.dependencies import (
     ChatServiceDependency,
-    LLMServiceBM25Dependency,
+    LLMPoolDependency,
+    LLMServiceDependency,
+    RAGRepositoryDependency,
+    RetrievalFlightDependency,
+    SchedulerDependency,
 )
+from chats.services.scheduler import SchedulerLaneChoice
 from users.domain.models import TransactionData
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Клиент может хранить ответ, но должен сверять его версию при каждом
+# запросе.
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def _not_modified(etag: str) -> Response:
+    """Ответ 304 на условный запрос с совпавшей версией."""
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL},
+    )
+
+
+def _rows_response(
+    rows: Sequence[Sequence], fields: list[str], etag: str
+) -> Response:
+    """
+    Ответ со строками БД, сериализованными в JSON напрямую.
+
+    Строки не превращаются в модели ответа и не проверяются ими повторно,
+    а response_model эндпойнта остается для документации схемы.
+    """
+    return Response(
+        dump_json_rows(rows, fields),
+        media_type=JSON_MEDIA_TYPE,
+        headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL},
+    )
+
 
 @router.get("/", response_model=list[Chat], status_code=200)
 async def get_chat_list(
     service: ChatServiceDependency,
     data_from_token: TokenDependency,
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    """Получение списка чатов пользователя."""
-    return await service.get_chats(data_from_token.id)
+    """
+    Получение списка чатов пользователя.
+
+    Ответ помечается ETag по токену версии списка. При совпадении
+    If-None-Match возвращается 304 без загрузки чатов.
+    """
+    etag = make_etag(
+        "chats",
+        data_from_token.id,
+        *await service.get_chats_version(data_from_token.id),
+    )
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return _rows_response(
+        await service.get_chat_rows(data_from_token.id), CHAT_FIELDS, etag
+    )
 
 
 @router.post("/", response_model=Chat, status_code=201)
@@ -54,58 +134,257 @@ async def create_chat(
     return await service.add_chat(data_from_token.id, chat_type)
 
 
+@router.get("/export/", status_code=200)
+async def export_messages(
+    service: ChatServiceDependency,
+    data_from_token: TokenDependency,
+    export_format: ExportFormatChoice = ExportFormatChoice.NDJSON,
+    chat_id: int | None = None,
+) -> StreamingResponse:
+    """
+    Потоковая выгрузка сообщений всех чатов пользователя или одного чата.
+
+    Строки отправляются клиенту по мере чтения из БД.
+    """
+    partitions = await prefetch(
+        service.stream_messages(
+            data_from_token.id, chat_id, get_export_batch_size()
+        )
+    )
+    return StreamingResponse(
+        serialize_export(partitions, MESSAGE_EXPORT_FIELDS, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=messages.{export_format.value}"
+            )
+        },
+    )
+
+
 @router.get("/{chat_id}/", response_model=list[Message], status_code=200)
 async def get_messages(
     chat_id: int,
     service: ChatServiceDependency,
     data_from_token: TokenDependency,
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    """Получение сообщений из чата."""
-    return await service.get_messages(chat_id, data_from_token.id)
+    """
+    Получение сообщений из чата.
+
+    Ответ помечается ETag по токену версии чата. При совпадении
+    If-None-Match возвращается 304 без загрузки сообщений.
+    """
+    etag = make_etag(
+        "chat",
+        chat_id,
+        *await service.get_chat_version(chat_id, data_from_token.id),
+    )
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return _rows_response(
+        await service.get_message_rows(chat_id, data_from_token.id),
+        MESSAGE_FIELDS,
+        etag,
+    )
+
+
+@router.get("/retrieval/stats/", status_code=200)
+async def get_retrieval_stats(
+    rag: RAGRepositoryDependency,
+    retrieval_flight: RetrievalFlightDependency,
+    data_from_token: TokenDependency,
+) -> dict:
+    """Получение статистики работы RAG-системы."""
+    return {**rag.get_stats(), "coalescing": retrieval_flight.get_stats()}
+
+
+@router.get("/llm/stats/", status_code=200)
+async def get_llm_stats(
+    llm_pool: LLMPoolDependency,
+    data_from_token: TokenDependency,
+) -> dict:
+    """Получение статистики реплик большой языковой модели."""
+    return llm_pool.get_stats()
+
+
+@router.get("/scheduler/stats/", status_code=200)
+async def get_scheduler_stats(
+    scheduler: SchedulerDependency,
+    data_from_token: TokenDependency,
+) -> dict:
+    """Получение глубины очередей и времени ожидания планировщика."""
+    return scheduler.get_stats()
 
 
 @router.post("/chat/{chat_id}/", response_model=MessageResponse)
 async def chat(
     chat_id: int,
     request: MessageRequest,
+    http_request: Request,
     chat_service: ChatServiceDependency,
-    llm_service_with_bm25: LLMServiceBM25Dependency,
+    llm_service: LLMServiceDependency,
     data_from_token: TokenDependency,
     user_service: UserServiceDependency,
+    scheduler: SchedulerDependency,
 ):
-    """Эндпойнт чата."""
+    """
+    Эндпойнт чата.
+
+    Запрос ждет допуска планировщика до записи сообщения и списания
+    средств, поэтому отклоненный из-за перегрузки запрос не оплачивается.
+    Ответ ограничен сроком LLM_REQUEST_TIMEOUT от поступления запроса и
+    отменяется, если клиент отключился. Средства за неполученный ответ
+    возвращаются или не списываются в зависимости от BILLING_POLICY.
+    """
+    deadline = time.monotonic() + get_llm_request_timeout()
     if not request.message:
         raise EmptyMessageException("Сообщение не может быть пустым.")
     user_id_from_token = data_from_token.id
     balance = await user_service.get_user_balance(user_id_from_token)
     if balance < 10:
         raise InsufficientFundsException("Недостаточно средств на балансе.")
-    chat_info = await chat_service.get_chat(chat_id)
-    await chat_service.add_message(
-        chat_id,
-        MessageData(
-            role="user",
-            content=request.message,
-        ),
-        user_id_from_token,
+    chat_info = await chat_service.get_chat_metadata(
+        chat_id, user_id_from_token
     )
-    await user_service.add_transaction_for_user(
-        user_id_from_token,
-        TransactionData(amount=10, transaction_type=TransactionType.EXPENSE),
+    lane = (
+        SchedulerLaneChoice.LLM
+        if chat_info.type == ChatTypeChoice.WITH_LLM
+        else SchedulerLaneChoice.RAG
     )
-    llm_service = llm_service_with_bm25
-    if chat_info.type == ChatTypeChoice.WITH_LLM:
-        model_response = await llm_service.get_model_answer(
-            request.message,
-            await chat_service.get_messages_without_meta(
-                chat_id, user_id_from_token
+
+    async def get_answer() -> MessageData:
+        if lane == SchedulerLaneChoice.LLM:
+            return await llm_service.get_model_answer(
+                request.message,
+                await chat_service.get_history_tail(
+                    chat_id,
+                    user_id_from_token,
+                    llm_service.max_tokens,
+                    llm_service.history_trim_step,
+                ),
+                chat_id,
+                deadline,
+            )
+        return await llm_service.get_only_rag_answer(request.message)
+
+    prepaid = get_billing_policy() == BillingPolicyChoice.REFUND
+    async with scheduler.admit(lane, user_id_from_token):
+        await chat_service.add_message(
+            chat_id,
+            MessageData(
+                role="user",
+                content=request.message,
             ),
+            user_id_from_token,
+        )
+        if prepaid:
+            await user_service.add_transaction_for_user(
+                user_id_from_token,
+                TransactionData(
+                    amount=10, transaction_type=TransactionType.EXPENSE
+                ),
+            )
+        try:
+            model_response = await cancel_on_disconnect(
+                get_answer(),
+                http_request.is_disconnected,
+                get_disconnect_poll_interval(),
+            )
+        except (Exception, asyncio.CancelledError):
+            if prepaid:
+                # Возврат не должен прерываться отменой самого запроса.
+                await asyncio.shield(
+                    user_service.add_transaction_for_user(
+                        user_id_from_token,
+                        TransactionData(
+                            amount=10,
+                            transaction_type=TransactionType.INCOME,
+                        ),
+                    )
+                )
+            raise
+        if not prepaid:
+            await user_service.add_transaction_for_user(
+                user_id_from_token,
+                TransactionData(
+                    amount=10, transaction_type=TransactionType.EXPENSE
+                ),
+            )
+        await chat_service.add_message(
+            chat_id,
+            model_response,
+            user_id_from_token,
         )
-    else:
-        model_response = await llm_service.get_only_rag_answer(request.message)
-    await chat_service.add_message(
-        chat_id,
-        model_response,
-        user_id_from_token,
-    )
     return MessageResponse(content=model_response.content)
+
+
+@router.post("/chat/{chat_id}/batch/", response_model=list[MessageResponse])
+async def chat_batch(
+    chat_id: int,
+    request: BatchMessageRequest,
+    http_request: Request,
+    chat_service: ChatServiceDependency,
+    llm_service: LLMServiceDependency,
+    data_from_token: TokenDependency,
+    user_service: UserServiceDependency,
+    scheduler: SchedulerDependency,
+):
+    """
+    Эндпойнт пакета вопросов к чату только с RAG.
+
+    Вопросы ищутся одним пакетом, средства списываются одной транзакцией
+    за весь пакет, а вопросы и ответы записываются одним запросом. Поиск
+    отменяется, если клиент отключился, и тогда средства не списываются.
+    """
+    if not request.messages:
+        raise InvalidBatchException("Пакет не может быть пустым.")
+    if len(request.messages) > get_max_batch_messages():
+        raise InvalidBatchException(
+            f"В пакете не может быть больше {get_max_batch_messages()} "
+            "вопросов."
+        )
+    if not all(request.messages):
+        raise EmptyMessageException("Сообщение не может быть пустым.")
+    user_id_from_token = data_from_token.id
+    price = 10 * len(request.messages)
+    balance = await user_service.get_user_balance(user_id_from_token)
+    if balance < price:
+        raise InsufficientFundsException("Недостаточно средств на балансе.")
+    chat_info = await chat_service.get_chat_metadata(
+        chat_id, user_id_from_token
+    )
+    if chat_info.type != ChatTypeChoice.ONLY_RAG:
+        raise InvalidBatchException(
+            "Пакетные вопросы доступны только в чатах без LLM."
+        )
+    async with scheduler.admit(SchedulerLaneChoice.RAG, user_id_from_token):
+        model_responses = await cancel_on_disconnect(
+            llm_service.get_only_rag_answers(request.messages),
+            http_request.is_disconnected,
+            get_disconnect_poll_interval(),
+        )
+        await chat_service.add_messages(
+            chat_id,
+            [
+                message
+                for question, model_response in zip(
+                    request.messages, model_responses
+                )
+                for message in (
+                    MessageData(role="user", content=question),
+                    model_response,
+                )
+            ],
+            user_id_from_token,
+        )
+        await user_service.add_transaction_for_user(
+            user_id_from_token,
+            TransactionData(
+                amount=price, transaction_type=TransactionType.EXPENSE
+            ),
+        )
+    return [
+        MessageResponse(content=model_response.content)
+        for model_response in model_responses
+    ]
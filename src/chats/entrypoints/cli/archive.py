@@ -0,0 +1,135 @@
+"""
+CLI обслуживания секций сообщений и архивации неактивных чатов.
+
+Команда ``partitions`` создает секции таблицы сообщений на ближайшие
+месяцы. Команда ``archive`` переносит сообщения чатов без новых
+сообщений дольше заданного числа месяцев в сжатый архив и удаляет
+опустевшие секции этих месяцев. Сообщения архивированного чата
+возвращаются в таблицу при его открытии.
+
+Команда ``convert`` однократно преобразует таблицу сообщений, созданную
+до секционирования, в секционированную: создает новую таблицу с
+секциями, копирует в нее строки и подменяет ею прежнюю. Прежняя
+таблица остается под именем messages_unpartitioned, если не указан
+``--drop-old``. На время копирования таблица сообщений заблокирована,
+поэтому команду лучше выполнять при остановленном приложении.
+
+Примеры запуска из каталога src:
+
+    python -m chats.entrypoints.cli.archive convert --drop-old
+    python -m chats.entrypoints.cli.archive partitions --months-ahead 3
+    python -m chats.entrypoints.cli.archive archive --idle-months 6
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from base.config import (
+    get_chat_archive_idle_months,
+    get_message_partitions_ahead,
+    get_postgres_url,
+)
+from base.database import create_engine
+from chats.adapters.partitions import (
+    add_months,
+    convert_messages_to_partitioned,
+    create_message_partitions,
+    drop_empty_message_partitions,
+    month_start,
+)
+from chats.services.archive import ChatArchiver
+from chats.services.unit_of_work import ChatSqlAlchemyUnitOfWork
+from users.adapters.orm import UserORM  # noqa: F401
+
+
+async def convert(args: argparse.Namespace) -> None:
+    """Преобразование таблицы сообщений в секционированную."""
+    engine = create_engine(get_postgres_url())
+    async with engine.begin() as connection:
+        copied = await connection.run_sync(
+            convert_messages_to_partitioned, args.months_ahead, args.drop_old
+        )
+    await engine.dispose()
+    if copied is None:
+        print("Таблица сообщений уже секционирована или не создана.")
+    else:
+        print(f"Таблица сообщений секционирована, строк: {copied}.")
+
+
+async def partitions(args: argparse.Namespace) -> None:
+    """Создание секций сообщений на ближайшие месяцы."""
+    engine = create_engine(get_postgres_url())
+    async with engine.begin() as connection:
+        created = await connection.run_sync(
+            create_message_partitions, args.months_ahead
+        )
+    await engine.dispose()
+    print(f"Создано секций: {len(created)}.")
+
+
+async def archive(args: argparse.Namespace) -> None:
+    """Архивация неактивных чатов и удаление опустевших секций."""
+    engine = create_engine(get_postgres_url())
+    # Граница по началу месяца позволяет удалить секции до нее целиком.
+    idle_before = add_months(month_start(datetime.now()), -args.idle_months)
+    archiver = ChatArchiver(
+        ChatSqlAlchemyUnitOfWork(
+            async_sessionmaker(
+                bind=engine, autoflush=False, autocommit=False
+            )
+        ),
+        batch_size=args.batch_size,
+    )
+    await archiver.archive_idle(
+        datetime.combine(idle_before, datetime.min.time())
+    )
+    async with engine.begin() as connection:
+        dropped = await connection.run_sync(
+            drop_empty_message_partitions, idle_before
+        )
+    await engine.dispose()
+    stats = archiver.get_stats()
+    print(
+        f"Архивировано чатов: {stats['chats']}, "
+        f"сообщений: {stats['messages']}, удалено секций: {len(dropped)}."
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(required=True)
+
+    convert_parser = subparsers.add_parser("convert")
+    convert_parser.add_argument(
+        "--months-ahead", type=int, default=get_message_partitions_ahead()
+    )
+    convert_parser.add_argument("--drop-old", action="store_true")
+    convert_parser.set_defaults(handler=convert)
+
+    partitions_parser = subparsers.add_parser("partitions")
+    partitions_parser.add_argument(
+        "--months-ahead", type=int, default=get_message_partitions_ahead()
+    )
+    partitions_parser.set_defaults(handler=partitions)
+
+    archive_parser = subparsers.add_parser("archive")
+    archive_parser.add_argument(
+        "--idle-months", type=int, default=get_chat_archive_idle_months()
+    )
+    archive_parser.add_argument("--batch-size", type=int, default=100)
+    archive_parser.set_defaults(handler=archive)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Точка входа CLI."""
+    args = parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
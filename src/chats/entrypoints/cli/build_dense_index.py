@@ -0,0 +1,96 @@
+"""
+CLI построения индекса векторного поиска по матрице эмбеддингов.
+
+Матрица эмбеддингов, сохраненная ``chats.entrypoints.cli.ingest``,
+отображается в память, и по ней строится индекс выбранного типа без
+повторной векторизации корпуса. Тип и параметры индекса по умолчанию
+берутся из переменных окружения (``DENSE_INDEX_TYPE``, ``HNSW_M``,
+``IVF_NLIST``, ``PQ_M`` и другие).
+
+Пример запуска из каталога src:
+
+    python -m chats.entrypoints.cli.build_dense_index --type hnsw
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from base.config import (
+    DenseIndexTypeChoice,
+    get_embeddings_path,
+    get_faiss_index_path,
+)
+from chats.adapters.dense_indexes import DenseIndex, DenseIndexParams
+
+
+def build_dense_index(
+    embeddings_path: str, index_path: str, params: DenseIndexParams
+) -> dict:
+    """Построение и атомарное сохранение индекса векторного поиска."""
+    started_at = time.perf_counter()
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    dense_index = DenseIndex.build(embeddings, params)
+    if dense_index.index is not None:
+        dense_index.save(f"{index_path}.tmp")
+        os.replace(f"{index_path}.tmp", index_path)
+    return {
+        "dense_index": params.model_dump(mode="json"),
+        "dense_index_path": (
+            index_path if dense_index.index is not None else None
+        ),
+        "dense_index_memory_bytes": dense_index.memory_bytes(),
+        "dense_index_build_seconds": round(
+            time.perf_counter() - started_at, 3
+        ),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    params = DenseIndexParams.from_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--embeddings-path", default=get_embeddings_path())
+    parser.add_argument("--faiss-path", default=get_faiss_index_path())
+    parser.add_argument(
+        "--type",
+        choices=[choice.value for choice in DenseIndexTypeChoice],
+        default=params.index_type.value,
+    )
+    parser.add_argument("--hnsw-m", type=int, default=params.hnsw_m)
+    parser.add_argument(
+        "--hnsw-ef-construction",
+        type=int,
+        default=params.hnsw_ef_construction,
+    )
+    parser.add_argument("--ivf-nlist", type=int, default=params.ivf_nlist)
+    parser.add_argument("--pq-m", type=int, default=params.pq_m)
+    parser.add_argument("--pq-nbits", type=int, default=params.pq_nbits)
+    args = parser.parse_args()
+    args.params = params.model_copy(
+        update={
+            "index_type": DenseIndexTypeChoice(args.type),
+            "hnsw_m": args.hnsw_m,
+            "hnsw_ef_construction": args.hnsw_ef_construction,
+            "ivf_nlist": args.ivf_nlist,
+            "pq_m": args.pq_m,
+            "pq_nbits": args.pq_nbits,
+        }
+    )
+    return args
+
+
+def main() -> None:
+    """Точка входа CLI."""
+    args = parse_args()
+    stats = build_dense_index(
+        args.embeddings_path, args.faiss_path, args.params
+    )
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
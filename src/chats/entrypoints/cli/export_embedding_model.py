@@ -0,0 +1,78 @@
+"""
+CLI экспорта модели эмбеддингов в ONNX для CPU.
+
+Веса загружаются через transformers (из каталога модели или из Hugging
+Face Hub), граф экспортируется с динамическими размерами батча и
+последовательности. С флагом ``--quantize`` дополнительно сохраняется
+int8-версия с динамической квантизацией весов.
+
+Пример запуска из каталога src:
+
+    python -m chats.entrypoints.cli.export_embedding_model --quantize
+"""
+
+import argparse
+import json
+import os
+
+from base.config import get_embedding_model_path
+from chats.adapters.embeddings import (
+    ONNX_MODEL_FILE,
+    QUANTIZED_ONNX_MODEL_FILE,
+)
+
+
+def export(model_path: str, source: str, quantize: bool) -> None:
+    """Экспорт модели в ONNX и, при необходимости, ее квантизация."""
+    import torch
+    from transformers import AutoModel
+
+    model = AutoModel.from_pretrained(source).eval()
+    sample = {
+        "input_ids": torch.ones((1, 8), dtype=torch.int64),
+        "attention_mask": torch.ones((1, 8), dtype=torch.int64),
+        "token_type_ids": torch.zeros((1, 8), dtype=torch.int64),
+    }
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in sample}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    onnx_path = os.path.join(model_path, ONNX_MODEL_FILE)
+    torch.onnx.export(
+        model,
+        (sample,),
+        onnx_path,
+        input_names=list(sample),
+        output_names=["last_hidden_state"],
+        dynamic_axes=dynamic_axes,
+        opset_version=17,
+    )
+    print(f"Модель сохранена в {onnx_path}.")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantized_path = os.path.join(model_path, QUANTIZED_ONNX_MODEL_FILE)
+        quantize_dynamic(
+            onnx_path, quantized_path, weight_type=QuantType.QInt8
+        )
+        print(f"Квантизованная модель сохранена в {quantized_path}.")
+
+
+def main() -> None:
+    """Точка входа CLI."""
+    model_path = get_embedding_model_path()
+    with open(os.path.join(model_path, "config.json")) as f:
+        default_source = json.load(f)["_name_or_path"]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--source",
+        default=default_source,
+        help="Каталог или имя модели в Hugging Face Hub с весами.",
+    )
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+    export(model_path, args.source, args.quantize)
+
+
+if __name__ == "__main__":
+    main()
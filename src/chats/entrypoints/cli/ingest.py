@@ -0,0 +1,406 @@
+"""
+CLI загрузки корпуса документов и построения поисковых индексов.
+
+Документы читаются потоково, нарезаются на фрагменты, токенизируются и
+векторизуются в пуле процессов. Фрагменты по мере обработки
+дописываются в BM25 индекс для отображения в память, а эмбеддинги -
+в файл матрицы, поэтому память загрузки не растет с размером корпуса.
+После прохода строятся индекс векторного поиска (тип задается
+``DENSE_INDEX_TYPE``), манифест со статистикой корпуса и, если не задан
+``--no-pickle``, pickle BM25Retriever (формат, который читает
+``base.utils.load_retriever``). Pickle собирается из готового индекса и
+держит в памяти весь корпус, поэтому для больших корпусов его лучше
+не строить.
+
+Векторизация выполняется ONNX моделью ``MiniLMEncoder``, той же, что
+векторизует запросы в приложении. Если модели нет, загрузка сразу
+завершается с ошибкой; модель экспортируется командой
+``python -m chats.entrypoints.cli.export_embedding_model``.
+
+Пример запуска из каталога src:
+
+    python -m chats.entrypoints.cli.ingest ../lessons --workers 8
+"""
+
+import argparse
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import pickle
+import time
+from typing import Iterator
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+import numpy as np
+
+from base.config import (
+    get_bm25_mmap_index_path,
+    get_bm25_retriever_path,
+    get_chunk_overlap,
+    get_chunk_size,
+    get_embedding_chunk_ids_path,
+    get_embedding_model_path,
+    get_embeddings_path,
+    get_faiss_index_path,
+    get_index_manifest_path,
+    get_n_relevant_docs,
+)
+from chats.adapters.dense_indexes import DenseIndexParams
+from chats.adapters.embeddings import MiniLMEncoder, ONNX_MODEL_FILE
+from chats.adapters.indexes import (
+    BM25SegmentWriter,
+    build_bm25_retriever,
+    MmapBM25Segment,
+    preprocess_text,
+)
+from chats.entrypoints.cli.build_dense_index import build_dense_index
+
+SUPPORTED_SUFFIXES = (".txt", ".md")
+EMBEDDING_BATCH_SIZE = 64
+COPY_BATCH_SIZE = 65_536
+
+ChunkData = tuple[str, int, Counter]
+
+_splitter: RecursiveCharacterTextSplitter | None = None
+_encoder: MiniLMEncoder | None = None
+
+
+def _init_worker(
+    chunk_size: int,
+    chunk_overlap: int,
+    embedding_model_path: str | None,
+) -> None:
+    """Инициализация процесса пула: сплиттер и модель эмбеддингов."""
+    global _splitter, _encoder
+    _splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True,
+    )
+    if not embedding_model_path:
+        return
+    # Каждый процесс пула считает свою часть корпуса, поэтому внутренний
+    # параллелизм модели только создает конкуренцию за ядра.
+    _encoder = MiniLMEncoder(embedding_model_path, n_threads=1)
+
+
+def _process_document(
+    path: str,
+) -> tuple[list[ChunkData], np.ndarray | None]:
+    """Нарезка, токенизация и векторизация одного документа."""
+    text = Path(path).read_text(encoding="utf-8", errors="replace")
+    chunks = [
+        (
+            chunk.page_content,
+            chunk.metadata["start_index"],
+            Counter(preprocess_text(chunk.page_content)),
+        )
+        for chunk in _splitter.create_documents([text])
+    ]
+    if _encoder is None or not chunks:
+        return chunks, None
+    texts = [chunk[0] for chunk in chunks]
+    embeddings = np.concatenate(
+        [
+            _encoder.encode(texts[start:start + EMBEDDING_BATCH_SIZE])
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        ]
+    )
+    return chunks, np.asarray(embeddings, dtype="float32")
+
+
+def check_embedding_model(embedding_model_path: str) -> None:
+    """
+    Проверка ONNX модели эмбеддингов до запуска пула.
+
+    Без проверки каждый процесс пула падал бы при инициализации, а
+    загрузка завершалась бы малопонятной ошибкой BrokenProcessPool.
+    """
+    model_file = os.path.join(embedding_model_path, ONNX_MODEL_FILE)
+    if not os.path.exists(model_file):
+        raise SystemExit(
+            f"Нет ONNX модели эмбеддингов {model_file}. Экспортируйте ее "
+            "командой python -m chats.entrypoints.cli.export_embedding_model "
+            "или запустите загрузку с --no-dense."
+        )
+
+
+def iter_source_paths(source_dir: Path) -> Iterator[Path]:
+    """Обход каталога с исходными документами в детерминированном порядке."""
+    for path in sorted(source_dir.rglob("*")):
+        if path.is_file() and path.suffix.lower() in SUPPORTED_SUFFIXES:
+            yield path
+
+
+def iter_processed_documents(
+    paths: Iterator[Path],
+    executor: ProcessPoolExecutor,
+    max_in_flight: int,
+) -> Iterator[tuple[Path, list[ChunkData], np.ndarray | None]]:
+    """
+    Обработка документов в пуле с ограничением числа задач в работе.
+
+    Порядок результатов совпадает с порядком путей, а в памяти
+    одновременно находится не более ``max_in_flight`` документов.
+    """
+    in_flight: deque[tuple[Path, Future]] = deque()
+    for path in paths:
+        in_flight.append((path, executor.submit(_process_document, str(path))))
+        if len(in_flight) >= max_in_flight:
+            done_path, future = in_flight.popleft()
+            yield done_path, *future.result()
+    while in_flight:
+        done_path, future = in_flight.popleft()
+        yield done_path, *future.result()
+
+
+def _replace_file(path: str, write) -> None:
+    """Атомарная запись файла, чтобы приложение не прочитало его частично."""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_pickle(obj, path: str) -> None:
+    """Сохранение объекта в pickle."""
+    with open(path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _write_array(array: np.ndarray, path: str) -> None:
+    """Сохранение массива numpy без добавления расширения к пути."""
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+class EmbeddingWriter:
+    """
+    Потоковая запись матрицы эмбеддингов в файл .npy.
+
+    Число строк заранее неизвестно, поэтому батчи дописываются в файл
+    сырых строк float32, а после прохода копируются блоками в матрицу,
+    выделенную ``np.lib.format.open_memmap``. В памяти одновременно
+    находится не больше одного батча или блока.
+    """
+
+    def __init__(self, path: str):
+        """Создание файла сырых строк."""
+        self.path = path
+        self._rows_path = f"{path}.rows"
+        self._rows = open(self._rows_path, "wb")
+        self.n_rows = 0
+        self.dim: int | None = None
+
+    def add(self, embeddings: np.ndarray) -> None:
+        """Дозапись батча эмбеддингов."""
+        self.dim = embeddings.shape[1]
+        self._rows.write(
+            np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()
+        )
+        self.n_rows += len(embeddings)
+
+    def close(self) -> None:
+        """Перенос строк в файл .npy и атомарная замена матрицы."""
+        self._rows.close()
+        rows = np.memmap(
+            self._rows_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(self.n_rows, self.dim),
+        )
+        tmp_path = f"{self.path}.tmp"
+        matrix = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(self.n_rows, self.dim),
+        )
+        for start in range(0, self.n_rows, COPY_BATCH_SIZE):
+            matrix[start:start + COPY_BATCH_SIZE] = rows[
+                start:start + COPY_BATCH_SIZE
+            ]
+        matrix.flush()
+        del matrix, rows
+        os.remove(self._rows_path)
+        os.replace(tmp_path, self.path)
+
+
+def ingest(
+    source_dir: Path,
+    bm25_path: str | None,
+    mmap_dir: str,
+    faiss_path: str | None,
+    embeddings_path: str,
+    embedding_chunk_ids_path: str,
+    manifest_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: int,
+    k: int,
+    embedding_model_path: str | None,
+    dense_index_params: DenseIndexParams,
+) -> dict:
+    """Построение BM25 и FAISS индексов по каталогу документов."""
+    started_at = time.perf_counter()
+    if embedding_model_path:
+        check_embedding_model(embedding_model_path)
+    segment_writer = BM25SegmentWriter(mmap_dir, preprocess_text)
+    embedding_writer = (
+        EmbeddingWriter(embeddings_path) if embedding_model_path else None
+    )
+    n_sources = 0
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            chunk_size,
+            chunk_overlap,
+            embedding_model_path,
+        ),
+    ) as executor:
+        processed = iter_processed_documents(
+            iter_source_paths(source_dir), executor, max_in_flight=workers * 4
+        )
+        for path, chunks, embeddings in processed:
+            n_sources += 1
+            source = str(path.relative_to(source_dir))
+            for content, start_index, frequencies in chunks:
+                chunk_id = segment_writer.n_docs
+                segment_writer.add(
+                    Document(
+                        id=str(chunk_id),
+                        page_content=content,
+                        metadata={
+                            "chunk_id": chunk_id,
+                            "source": source,
+                            "start_index": start_index,
+                        },
+                    ),
+                    frequencies,
+                    chunk_id,
+                )
+            if embeddings is not None:
+                embedding_writer.add(embeddings)
+
+    if not segment_writer.n_docs:
+        raise SystemExit(f"В каталоге {source_dir} нет документов.")
+
+    segment_writer.close()
+    segment = MmapBM25Segment(mmap_dir)
+    if bm25_path:
+        retriever = build_bm25_retriever(
+            list(segment.documents()), segment.term_frequencies(), k=k
+        )
+        _replace_file(bm25_path, lambda path: _write_pickle(retriever, path))
+        del retriever
+    dense_stats = {}
+    if embedding_writer is not None:
+        embedding_writer.close()
+        # Строки эмбеддингов идут в порядке фрагментов индекса BM25.
+        _replace_file(
+            embedding_chunk_ids_path,
+            lambda path: _write_array(np.asarray(segment.chunk_ids), path),
+        )
+        dense_stats = build_dense_index(
+            embeddings_path, faiss_path, dense_index_params
+        )
+
+    n_tokens = int(segment.total_length)
+    manifest = {
+        "created_at": datetime.now(tz=timezone.utc).isoformat(),
+        "source_dir": str(source_dir),
+        "n_sources": n_sources,
+        "n_chunks": segment.n_docs,
+        "n_tokens": n_tokens,
+        "avg_chunk_tokens": n_tokens / segment.n_docs,
+        "vocabulary_size": segment.meta["n_terms"],
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "bm25_path": bm25_path,
+        "bm25_mmap_dir": mmap_dir,
+        "embeddings_path": embeddings_path if dense_stats else None,
+        "embedding_chunk_ids_path": (
+            embedding_chunk_ids_path if dense_stats else None
+        ),
+        "embedding_model": embedding_model_path if dense_stats else None,
+        "embedding_dim": embedding_writer.dim if dense_stats else None,
+        **dense_stats,
+        "workers": workers,
+        "elapsed_seconds": round(time.perf_counter() - started_at, 3),
+    }
+    _replace_file(
+        manifest_path,
+        lambda path: Path(path).write_text(
+            json.dumps(manifest, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        ),
+    )
+    return manifest
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_dir", type=Path)
+    parser.add_argument("--bm25-path", default=get_bm25_retriever_path())
+    parser.add_argument("--mmap-dir", default=get_bm25_mmap_index_path())
+    parser.add_argument("--faiss-path", default=get_faiss_index_path())
+    parser.add_argument("--embeddings-path", default=get_embeddings_path())
+    parser.add_argument(
+        "--embedding-chunk-ids-path", default=get_embedding_chunk_ids_path()
+    )
+    parser.add_argument("--manifest-path", default=get_index_manifest_path())
+    parser.add_argument("--chunk-size", type=int, default=get_chunk_size())
+    parser.add_argument(
+        "--chunk-overlap", type=int, default=get_chunk_overlap()
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=get_n_relevant_docs(),
+        help="Число документов, возвращаемых BM25Retriever.",
+    )
+    parser.add_argument(
+        "--no-pickle",
+        action="store_true",
+        help="Не строить pickle BM25Retriever.",
+    )
+    parser.add_argument(
+        "--no-dense",
+        action="store_true",
+        help="Не строить индекс векторного поиска.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Точка входа CLI."""
+    args = parse_args()
+    manifest = ingest(
+        source_dir=args.source_dir,
+        bm25_path=None if args.no_pickle else args.bm25_path,
+        mmap_dir=args.mmap_dir,
+        faiss_path=None if args.no_dense else args.faiss_path,
+        embeddings_path=args.embeddings_path,
+        embedding_chunk_ids_path=args.embedding_chunk_ids_path,
+        manifest_path=args.manifest_path,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        workers=args.workers,
+        k=args.k,
+        embedding_model_path=(
+            None if args.no_dense else get_embedding_model_path()
+        ),
+        dense_index_params=DenseIndexParams.from_config(),
+    )
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+CLI инкрементального обновления BM25 индекса.
+
+Добавление и удаление документов записываются в журнал изменений, который
+приложение применяет к индексу без полной перестройки. Команда ``compact``
+сливает журнал с базовым индексом в новый каталог для отображения в
+память и, без ``--no-pickle``, в pickle BM25Retriever. Воркеры
+приложения сливают в памяти только дельта-сегменты и переходят на новый
+каталог базы после его публикации. Если корпус
+загружен с векторным поиском, ``compact`` приводит к уплотненному
+индексу и матрицу эмбеддингов с индексом векторного поиска: строки
+удаленных фрагментов отбрасываются, добавленные фрагменты векторизуются.
+Векторный поиск приложения подхватывает их после перезапуска.
+
+Примеры запуска из каталога src:
+
+    python -m chats.entrypoints.cli.update_index add ../lessons/new.md \
+        --source-root ../lessons
+    python -m chats.entrypoints.cli.update_index remove --source old.md
+    python -m chats.entrypoints.cli.update_index compact --no-pickle
+"""
+
+import argparse
+import os
+from pathlib import Path
+import pickle
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+import numpy as np
+
+from base.config import (
+    get_bm25_delta_log_path,
+    get_bm25_mmap_index_path,
+    get_bm25_retriever_path,
+    get_chunk_overlap,
+    get_chunk_size,
+    get_embedding_chunk_ids_path,
+    get_embedding_model_path,
+    get_embeddings_path,
+    get_faiss_index_path,
+    get_n_relevant_docs,
+)
+from chats.adapters.dense_indexes import DenseIndexParams
+from chats.adapters.embeddings import MiniLMEncoder
+from chats.adapters.indexes import (
+    AbstractBM25Segment,
+    build_bm25_retriever,
+    iter_delta_log_files,
+    MmapBM25Segment,
+    SegmentedBM25IndexManager,
+    write_delta_log_entry,
+    write_delta_log_state,
+)
+from chats.entrypoints.cli.build_dense_index import build_dense_index
+from chats.entrypoints.cli.ingest import (
+    check_embedding_model,
+    COPY_BATCH_SIZE,
+    EMBEDDING_BATCH_SIZE,
+)
+
+
+def add(args: argparse.Namespace) -> None:
+    """Запись новых документов в журнал изменений."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        add_start_index=True,
+    )
+    documents = []
+    for path in args.paths:
+        source = str(path.resolve().relative_to(args.source_root.resolve()))
+        chunks = splitter.create_documents(
+            [path.read_text(encoding="utf-8", errors="replace")],
+            metadatas=[{"source": source}],
+        )
+        documents.extend(chunks)
+    seq = write_delta_log_entry(args.log_dir, "add", documents)
+    print(f"Запись {seq}: добавлено фрагментов {len(documents)}.")
+
+
+def remove(args: argparse.Namespace) -> None:
+    """Запись удаления документов в журнал изменений."""
+    seq = write_delta_log_entry(
+        args.log_dir,
+        "remove",
+        {"sources": args.source, "chunk_ids": args.chunk_id},
+    )
+    print(f"Запись {seq}: удаление зарегистрировано.")
+
+
+def compact(args: argparse.Namespace) -> None:
+    """
+    Слияние журнала изменений с базовым индексом.
+
+    Живые документы потоково переписываются в новый каталог базы, в
+    метаданных которого хранится номер последней вошедшей записи
+    журнала. Состояние журнала продвигается только после публикации
+    базы: воркер, загрузивший новую базу раньше, берет номер из нее и не
+    применяет вошедшие в нее записи повторно, а старая база никогда не
+    встречается с новым номером и не теряет изменений.
+    """
+    manager = SegmentedBM25IndexManager(
+        base_path=args.mmap_dir,
+        log_dir=args.log_dir,
+        max_segments=1,
+        max_tombstone_ratio=0.0,
+        pickle_path=args.bm25_path,
+    )
+    manager.index.save(args.mmap_dir, delta_seq=manager.applied_seq)
+    del manager
+    segment = MmapBM25Segment(args.mmap_dir)
+    if not args.no_pickle:
+        retriever = build_bm25_retriever(
+            list(segment.documents()), segment.term_frequencies(), k=args.k
+        )
+        retriever.preprocess_func = segment.preprocess_func
+        with open(f"{args.bm25_path}.tmp", "wb") as f:
+            pickle.dump(retriever, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{args.bm25_path}.tmp", args.bm25_path)
+        del retriever
+    write_delta_log_state(args.log_dir, segment.delta_seq)
+    if os.path.exists(args.embeddings_path):
+        n_encoded = rebuild_dense_artifacts(args, segment)
+        print(f"Эмбеддинги обновлены: векторизовано {n_encoded}.")
+    for seq, _, path in iter_delta_log_files(args.log_dir):
+        if seq <= segment.delta_seq:
+            os.remove(path)
+    print(f"Индекс уплотнен: фрагментов {segment.n_docs}.")
+
+
+def rebuild_dense_artifacts(
+    args: argparse.Namespace, segment: AbstractBM25Segment
+) -> int:
+    """
+    Приведение эмбеддингов и индекса векторного поиска к сегменту.
+
+    Строки матрицы записываются в порядке фрагментов сегмента: векторы
+    сохранившихся фрагментов копируются блоками из старой матрицы,
+    отображенной в память, а фрагменты без вектора векторизуются.
+    Возвращается число векторизованных фрагментов.
+    """
+    embeddings = np.load(args.embeddings_path, mmap_mode="r")
+    if os.path.exists(args.embedding_chunk_ids_path):
+        old_chunk_ids = np.load(args.embedding_chunk_ids_path)
+    else:
+        old_chunk_ids = np.arange(len(embeddings), dtype=np.int64)
+    chunk_ids = np.asarray(segment.chunk_ids, dtype=np.int64)
+    order = np.argsort(old_chunk_ids, kind="stable")
+    found = np.searchsorted(old_chunk_ids[order], chunk_ids)
+    rows = order[np.minimum(found, max(len(order) - 1, 0))]
+    known = (found < len(order)) & (old_chunk_ids[rows] == chunk_ids)
+    missing = np.flatnonzero(~known)
+    if len(missing):
+        check_embedding_model(args.embedding_model_path)
+        encoder = MiniLMEncoder(args.embedding_model_path)
+
+    tmp_embeddings_path = f"{args.embeddings_path}.tmp"
+    new_embeddings = np.lib.format.open_memmap(
+        tmp_embeddings_path,
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(chunk_ids), embeddings.shape[1]),
+    )
+    for start in range(0, len(chunk_ids), COPY_BATCH_SIZE):
+        block = slice(start, start + COPY_BATCH_SIZE)
+        block_known = np.flatnonzero(known[block])
+        new_embeddings[start + block_known] = embeddings[
+            rows[block][block_known]
+        ]
+    for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+        positions = missing[start:start + EMBEDDING_BATCH_SIZE]
+        new_embeddings[positions] = encoder.encode(
+            [
+                segment.document(int(position)).page_content
+                for position in positions
+            ]
+        )
+    new_embeddings.flush()
+    del new_embeddings, embeddings
+
+    with open(f"{args.embedding_chunk_ids_path}.tmp", "wb") as f:
+        np.save(f, chunk_ids)
+    os.replace(tmp_embeddings_path, args.embeddings_path)
+    os.replace(
+        f"{args.embedding_chunk_ids_path}.tmp", args.embedding_chunk_ids_path
+    )
+    build_dense_index(
+        args.embeddings_path, args.faiss_path, DenseIndexParams.from_config()
+    )
+    return len(missing)
+
+
+def parse_args() -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bm25-path", default=get_bm25_retriever_path())
+    parser.add_argument("--mmap-dir", default=get_bm25_mmap_index_path())
+    parser.add_argument("--log-dir", default=get_bm25_delta_log_path())
+    subparsers = parser.add_subparsers(required=True)
+
+    add_parser = subparsers.add_parser("add")
+    add_parser.add_argument("paths", type=Path, nargs="+")
+    add_parser.add_argument("--source-root", type=Path, default=Path("."))
+    add_parser.add_argument(
+        "--chunk-size", type=int, default=get_chunk_size()
+    )
+    add_parser.add_argument(
+        "--chunk-overlap", type=int, default=get_chunk_overlap()
+    )
+    add_parser.set_defaults(handler=add)
+
+    remove_parser = subparsers.add_parser("remove")
+    remove_parser.add_argument("--source", action="append", default=[])
+    remove_parser.add_argument(
+        "--chunk-id", type=int, action="append", default=[]
+    )
+    remove_parser.set_defaults(handler=remove)
+
+    compact_parser = subparsers.add_parser("compact")
+    compact_parser.add_argument("--k", type=int, default=get_n_relevant_docs())
+    compact_parser.add_argument("--no-pickle", action="store_true")
+    compact_parser.add_argument(
+        "--embeddings-path", default=get_embeddings_path()
+    )
+    compact_parser.add_argument(
+        "--embedding-chunk-ids-path", default=get_embedding_chunk_ids_path()
+    )
+    compact_parser.add_argument("--faiss-path", default=get_faiss_index_path())
+    compact_parser.add_argument(
+        "--embedding-model-path", default=get_embedding_model_path()
+    )
+    compact_parser.set_defaults(handler=compact)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Точка входа CLI."""
+    args = parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Модуль архивации неактивных чатов."""
+
+from datetime import datetime
+
+from ..services.unit_of_work import ChatAbstractUnitOfWork
+
+
+class ChatArchiver:
+    """
+    Перенос сообщений неактивных чатов в сжатый архив.
+
+    Каждый чат архивируется в своей транзакции, чтобы не держать
+    блокировки таблицы сообщений на все время архивации. Сообщения
+    возвращаются из архива при открытии чата.
+    """
+
+    def __init__(self, uow: ChatAbstractUnitOfWork, batch_size: int = 100):
+        """Инициализация архивации."""
+        self._uow = uow
+        self.batch_size = batch_size
+        self._n_chats = 0
+        self._n_messages = 0
+
+    async def archive_idle(self, idle_before: datetime) -> None:
+        """
+        Архивация всех чатов без сообщений после idle_before.
+
+        Пачки чатов выбираются по возрастанию идентификатора, и каждая
+        следующая продолжает перебор после последнего чата предыдущей.
+        """
+        after_chat_id = 0
+        while True:
+            async with self._uow as uow:
+                chat_ids = await uow.chats.get_idle_chat_ids(
+                    idle_before, self.batch_size, after_chat_id
+                )
+            for chat_id in chat_ids:
+                async with self._uow as uow:
+                    n_messages = await uow.chats.archive(chat_id)
+                    await uow.commit()
+                self._n_chats += 1
+                self._n_messages += n_messages
+            if len(chat_ids) < self.batch_size:
+                return
+            after_chat_id = chat_ids[-1]
+
+    def get_stats(self) -> dict:
+        """Статистика архивации."""
+        return {"chats": self._n_chats, "messages": self._n_messages}
@@ -0,0 +1,214 @@
+"""Модуль сжатия контекста из найденных фрагментов документов."""
+
+import re
+import zlib
+
+import numpy as np
+
+from base.utils import estimate_tokens, truncate_to_tokens
+from ..domain.models import RetrievedChunk
+
+HASHING_DIM = 4_096
+TOKEN_PATTERN = re.compile(r"\w+")
+SPACES_PATTERN = re.compile(r"[^\S\n]+")
+BLANK_LINES_PATTERN = re.compile(r"\s*\n\s*")
+
+
+class ContextCompressor:
+    """
+    Отбор фрагментов для контекста запроса к LLM.
+
+    Кандидаты последовательно проходят отсечение по разрыву скоров,
+    склейку перекрывающихся фрагментов одного источника, удаление
+    почти-дубликатов, отбор MMR для разнообразия и ограничение по бюджету
+    токенов. Сходство фрагментов считается по хэшированному мешку слов,
+    поэтому этап не требует модели эмбеддингов. Нулевой score_gap
+    выключает отсечение по разрыву скоров.
+
+    Входные фрагменты не изменяются: обрезанные и склеенные фрагменты
+    создаются копиями, поэтому одну выдачу ретривера можно разделять
+    между одновременными запросами.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        mmr_lambda: float,
+        duplicate_threshold: float,
+        score_gap: float,
+    ):
+        """Инициализация компрессора."""
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.score_gap = score_gap
+
+    def compress(
+        self, chunks: list[RetrievedChunk], n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Отбор не более n_docs фрагментов в порядке использования."""
+        chunks = sorted(chunks, key=lambda chunk: -chunk.score)
+        chunks = merge_overlapping_chunks(self._cut_at_score_gap(chunks))
+        if not chunks:
+            return []
+        chunks = [
+            chunk.model_copy(
+                update={"content": normalize_whitespace(chunk.content)}
+            )
+            for chunk in chunks
+        ]
+
+        vectors = _hashed_bag_of_words([chunk.content for chunk in chunks])
+        similarity = vectors @ vectors.T
+        unique = _drop_duplicates(similarity, self.duplicate_threshold)
+        scores = np.array([chunks[i].score for i in unique], np.float32)
+        selected = _maximal_marginal_relevance(
+            scores,
+            similarity[np.ix_(unique, unique)],
+            self.mmr_lambda,
+            n_docs,
+        )
+        return self._fit_token_budget([chunks[unique[i]] for i in selected])
+
+    def _cut_at_score_gap(
+        self, chunks: list[RetrievedChunk]
+    ) -> list[RetrievedChunk]:
+        """Отсечение выдачи на первом большом разрыве скоров."""
+        if self.score_gap <= 0 or len(chunks) < 2 or chunks[0].score <= 0:
+            return chunks
+        scores = np.array([chunk.score for chunk in chunks])
+        gaps = (scores[:-1] - scores[1:]) / scores[0]
+        (cut_positions,) = np.nonzero(gaps > self.score_gap)
+        if not len(cut_positions):
+            return chunks
+        return chunks[: cut_positions[0] + 1]
+
+    def _fit_token_budget(
+        self, chunks: list[RetrievedChunk]
+    ) -> list[RetrievedChunk]:
+        """Отбор фрагментов, помещающихся в бюджет токенов."""
+        result = []
+        n_tokens = 0
+        for chunk in chunks:
+            chunk_tokens = estimate_tokens(chunk.content)
+            if n_tokens + chunk_tokens <= self.max_tokens:
+                result.append(chunk)
+                n_tokens += chunk_tokens
+            elif not result:
+                # Самый релевантный фрагмент не должен пропадать целиком
+                # из-за того, что он длиннее бюджета.
+                result.append(
+                    chunk.model_copy(
+                        update={
+                            "content": truncate_to_tokens(
+                                chunk.content, self.max_tokens
+                            )
+                        }
+                    )
+                )
+                n_tokens = self.max_tokens
+        return result
+
+
+def normalize_whitespace(text: str) -> str:
+    """Схлопывание пробелов и пустых строк, не несущих смысла для LLM."""
+    text = SPACES_PATTERN.sub(" ", text)
+    return BLANK_LINES_PATTERN.sub("\n", text).strip()
+
+
+def merge_overlapping_chunks(
+    chunks: list[RetrievedChunk],
+) -> list[RetrievedChunk]:
+    """
+    Склейка перекрывающихся фрагментов одного источника.
+
+    Соседние фрагменты при нарезке документа перекрываются, и без склейки
+    общий текст попадает в контекст дважды. Склеенный фрагмент получает
+    наибольший скор из исходных и сохраняет порядок по скору. Склеенные
+    фрагменты создаются копиями, исходные не изменяются.
+    """
+    positioned: dict[str, list[RetrievedChunk]] = {}
+    result = []
+    for chunk in chunks:
+        if chunk.source is None or chunk.start_index is None:
+            result.append(chunk)
+        else:
+            positioned.setdefault(chunk.source, []).append(chunk)
+
+    for source_chunks in positioned.values():
+        source_chunks.sort(key=lambda chunk: chunk.start_index)
+        first = source_chunks[0]
+        content, score = first.content, first.score
+        for chunk in source_chunks[1:]:
+            current_end = first.start_index + len(content)
+            if chunk.start_index > current_end:
+                result.append(
+                    first.model_copy(
+                        update={"content": content, "score": score}
+                    )
+                )
+                first = chunk
+                content, score = chunk.content, chunk.score
+                continue
+            chunk_end = chunk.start_index + len(chunk.content)
+            if chunk_end > current_end:
+                content += chunk.content[current_end - chunk.start_index:]
+            score = max(score, chunk.score)
+        result.append(
+            first.model_copy(update={"content": content, "score": score})
+        )
+    result.sort(key=lambda chunk: -chunk.score)
+    return result
+
+
+def _hashed_bag_of_words(texts: list[str]) -> np.ndarray:
+    """Нормированные векторы хэшированного мешка слов."""
+    vectors = np.zeros((len(texts), HASHING_DIM), np.float32)
+    for row, text in enumerate(texts):
+        columns = [
+            zlib.crc32(token.encode()) % HASHING_DIM
+            for token in TOKEN_PATTERN.findall(text.lower())
+        ]
+        np.add.at(vectors[row], columns, 1.0)
+    vectors /= np.maximum(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+    )
+    return vectors
+
+
+def _drop_duplicates(similarity: np.ndarray, threshold: float) -> list[int]:
+    """Индексы фрагментов без почти-дубликатов более релевантных."""
+    kept: list[int] = []
+    for i in range(len(similarity)):
+        if not kept or similarity[i, kept].max() < threshold:
+            kept.append(i)
+    return kept
+
+
+def _maximal_marginal_relevance(
+    scores: np.ndarray,
+    similarity: np.ndarray,
+    mmr_lambda: float,
+    k: int,
+) -> list[int]:
+    """
+    Отбор k фрагментов по критерию maximal marginal relevance.
+
+    Максимальное сходство с уже выбранными фрагментами обновляется одной
+    векторной операцией на шаг, поэтому отбор стоит O(k * n).
+    """
+    spread = scores.max() - scores.min()
+    if spread > 0:
+        relevance = (scores - scores.min()) / spread
+    else:
+        relevance = np.ones_like(scores)
+    max_similarity = np.zeros_like(relevance)
+    available = np.ones(len(scores), bool)
+    selected = []
+    for _ in range(min(k, len(scores))):
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        i = int(np.argmax(np.where(available, mmr, -np.inf)))
+        selected.append(i)
+        available[i] = False
+        max_similarity = np.maximum(max_similarity, similarity[i])
+    return selected
@@ -0,0 +1,85 @@
+"""Модуль фонового удаления сообщений удаленных чатов."""
+
+import asyncio
+import logging
+
+from ..services.unit_of_work import ChatAbstractUnitOfWork
+
+logger = logging.getLogger(__name__)
+
+
+class ChatPurger:
+    """
+    Фоновое удаление помеченных удаленными чатов.
+
+    Сообщения чата удаляются пачками по batch_size строк, каждая в своей
+    транзакции, чтобы удаление длинной истории не держало блокировки и
+    не писало весь журнал одной транзакцией. Сам чат удаляется после
+    своих сообщений.
+    """
+
+    def __init__(
+        self,
+        uow: ChatAbstractUnitOfWork,
+        batch_size: int,
+        max_chats: int = 100,
+    ):
+        """Инициализация удаления."""
+        self._uow = uow
+        self.batch_size = batch_size
+        self.max_chats = max_chats
+        self._purge_task: asyncio.Task | None = None
+        self._n_chats = 0
+        self._n_messages = 0
+
+    async def purge(self) -> None:
+        """Удаление помеченных чатов, найденных на момент вызова."""
+        async with self._uow as uow:
+            chat_ids = await uow.chats.get_deleted_chat_ids(self.max_chats)
+        for chat_id in chat_ids:
+            await self._purge_chat(chat_id)
+
+    async def _purge_chat(self, chat_id: int) -> None:
+        """Удаление сообщений чата пачками и затем самого чата."""
+        while True:
+            async with self._uow as uow:
+                n_deleted = await uow.chats.delete_messages_batch(
+                    chat_id, self.batch_size
+                )
+                await uow.commit()
+            self._n_messages += n_deleted
+            if n_deleted < self.batch_size:
+                break
+        async with self._uow as uow:
+            await uow.chats.delete_marked(chat_id)
+            await uow.commit()
+        self._n_chats += 1
+
+    def start(self, interval: float) -> None:
+        """Запуск периодического удаления в текущем цикле событий."""
+        if self._purge_task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                try:
+                    await self.purge()
+                except Exception:
+                    logger.exception("Ошибка фонового удаления чатов")
+                await asyncio.sleep(interval)
+
+        self._purge_task = asyncio.get_running_loop().create_task(run())
+
+    async def close(self) -> None:
+        """Остановка периодического удаления."""
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+
+    def get_stats(self) -> dict:
+        """Статистика удаления."""
+        return {
+            "batch_size": self.batch_size,
+            "chats": self._n_chats,
+            "messages": self._n_messages,
+        }
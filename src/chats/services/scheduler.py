@@ -0,0 +1,196 @@
+"""Модуль планировщика запросов к LLM и RAG-системе."""
+
+import asyncio
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from enum import Enum
+import math
+import time
+from typing import AsyncIterator
+
+from base.exceptions import (
+    ServiceOverloadedException,
+    TooManyRequestsException,
+)
+
+TIME_EWMA_ALPHA = 0.2
+USER_QUEUE_EXC_MESSAGE = "Слишком много запросов в очереди пользователя."
+OVERLOADED_EXC_MESSAGE = "Сервис перегружен, повторите запрос позже."
+
+
+class SchedulerLaneChoice(Enum):
+    """Полосы планировщика с независимыми лимитами."""
+
+    LLM = "llm"
+    RAG = "rag"
+
+
+class _Lane:
+    """Полоса с ограничением параллельности и очередями пользователей."""
+
+    def __init__(self, max_concurrency: int, max_wait: float):
+        """Инициализация пустой полосы."""
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.active = 0
+        self.n_queued = 0
+        self.queues: OrderedDict[int, deque[asyncio.Future]] = OrderedDict()
+        self.service_time: float | None = None
+        self.wait_time: float | None = None
+        self.max_wait_time = 0.0
+        self.n_admitted = 0
+        self.n_rejected = 0
+
+    def estimate_wait(self) -> float:
+        """
+        Оценка ожидания нового запроса в очереди.
+
+        Полоса освобождает слот в среднем раз в service_time /
+        max_concurrency секунд, а перед запросом стоит вся очередь.
+        """
+        if self.service_time is None:
+            return 0.0
+        return (
+            (self.n_queued + 1) * self.service_time / self.max_concurrency
+        )
+
+    def get_stats(self) -> dict:
+        """Статистика полосы."""
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.n_queued,
+            "queued_users": len(self.queues),
+            "admitted": self.n_admitted,
+            "rejected": self.n_rejected,
+            "wait_ewma_ms": _to_ms(self.wait_time),
+            "wait_max_ms": _to_ms(self.max_wait_time),
+            "service_ewma_ms": _to_ms(self.service_time),
+            "estimated_wait_ms": _to_ms(self.estimate_wait()),
+        }
+
+
+class FairScheduler:
+    """
+    Планировщик допуска запросов с честным разделением между пользователями.
+
+    Каждая полоса ограничивает число одновременно выполняемых запросов.
+    Сверх лимита запросы ждут в очередях пользователей, которые
+    обслуживаются по кругу, поэтому пользователь с пачкой запросов не
+    задерживает остальных больше чем на один свой запрос. Запрос
+    отклоняется сразу, если очередь пользователя заполнена или оценка
+    ожидания превышает допустимую для полосы.
+    """
+
+    def __init__(
+        self,
+        limits: dict[SchedulerLaneChoice, tuple[int, float]],
+        max_queued_per_user: int,
+    ):
+        """
+        Инициализация планировщика.
+
+        limits задает для каждой полосы лимит параллельности и допустимое
+        ожидание в очереди в секундах.
+        """
+        self.lanes = {
+            lane: _Lane(max_concurrency, max_wait)
+            for lane, (max_concurrency, max_wait) in limits.items()
+        }
+        self.max_queued_per_user = max_queued_per_user
+
+    @asynccontextmanager
+    async def admit(
+        self, lane: SchedulerLaneChoice, user_id: int
+    ) -> AsyncIterator[None]:
+        """Допуск запроса пользователя в полосу на время блока."""
+        state = self.lanes[lane]
+        queued_at = time.monotonic()
+        await self._acquire(state, user_id)
+        started_at = time.monotonic()
+        state.n_admitted += 1
+        state.wait_time = _ewma(state.wait_time, started_at - queued_at)
+        state.max_wait_time = max(state.max_wait_time, started_at - queued_at)
+        try:
+            yield
+        finally:
+            state.service_time = _ewma(
+                state.service_time, time.monotonic() - started_at
+            )
+            self._release(state)
+
+    async def _acquire(self, lane: _Lane, user_id: int) -> None:
+        """Занятие слота полосы или ожидание своей очереди."""
+        if lane.active < lane.max_concurrency and not lane.n_queued:
+            lane.active += 1
+            return
+        estimated_wait = lane.estimate_wait()
+        retry_after = max(math.ceil(estimated_wait), 1)
+        queue = lane.queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            lane.n_rejected += 1
+            raise TooManyRequestsException(
+                USER_QUEUE_EXC_MESSAGE, retry_after
+            )
+        if estimated_wait > lane.max_wait:
+            lane.n_rejected += 1
+            raise ServiceOverloadedException(
+                OVERLOADED_EXC_MESSAGE, retry_after
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        lane.queues.setdefault(user_id, deque()).append(future)
+        lane.n_queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self._remove(lane, user_id, future)
+            else:
+                # Слот уже передан этому запросу, но он отменен.
+                self._release(lane)
+            raise
+
+    def _release(self, lane: _Lane) -> None:
+        """Передача слота следующему по кругу пользователю."""
+        while lane.queues:
+            user_id, queue = next(iter(lane.queues.items()))
+            future = queue.popleft()
+            lane.n_queued -= 1
+            if queue:
+                lane.queues.move_to_end(user_id)
+            else:
+                del lane.queues[user_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        lane.active -= 1
+
+    @staticmethod
+    def _remove(lane: _Lane, user_id: int, future: asyncio.Future) -> None:
+        """Удаление отмененного запроса из очереди пользователя."""
+        queue = lane.queues.get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        lane.n_queued -= 1
+        if not queue:
+            del lane.queues[user_id]
+
+    def get_stats(self) -> dict:
+        """Статистика полос планировщика."""
+        return {
+            lane.value: state.get_stats() for lane, state in self.lanes.items()
+        }
+
+
+def _ewma(current: float | None, value: float) -> float:
+    """Экспоненциальное скользящее среднее времени."""
+    if current is None:
+        return value
+    return TIME_EWMA_ALPHA * value + (1 - TIME_EWMA_ALPHA) * current
+
+
+def _to_ms(seconds: float | None) -> float | None:
+    """Перевод секунд в миллисекунды для статистики."""
+    return round(seconds * 1000, 1) if seconds is not None else None
@@ -1,39 +1,117 @@
 """Бизнес-логика."""
 
-from langchain_community.retrievers import BM25Retriever
+from typing import AsyncIterator, Sequence
 
+from base.utils import SingleFlight
+from base.write_behind import WriteBehindBuffer
+from ..adapters.history_cache import ChatHistoryTailCache
+from ..adapters.llm_pool import LLMBackendPool
+from ..adapters.metadata_cache import ChatMetadataCache
+from ..adapters.orm import ChunkORM, MessageORM
 from ..adapters.repositories import (
-    BM25RetrieverRepository,
+    chunk_rows,
     LlamaCppRepository,
+    message_row,
+    RAGAbstractsRepository,
 )
-from ..domain.models import Chat, ChatType, Message, MessageData
+from ..domain.models import (
+    Chat,
+    ChatMetadata,
+    ChatType,
+    Message,
+    MessageData,
+    RetrievedChunk,
+    RetrievedContext,
+)
+from ..services.compression import ContextCompressor
 from ..services.unit_of_work import ChatAbstractUnitOfWork
 
 
 class ChatService:
     """Сервис для работы с чатами и сообщениями."""
 
-    def __init__(self, uow: ChatAbstractUnitOfWork):
-        """Инициализация сервиса."""
+    def __init__(
+        self,
+        uow: ChatAbstractUnitOfWork,
+        history_cache: ChatHistoryTailCache | None = None,
+        write_buffer: WriteBehindBuffer | None = None,
+        purge_deleted: bool = False,
+        metadata_cache: ChatMetadataCache | None = None,
+    ):
+        """
+        Инициализация сервиса.
+
+        С write_buffer сообщения записываются в БД пачками, а чтения
+        сообщений пользователя сначала записывают его строки из буфера.
+        С purge_deleted удаляемые чаты только помечаются, а их сообщения
+        удаляет фоновая задача. metadata_cache - кэш метаданных чатов
+        репозиториев, из которого удаленные чаты сбрасываются после
+        фиксации транзакции.
+        """
         self._uow = uow
+        self._history_cache = history_cache
+        self._metadata_cache = metadata_cache
+        self._write_buffer = write_buffer
+        self._purge_deleted = purge_deleted
 
-    async def get_chat(self, chat_id: int) -> Chat:
+    async def _sync_writes(self, user_id: int) -> None:
+        """Запись отложенных строк пользователя перед чтением."""
+        if self._write_buffer is not None:
+            await self._write_buffer.sync(user_id)
+
+    async def get_chat(
+        self, chat_id: int, user_id: int | None = None
+    ) -> Chat:
         """Получение чата."""
-        async with self._uow as uow:
+        async with self._uow.read_only(user_id) as uow:
             return await uow.chats.get(chat_id)
 
+    async def get_chat_metadata(
+        self, chat_id: int, user_id: int
+    ) -> ChatMetadata:
+        """
+        Получение владельца и типа чата с проверкой доступа.
+
+        Сообщения архивированного чата возвращаются из архива, поэтому
+        открытие чата этим методом делает архивацию незаметной.
+        """
+        async with self._uow.read_only(user_id) as uow:
+            metadata = await uow.chats.get_metadata(chat_id, user_id)
+        if metadata.archived:
+            await self._rehydrate(chat_id, user_id)
+        return metadata
+
+    async def _rehydrate(self, chat_id: int, user_id: int) -> None:
+        """Возврат сообщений чата из архива."""
+        async with self._uow as uow:
+            await uow.chats.rehydrate(chat_id)
+            await uow.commit()
+        self._uow.mark_write(user_id)
+        if self._history_cache is not None:
+            self._history_cache.invalidate(chat_id)
+
     async def add_chat(self, user_id: int, chat_type: ChatType) -> Chat:
         """Создание чата."""
         async with self._uow as uow:
             chat = await uow.chats.add(user_id, chat_type)
             await uow.commit()
-            return chat  # noqa R504
+        self._uow.mark_write(user_id)
+        return chat
 
     async def delete_chat(self, chat_id: int, user_id: int) -> None:
         """Удаление чата."""
+        await self._sync_writes(user_id)
         async with self._uow as uow:
-            await uow.chats.delete(chat_id, user_id)
+            if self._purge_deleted:
+                await uow.chats.mark_deleted(chat_id, user_id)
+            else:
+                await uow.chats.delete(chat_id, user_id)
             await uow.commit()
+        self._uow.mark_write(user_id)
+        if self._metadata_cache is not None:
+            self._metadata_cache.invalidate(chat_id)
+        if self._history_cache is not None:
+            self._history_cache.invalidate(chat_id)
 
     async def add_message(
         self,
@@ -42,33 +120,140 @@ class ChatService:
         user_id: int,
     ) -> None:
         """Добавление в чат сообщения."""
-        async with self._uow as uow:
-            await uow.chats.add_message_to_chat(
-                chat_id,
-                message_data,
-                user_id,
+        if self._write_buffer is not None:
+            await self._add_buffered(chat_id, [message_data], user_id)
+        else:
+            async with self._uow as uow:
+                await uow.chats.add_message_to_chat(
+                    chat_id,
+                    message_data,
+                    user_id,
+                )
+                await uow.commit()
+        self._uow.mark_write(user_id)
+        if self._history_cache is not None:
+            self._history_cache.append(chat_id, message_data)
+
+    async def add_messages(
+        self,
+        chat_id: int,
+        messages: list[MessageData],
+        user_id: int,
+    ) -> None:
+        """Добавление в чат нескольких сообщений одной транзакцией."""
+        if self._write_buffer is not None:
+            await self._add_buffered(chat_id, messages, user_id)
+        else:
+            async with self._uow as uow:
+                await uow.chats.add_messages_to_chat(
+                    chat_id, messages, user_id
+                )
+                await uow.commit()
+        self._uow.mark_write(user_id)
+        if self._history_cache is not None:
+            for message_data in messages:
+                self._history_cache.append(chat_id, message_data)
+
+    async def _add_buffered(
+        self, chat_id: int, messages: list[MessageData], user_id: int
+    ) -> None:
+        """
+        Добавление сообщений в буфер отложенной записи.
+
+        Доступ к чату проверяется сразу, чтобы ошибка доступа дошла до
+        клиента, а не до фоновой записи.
+        """
+        async with self._uow.read_only(user_id) as uow:
+            await uow.chats.check_access(chat_id, user_id)
+        rows = []
+        for message_data in messages:
+            rows.extend(
+                (ChunkORM, row, True) for row in chunk_rows([message_data])
             )
-            await uow.commit()
+            rows.append(
+                (MessageORM, message_row(chat_id, message_data), False)
+            )
+        await self._write_buffer.add_many(rows, user_id)
 
     async def get_messages(self, chat_id: int, user_id: int) -> list[Message]:
         """Получение сообщений в чате."""
-        async with self._uow as uow:
+        await self.get_chat_metadata(chat_id, user_id)
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
             return await uow.chats.get_messages_by_chat_id(chat_id, user_id)
 
     async def get_chats(self, user_id: int) -> list[Chat]:
         """Получение списка чатов пользователя."""
-        async with self._uow as uow:
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
             return await uow.chats.get_chats_by_user_id(user_id)
 
-    async def get_messages_without_meta(
+    async def get_message_rows(
         self, chat_id: int, user_id: int
-    ) -> list[MessageData]:
-        """Получение сообщений в чате."""
-        async with self._uow as uow:
-            messages = await uow.chats.get_messages_by_chat_id(
+    ) -> Sequence[Sequence]:
+        """Получение строк сообщений чата для сериализации без моделей."""
+        await self.get_chat_metadata(chat_id, user_id)
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            return await uow.chats.get_message_rows_by_chat_id(
                 chat_id, user_id
             )
-        return [MessageData(**message.model_dump()) for message in messages]
+
+    async def get_chat_rows(self, user_id: int) -> Sequence[Sequence]:
+        """Получение строк списка чатов для сериализации без моделей."""
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            return await uow.chats.get_chat_rows_by_user_id(user_id)
+
+    async def get_chats_version(self, user_id: int) -> tuple[int, ...]:
+        """Получение токена версии списка чатов пользователя."""
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            return await uow.chats.get_chats_version(user_id)
+
+    async def get_chat_version(
+        self, chat_id: int, user_id: int
+    ) -> tuple[int, ...]:
+        """Получение токена версии сообщений чата."""
+        await self.get_chat_metadata(chat_id, user_id)
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            return await uow.chats.get_chat_version(chat_id, user_id)
+
+    async def get_history_tail(
+        self, chat_id: int, user_id: int, n_tokens: int, trim_step: int
+    ) -> list[MessageData]:
+        """Получение последних сообщений чата в пределах n_tokens."""
+        if self._history_cache is not None:
+            messages = self._history_cache.get(chat_id, user_id)
+            if messages is not None:
+                return messages
+        await self.get_chat_metadata(chat_id, user_id)
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            history = await uow.chats.get_history_tail(
+                chat_id, user_id, n_tokens, trim_step
+            )
+        # По пустому хвосту нельзя восстановить число отсеченных токенов.
+        if self._history_cache is not None and history.messages:
+            self._history_cache.put(chat_id, user_id, history)
+        return history.messages
+
+    async def stream_messages(
+        self, user_id: int, chat_id: int | None, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """
+        Потоковое чтение сообщений пользователя пачками строк.
+
+        Сообщения архивированных чатов читаются из архива без возврата
+        в таблицу сообщений: выгрузка не открывает чаты.
+        """
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            async for rows in uow.chats.stream_messages(
+                user_id, chat_id, batch_size
+            ):
+                yield rows
 
 
 class LLMService:
@@ -76,24 +261,34 @@ class LLMService:
 
     def __init__(
         self,
-        llama_url: str,
-        store: BM25Retriever,
+        llm_pool: LLMBackendPool,
+        rag: RAGAbstractsRepository,
         max_tokens: int,
         n_relevant_docs: int,
+        compressor: ContextCompressor,
+        n_candidate_docs: int,
+        history_trim_step: int,
+        system_prompt: str | None = None,
+        retrieval_flight: SingleFlight | None = None,
     ):
         """Инициализация сервиса."""
-        self.model = LlamaCppRepository(llama_url)
-        self.rag = BM25RetrieverRepository(store)
+        self.model = LlamaCppRepository(llm_pool)
+        self.history_trim_step = history_trim_step
+        self.system_prompt = system_prompt
+        self.rag = rag
         self.max_tokens = max_tokens
         self.n_relevant_docs = n_relevant_docs
+        self.compressor = compressor
+        self.n_candidate_docs = max(n_candidate_docs, n_relevant_docs)
+        self.retrieval_flight = retrieval_flight
 
     async def _get_augmented_prompt_with_relevant_docs(
         self,
         query: str,
     ) -> str:
         """Получить аугментированный релевантными документами запрос."""
-        relevant_context_from_store = await self.rag.get_relevant_context(
-            query, self.n_relevant_docs
+        relevant_context_from_store = (
+            await self._get_context_from_relevant_docs(query)
         )
         return self.rag.get_augmented_prompt(
             query,
@@ -104,32 +299,103 @@ class LLMService:
         self,
         query: str,
     ) -> str:
-        """Получить контекст из релевантных документов запрос."""
-        return await self.rag.get_relevant_context(query, self.n_relevant_docs)
+        """
+        Получить сжатый контекст из релевантных документов.
+
+        Сжатие нужно только контексту LLM: оно ограничивает его бюджетом
+        токенов и убирает повторы, которые модель прочитала бы дважды.
+        """
+        chunks = self.compressor.compress(
+            await self._get_candidate_chunks(query), self.n_relevant_docs
+        )
+        return "\n".join([chunk.content for chunk in chunks])
+
+    async def _get_candidate_chunks(
+        self, query: str
+    ) -> list[RetrievedChunk]:
+        """
+        Получить фрагменты-кандидаты для запроса в порядке скора.
+
+        Одновременные одинаковые запросы к одной версии индекса выполняют
+        поиск один раз и получают общий список, поэтому вызывающие не
+        должны изменять его фрагменты.
+        """
+        if self.retrieval_flight is None:
+            return await self.rag.get_relevant_chunks(
+                query, self.n_candidate_docs
+            )
+        query = normalize_query(query)
+        return await self.retrieval_flight.do(
+            (query, self.rag.get_index_version()),
+            lambda: self.rag.get_relevant_chunks(
+                query, self.n_candidate_docs
+            ),
+        )
+
+    @staticmethod
+    def _to_rag_answer(chunks: list[RetrievedChunk]) -> RetrievedContext:
+        """Ответ RAG-системы из найденных фрагментов."""
+        return RetrievedContext(
+            role="assistant",
+            content="\n".join([chunk.content for chunk in chunks]),
+            chunks=chunks,
+        )
 
     async def get_model_answer(
         self,
         query: str,
         history: list[MessageData],
+        chat_id: int | None = None,
+        deadline: float | None = None,
     ) -> MessageData:
-        """Получить ответ модели по контексту."""
+        """
+        Получить ответ модели по контексту.
+
+        Системный промпт и история идут первыми и не меняются между
+        ходами, а найденный RAG-системой контекст передается только в
+        последнем сообщении, поэтому сервер модели заново считает лишь
+        новый ход. deadline по time.monotonic передается микросервису.
+        """
         prompt = await self._get_augmented_prompt_with_relevant_docs(query)
+        if self.system_prompt:
+            history.insert(
+                0, MessageData(role="system", content=self.system_prompt)
+            )
         history.append(
             MessageData(
                 role="user",
                 content=prompt,
             )
         )
-        context = await self.model.get_context(history, self.max_tokens)
-        return await self.model.get_answer(context)
+        context = await self.model.get_context(
+            history, self.max_tokens, deadline
+        )
+        return await self.model.get_answer(context, chat_id, deadline)
 
     async def get_only_rag_answer(
         self,
         query: str,
-    ) -> MessageData:
-        """Получить только результат работы RAG."""
-        context = await self._get_context_from_relevant_docs(query)
-        return MessageData(
-            role="assistant",
-            content=context,
+    ) -> RetrievedContext:
+        """
+        Получить только результат работы RAG.
+
+        Пользователь получает найденные фрагменты целиком, без сжатия
+        контекста для LLM.
+        """
+        chunks = await self._get_candidate_chunks(query)
+        return self._to_rag_answer(chunks[: self.n_relevant_docs])
+
+    async def get_only_rag_answers(
+        self,
+        queries: list[str],
+    ) -> list[RetrievedContext]:
+        """Получить результаты работы RAG для пакета запросов."""
+        chunk_lists = await self.rag.get_relevant_chunks_batch(
+            queries, self.n_relevant_docs
         )
+        return [self._to_rag_answer(chunks) for chunks in chunk_lists]
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация пробелов запроса, не влияющих на результат поиска."""
+    return " ".join(query.split())
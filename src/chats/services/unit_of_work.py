@@ -7,6 +7,8 @@ from sqlalchemy.ext.asyncio import (
     AsyncSession,
 )
 
+from base.database import ReadYourWritesTracker
+from ..adapters.metadata_cache import ChatMetadataCache
 from ..adapters.repositories import (
     ChatAbstractDatabaseRepository,
     ChatSQLAlchemyRepository,
@@ -37,18 +39,44 @@ class ChatAbstractUnitOfWork(abc.ABC):
     async def rollback(self):
         """Откат транзакции."""
 
+    def read_only(
+        self, user_id: int | None = None
+    ) -> "ChatAbstractUnitOfWork":
+        """Единица работы для чтения данных пользователя без записи."""
+        return self
+
+    def mark_write(self, user_id: int) -> None:
+        """Учет зафиксированной записи данных пользователя."""
+
 
 class ChatSqlAlchemyUnitOfWork(ChatAbstractUnitOfWork):
     """UoW для SQLAlchemy."""
 
-    def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
-        """Инициализация UoW."""
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        read_session_factory: async_sessionmaker[AsyncSession] | None = None,
+        write_tracker: ReadYourWritesTracker | None = None,
+        metadata_cache: ChatMetadataCache | None = None,
+    ):
+        """
+        Инициализация UoW.
+
+        read_session_factory задает сессии реплики для чтения. Чтения
+        пользователя, недавно записавшего данные, остаются в основной БД.
+        metadata_cache разделяется репозиториями всех сессий.
+        """
         self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._write_tracker = write_tracker
+        self._metadata_cache = metadata_cache
 
     async def __aenter__(self):
         """Инициализация UoW через менеджер контекста."""
         self.session = self._session_factory()
-        self._chats = ChatSQLAlchemyRepository(self.session)
+        self._chats = ChatSQLAlchemyRepository(
+            self.session, self._metadata_cache
+        )
         return await super().__aenter__()
 
     async def __aexit__(self, *args):
@@ -68,3 +96,21 @@ class ChatSqlAlchemyUnitOfWork(ChatAbstractUnitOfWork):
     async def rollback(self):
         """Откат транзакции."""
         await self.session.rollback()
+
+    def read_only(
+        self, user_id: int | None = None
+    ) -> "ChatSqlAlchemyUnitOfWork":
+        """Единица работы на сессиях реплики, если она задана и актуальна."""
+        if self._read_session_factory is None or (
+            self._write_tracker is not None
+            and self._write_tracker.must_read_primary(user_id)
+        ):
+            return self
+        return ChatSqlAlchemyUnitOfWork(
+            self._read_session_factory, metadata_cache=self._metadata_cache
+        )
+
+    def mark_write(self, user_id: int) -> None:
+        """Учет записи для чтения пользователем своих изменений."""
+        if self._write_tracker is not None:
+            self._write_tracker.mark_write(user_id)
@@ -2,21 +2,59 @@
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
-from base.config import get_allowed_hosts, get_api_prefix
-from base.dependencies import engine
+from base.config import (
+    get_allowed_hosts,
+    get_api_prefix,
+    get_chat_purge_interval,
+    get_llm_health_check_interval,
+    get_message_partitions_ahead,
+    get_query_repeat_threshold,
+    get_query_stats_mode,
+    QueryStatsModeChoice,
+)
+from base.database import LAST_WRITE_HEADER, ReadYourWritesMiddleware
+from base.dependencies import (
+    engine,
+    password_hasher,
+    read_engine,
+    write_buffer,
+    write_tracker,
+)
 from base.exception_handlers import EXCEPTION_HANDLERS
 from base.orm import Base
-
-from users.entrypoints.api.endpoints import router as users_router
+from base.query_stats import QueryStatsMiddleware
+from chats.adapters.partitions import create_message_partitions
+from chats.entrypoints.api.dependencies import chat_purger, llm_pool
 from chats.entrypoints.api.endpoints import router as chats_router
+from users.entrypoints.api.endpoints import router as users_router
 
 app = FastAPI()
 
+
 @app.on_event("startup")
 async def startup():
-    """Инициализация БД."""
+    """Инициализация БД и запуск фоновых задач."""
     async with engine.begin() as connection:
         await connection.run_sync(Base.metadata.create_all)
+        await connection.run_sync(
+            create_message_partitions, get_message_partitions_ahead()
+        )
+    llm_pool.start_health_checks(get_llm_health_check_interval())
+    if write_buffer is not None:
+        write_buffer.start()
+    if chat_purger is not None:
+        chat_purger.start(get_chat_purge_interval())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Запись отложенных строк и остановка фоновых задач."""
+    if write_buffer is not None:
+        await write_buffer.close()
+    if chat_purger is not None:
+        await chat_purger.close()
+    await llm_pool.close()
+    await password_hasher.close()
 
 
 app.add_middleware(
@@ -25,8 +63,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["content-disposition"],
+    expose_headers=["content-disposition", LAST_WRITE_HEADER.lower()],
 )
+if read_engine is not None:
+    app.add_middleware(ReadYourWritesMiddleware, tracker=write_tracker)
+if get_query_stats_mode() != QueryStatsModeChoice.OFF:
+    app.add_middleware(
+        QueryStatsMiddleware,
+        with_headers=get_query_stats_mode() == QueryStatsModeChoice.HEADERS,
+        repeat_threshold=get_query_repeat_threshold(),
+    )
 
 
 app.include_router(
@@ -0,0 +1,55 @@
+"""Общие фикстуры тестов."""
+
+import os
+
+import pytest
+from sqlalchemy import MetaData, PrimaryKeyConstraint
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+pytest_plugins = ["base.testing"]
+
+# Учет SQL-запросов подключается к приложению при его импорте, поэтому
+# режим задается до импорта тестов эндпойнтов.
+os.environ.setdefault("QUERY_STATS_MODE", "log")
+
+
+def create_tables(connection, metadata: MetaData) -> None:
+    """
+    Создание таблиц metadata в SQLite.
+
+    SQLite автоинкрементирует только первичный ключ из одного целого
+    столбца, поэтому таблицы создаются по копии схемы, в которой
+    составной ключ с автоинкрементом, например секционированной таблицы
+    сообщений, сведен к автоинкрементному столбцу.
+    """
+    copy = MetaData()
+    for table in metadata.sorted_tables:
+        table.to_metadata(copy)
+    for table in copy.tables.values():
+        columns = [
+            column
+            for column in table.primary_key.columns
+            if column.autoincrement is True
+        ]
+        if len(table.primary_key.columns) > 1 and columns:
+            for column in table.primary_key.columns:
+                column.primary_key = column in columns
+            table.append_constraint(PrimaryKeyConstraint(*columns))
+    copy.create_all(connection)
+
+
+@pytest.fixture
+def make_session_factory(tmp_path):
+    """Создание фабрики сессий SQLite во временном каталоге с таблицами."""
+
+    async def make(metadata: MetaData) -> async_sessionmaker:
+        # Без пула соединения закрываются с сессиями и не держат процесс.
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool
+        )
+        async with engine.begin() as connection:
+            await connection.run_sync(create_tables, metadata)
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+    return make
@@ -0,0 +1,200 @@
+"""Тесты сегментированного BM25 индекса."""
+
+from collections import Counter
+import pickle
+import random
+
+from langchain_core.documents import Document
+import numpy as np
+
+from chats.adapters.indexes import (
+    build_bm25_retriever,
+    MmapBM25Segment,
+    preprocess_text,
+    SegmentedBM25Index,
+    SegmentedBM25IndexManager,
+    write_delta_log_entry,
+)
+
+COMMON_WORDS = ["заказ", "товар"]
+RARE_WORDS = [f"термин{i}" for i in range(60)]
+
+
+def make_documents(n_docs: int, seed: int) -> list[Document]:
+    """Документы, в большинстве которых встречаются частые термы."""
+    rng = random.Random(seed)
+    documents = []
+    for position in range(n_docs):
+        words = rng.choices(RARE_WORDS, k=rng.randint(3, 12))
+        words += [word for word in COMMON_WORDS if rng.random() < 0.8]
+        documents.append(
+            Document(
+                page_content=" ".join(words),
+                metadata={"chunk_id": position},
+            )
+        )
+    return documents
+
+
+def build_retriever(documents: list[Document]):
+    """Pickle-совместимый BM25Retriever по документам."""
+    return build_bm25_retriever(
+        documents,
+        [Counter(preprocess_text(doc.page_content)) for doc in documents],
+        k=10,
+    )
+
+
+def okapi_scores(retriever, query: str) -> dict[int, float]:
+    """Скоры BM25Okapi всех фрагментов по их идентификаторам."""
+    scores = retriever.vectorizer.get_scores(preprocess_text(query))
+    return {
+        document.metadata["chunk_id"]: score
+        for document, score in zip(retriever.docs, scores)
+    }
+
+
+def assert_same_ranking(index, retriever, queries: list[str], k: int):
+    """
+    Совпадение выдач и скоров индекса и BM25Okapi.
+
+    Порядок фрагментов с равными скорами не сравнивается: сравниваются
+    скоры топ-k и скор BM25Okapi каждого найденного фрагмента.
+    """
+    for query in queries:
+        expected = okapi_scores(retriever, query)
+        actual = index.search_with_scores(query, k)
+        np.testing.assert_allclose(
+            [score for score, _ in actual],
+            sorted(expected.values(), reverse=True)[:k],
+            rtol=1e-5,
+        )
+        np.testing.assert_allclose(
+            [score for score, _ in actual],
+            [
+                expected[document.metadata["chunk_id"]]
+                for _, document in actual
+            ],
+            rtol=1e-5,
+        )
+
+
+QUERIES = [
+    "заказ термин1",
+    "товар заказ",
+    "термин5 термин7 термин5",
+    "товар термин42",
+]
+
+
+def test_ranking_matches_bm25_okapi():
+    """Скоры частых термов с отрицательным IDF совпадают с pickle."""
+    retriever = build_retriever(make_documents(200, seed=1))
+    index = SegmentedBM25Index.from_retriever(retriever)
+
+    assert_same_ranking(index, retriever, QUERIES, k=10)
+
+
+def test_ranking_matches_bm25_okapi_after_add():
+    """Средний IDF учитывает термы всех сегментов."""
+    documents = make_documents(200, seed=2)
+    index = SegmentedBM25Index.from_retriever(build_retriever(documents))
+    added = [
+        Document(page_content=f"новинка{i} заказ", metadata={})
+        for i in range(20)
+    ]
+    chunk_ids = index.add_documents(added)
+    for document, chunk_id in zip(added, chunk_ids):
+        document.metadata["chunk_id"] = chunk_id
+
+    assert_same_ranking(
+        index,
+        build_retriever(documents + added),
+        [*QUERIES, "новинка3 заказ"],
+        k=10,
+    )
+
+
+def make_added_documents(prefix: str, n_docs: int) -> list[Document]:
+    """Новые документы с уникальным для пакета термом."""
+    return [
+        Document(page_content=f"{prefix}{i} заказ", metadata={})
+        for i in range(n_docs)
+    ]
+
+
+def test_compact_merges_only_delta_segments(tmp_path):
+    """Уплотнение сливает дельты и оставляет базу в mmap."""
+    documents = make_documents(200, seed=4)
+    SegmentedBM25Index.from_retriever(build_retriever(documents)).save(
+        str(tmp_path / "index")
+    )
+    index = SegmentedBM25Index.from_directory(str(tmp_path / "index"))
+    base = index.snapshot.segments[0]
+    added = []
+    for prefix in ("новинка", "акция", "скидка"):
+        batch = make_added_documents(prefix, 10)
+        for document, chunk_id in zip(batch, index.add_documents(batch)):
+            document.metadata["chunk_id"] = chunk_id
+        added.extend(batch)
+    index.remove_chunks([0, added[0].metadata["chunk_id"]])
+
+    assert index.needs_compaction(max_segments=2, max_tombstone_ratio=1.0)
+    index.compact()
+
+    segments = index.snapshot.segments
+    assert segments[0] is base and isinstance(base, MmapBM25Segment)
+    assert len(segments) == 2 and segments[1].n_docs == len(added) - 1
+    assert not index.needs_compaction(max_segments=2, max_tombstone_ratio=1.0)
+    assert_same_ranking(
+        index,
+        build_retriever(documents[1:] + added[1:]),
+        [*QUERIES, "новинка3 заказ", "скидка9 заказ"],
+        k=10,
+    )
+
+
+def test_saved_base_skips_merged_delta_log(tmp_path):
+    """Воркер не применяет повторно записи журнала, вошедшие в базу."""
+    base_dir = str(tmp_path / "index")
+    log_dir = str(tmp_path / "log")
+    SegmentedBM25Index.from_retriever(
+        build_retriever(make_documents(100, seed=5))
+    ).save(base_dir)
+    write_delta_log_entry(log_dir, "add", make_added_documents("новинка", 5))
+    write_delta_log_entry(log_dir, "remove", {"chunk_ids": [1, 2]})
+
+    manager = SegmentedBM25IndexManager(base_dir, log_dir, 8, 0.2)
+    manager.index.save(base_dir, delta_seq=manager.applied_seq)
+    # Состояние журнала еще не продвинуто: номер берется из базы.
+    reloaded = SegmentedBM25IndexManager(base_dir, log_dir, 8, 0.2)
+
+    assert reloaded.applied_seq == 2
+    assert len(reloaded.index.snapshot.segments) == 1
+    assert reloaded.index.snapshot.n_docs == 103
+
+
+def test_manager_keeps_mmap_base_and_switches_to_published(tmp_path):
+    """Менеджер уплотняет дельты над общей базой и переходит на каталог."""
+    base_dir = str(tmp_path / "index")
+    pickle_path = str(tmp_path / "index.pkl")
+    log_dir = str(tmp_path / "log")
+    retriever = build_retriever(make_documents(100, seed=6))
+    with open(pickle_path, "wb") as f:
+        pickle.dump(retriever, f)
+    manager = SegmentedBM25IndexManager(
+        base_dir, log_dir, 1, 0.2, pickle_path=pickle_path
+    )
+    assert not isinstance(manager.index.snapshot.segments[0], MmapBM25Segment)
+
+    SegmentedBM25Index.from_retriever(retriever).save(base_dir)
+    for prefix in ("новинка", "акция", "скидка"):
+        write_delta_log_entry(log_dir, "add", make_added_documents(prefix, 5))
+    manager.refresh()
+    base = manager.index.snapshot.segments[0]
+    manager.refresh()
+
+    assert isinstance(base, MmapBM25Segment)
+    assert manager.index.snapshot.segments[0] is base
+    assert len(manager.index.snapshot.segments) == 2
+    assert manager.index.snapshot.n_docs == 115
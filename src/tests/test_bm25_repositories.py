@@ -0,0 +1,56 @@
+"""Тесты согласованности одиночного и пакетного поиска BM25."""
+
+import asyncio
+
+import pytest
+
+from chats.adapters.indexes import SegmentedBM25Index
+from chats.adapters.repositories import (
+    BM25RetrieverRepository,
+    MmapBM25RetrieverRepository,
+)
+from tests.test_bm25_indexes import build_retriever, make_documents
+
+QUERIES = [
+    "заказ термин1",
+    "неизвестное слово",
+    "",
+    "термин5 термин7 термин5",
+]
+
+
+def make_repositories():
+    """Репозитории pickle и mmap по одному корпусу."""
+    retriever = build_retriever(make_documents(100, seed=3))
+    return [
+        BM25RetrieverRepository(retriever),
+        MmapBM25RetrieverRepository(
+            SegmentedBM25Index.from_retriever(retriever)
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "repository", make_repositories(), ids=["pickle", "mmap"]
+)
+def test_batch_matches_single_search(repository):
+    """Пакетный поиск возвращает то же, что одиночный, и на промахах."""
+
+    async def search():
+        single = [
+            await repository.get_relevant_chunks(query, 5)
+            for query in QUERIES
+        ]
+        batch = await repository.get_relevant_chunks_batch(QUERIES, 5)
+        return single, batch
+
+    single, batch = asyncio.run(search())
+
+    assert single[1] == [] and single[2] == []
+    for single_chunks, batch_chunks in zip(single, batch):
+        assert [chunk.score for chunk in single_chunks] == pytest.approx(
+            [chunk.score for chunk in batch_chunks]
+        )
+        assert {chunk.chunk_id for chunk in single_chunks} == {
+            chunk.chunk_id for chunk in batch_chunks
+        }
@@ -0,0 +1,147 @@
+"""Тесты архивации неактивных чатов и выгрузки архивов."""
+
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from base.config import ChatTypeChoice
+from base.orm import Base
+from chats.adapters.orm import ChatORM, MessageORM
+from chats.services.archive import ChatArchiver
+from chats.services.unit_of_work import ChatSqlAlchemyUnitOfWork
+from users.adapters.orm import UserORM
+
+USER_ID = 1
+IDLE_BEFORE = datetime(2024, 6, 1)
+# Чаты 1 и 3 неактивны, чат 2 получил сообщение после IDLE_BEFORE.
+MESSAGES = [
+    (1, 1, datetime(2024, 1, 1)),
+    (2, 1, datetime(2024, 1, 2)),
+    (3, 2, datetime(2024, 1, 3)),
+    (4, 2, datetime(2024, 7, 1)),
+    (5, 3, datetime(2024, 2, 1)),
+]
+
+
+async def make_chats(make_session_factory) -> async_sessionmaker:
+    """Фабрика сессий SQLite с пользователем, тремя чатами и сообщениями."""
+    session_factory = await make_session_factory(Base.metadata)
+    async with session_factory() as session:
+        await session.execute(
+            insert(UserORM),
+            [{"id": USER_ID, "email": "user@example.com", "password": ""}],
+        )
+        await session.execute(
+            insert(ChatORM),
+            [
+                {
+                    "id": chat_id,
+                    "user_id": USER_ID,
+                    "type": list(ChatTypeChoice)[0],
+                }
+                for chat_id in (1, 2, 3)
+            ],
+        )
+        await session.execute(
+            insert(MessageORM),
+            [
+                {
+                    "id": message_id,
+                    "chat_id": chat_id,
+                    "role": "user",
+                    "content": f"сообщение {message_id}",
+                    "timestamp": timestamp,
+                }
+                for message_id, chat_id, timestamp in MESSAGES
+            ],
+        )
+        await session.commit()
+    return session_factory
+
+
+async def read_export(uow: ChatSqlAlchemyUnitOfWork) -> list[tuple]:
+    """Все строки выгрузки сообщений пользователя."""
+    async with uow:
+        return [
+            row
+            async for rows in uow.chats.stream_messages(USER_ID, None, 2)
+            for row in rows
+        ]
+
+
+def test_archive_idle_chats_in_pages(make_session_factory):
+    """Пачки неактивных чатов продолжают перебор после предыдущей."""
+
+    async def run():
+        uow = ChatSqlAlchemyUnitOfWork(
+            await make_chats(make_session_factory)
+        )
+        archiver = ChatArchiver(uow, batch_size=1)
+        await archiver.archive_idle(IDLE_BEFORE)
+        async with uow:
+            idle = await uow.chats.get_idle_chat_ids(IDLE_BEFORE, 10)
+        return archiver.get_stats(), idle
+
+    stats, idle = asyncio.run(run())
+
+    assert stats == {"chats": 2, "messages": 3}
+    assert idle == []
+
+
+def test_export_streams_archived_chats_without_rehydrating(
+    make_session_factory,
+):
+    """Выгрузка читает архив, не возвращая сообщения в таблицу."""
+
+    async def run():
+        uow = ChatSqlAlchemyUnitOfWork(
+            await make_chats(make_session_factory)
+        )
+        before = await read_export(uow)
+        await ChatArchiver(uow).archive_idle(IDLE_BEFORE)
+        after = await read_export(uow)
+        async with uow:
+            idle = await uow.chats.get_idle_chat_ids(IDLE_BEFORE, 10)
+            metadata = await uow.chats.get_metadata(1, USER_ID)
+        return before, after, idle, metadata
+
+    before, after, idle, metadata = asyncio.run(run())
+
+    assert after == before
+    assert [row[1] for row in after] == [1, 2, 3, 4, 5]
+    assert idle == []
+    assert metadata.archived
+
+
+def test_versions_change_on_archive_and_rehydrate(make_session_factory):
+    """Перенос сообщений в архив и обратно меняет токены версий."""
+
+    async def run():
+        uow = ChatSqlAlchemyUnitOfWork(
+            await make_chats(make_session_factory)
+        )
+        versions = []
+        for step in ("before", "archive", "rehydrate"):
+            if step == "archive":
+                await ChatArchiver(uow).archive_idle(IDLE_BEFORE)
+            elif step == "rehydrate":
+                async with uow:
+                    await uow.chats.rehydrate(1)
+                    await uow.commit()
+            async with uow:
+                versions.append(
+                    (
+                        await uow.chats.get_chats_version(USER_ID),
+                        await uow.chats.get_chat_version(1, USER_ID),
+                        await uow.chats.get_chat_version(2, USER_ID),
+                    )
+                )
+        return versions
+
+    before, archived, rehydrated = asyncio.run(run())
+
+    assert len({before[0], archived[0], rehydrated[0]}) == 3
+    assert len({before[1], archived[1], rehydrated[1]}) == 3
+    assert before[2] == archived[2] == rehydrated[2]
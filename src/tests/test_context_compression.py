@@ -0,0 +1,122 @@
+"""Тесты сжатия контекста и ответов только RAG."""
+
+import asyncio
+
+from base.config import get_hybrid_relevance_score_gap
+from chats.adapters.repositories import (
+    HybridRetrieverRepository,
+    RAGAbstractsRepository,
+)
+from chats.domain.models import RetrievedChunk
+from chats.services.compression import ContextCompressor
+from chats.services.services import LLMService
+
+LONG_TEXT = "возврат   товара " * 200
+
+
+class StaticRAGRepository(RAGAbstractsRepository):
+    """Репозиторий RAG с заранее заданной выдачей."""
+
+    def __init__(self, chunks: list[RetrievedChunk]):
+        """Инициализация репозитория."""
+        self.chunks = chunks
+
+    async def get_relevant_chunks(
+        self, query: str, n_docs: int
+    ) -> list[RetrievedChunk]:
+        """Первые n_docs фрагментов выдачи."""
+        return self.chunks[:n_docs]
+
+
+def make_chunks() -> list[RetrievedChunk]:
+    """Длинный фрагмент и два перекрывающихся фрагмента одного файла."""
+    return [
+        RetrievedChunk(chunk_id=0, content=LONG_TEXT, score=3.0),
+        RetrievedChunk(
+            chunk_id=1,
+            source="a.md",
+            start_index=0,
+            content="оплата  заказа",
+            score=2.5,
+        ),
+        RetrievedChunk(
+            chunk_id=2,
+            source="a.md",
+            start_index=7,
+            content="заказа картой",
+            score=2.8,
+        ),
+    ]
+
+
+def make_compressor() -> ContextCompressor:
+    """Компрессор с бюджетом меньше длинного фрагмента."""
+    return ContextCompressor(
+        max_tokens=50,
+        mmr_lambda=0.7,
+        duplicate_threshold=0.9,
+        score_gap=0.9,
+    )
+
+
+def test_compress_does_not_mutate_chunks():
+    """Обрезка, нормализация и склейка работают с копиями."""
+    chunks = make_chunks()
+    originals = [chunk.model_copy() for chunk in chunks]
+
+    compressed = make_compressor().compress(chunks, n_docs=3)
+
+    assert len(compressed[0].content) < len(LONG_TEXT)
+    assert chunks == originals
+
+
+def test_only_rag_answer_is_not_compressed():
+    """Ответ только RAG не обрезается бюджетом контекста LLM."""
+    chunks = make_chunks()
+    service = LLMService(
+        llm_pool=None,
+        rag=StaticRAGRepository(chunks),
+        max_tokens=100,
+        n_relevant_docs=2,
+        compressor=make_compressor(),
+        n_candidate_docs=3,
+        history_trim_step=100,
+    )
+
+    answer = asyncio.run(service.get_only_rag_answer("возврат"))
+    answers = asyncio.run(service.get_only_rag_answers(["возврат"]))
+
+    assert answer.chunks == chunks[:2]
+    assert answers[0].chunks == chunks[:2]
+    assert answer.content.startswith(LONG_TEXT)
+
+
+def test_hybrid_context_keeps_single_retriever_chunks():
+    """Отсечение по разрыву не отбрасывает найденные одним ретривером."""
+    shared, lexical, semantic = (
+        RetrievedChunk(chunk_id=chunk_id, content=content, score=1.0)
+        for chunk_id, content in (
+            (0, "возврат товара в течение двух недель"),
+            (1, "оплата заказа банковской картой"),
+            (2, "доставка курьером по городу"),
+        )
+    )
+    hybrid = HybridRetrieverRepository(
+        [
+            StaticRAGRepository([shared, lexical]),
+            StaticRAGRepository([shared, semantic]),
+        ],
+        candidates_factor=1,
+    )
+    compressor = ContextCompressor(
+        max_tokens=100,
+        mmr_lambda=0.7,
+        duplicate_threshold=0.9,
+        score_gap=get_hybrid_relevance_score_gap(),
+    )
+
+    chunks = asyncio.run(hybrid.get_relevant_chunks("возврат", 3))
+    compressed = compressor.compress(chunks, n_docs=3)
+
+    assert chunks[0].score > 1.9 * chunks[1].score
+    assert {chunk.chunk_id for chunk in compressed} == {0, 1, 2}
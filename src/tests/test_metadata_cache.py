@@ -0,0 +1,79 @@
+"""Тесты сброса кэша метаданных чатов."""
+
+import asyncio
+
+from base.config import ChatTypeChoice
+from chats.adapters.metadata_cache import ChatMetadataCache
+from chats.domain.models import ChatMetadata
+from chats.services.services import ChatService
+from chats.services.unit_of_work import ChatAbstractUnitOfWork
+
+CHAT_TYPE = list(ChatTypeChoice)[0]
+
+
+class DeletingRepository:
+    """Репозиторий чатов, удаление в котором ничего не делает."""
+
+    async def delete(self, chat_id: int, user_id: int | None = None) -> None:
+        """Удаление чата."""
+
+    async def mark_deleted(self, chat_id: int, user_id: int) -> None:
+        """Пометка чата удаленным."""
+
+
+class RecordingUnitOfWork(ChatAbstractUnitOfWork):
+    """Единица работы, запоминающая кэш чата в момент фиксации."""
+
+    def __init__(self, metadata_cache: ChatMetadataCache, chat_id: int):
+        """Инициализация единицы работы."""
+        self._chats = DeletingRepository()
+        self.metadata_cache = metadata_cache
+        self.chat_id = chat_id
+        self.cached_at_commit: list[ChatMetadata | None] = []
+
+    @property
+    def chats(self) -> DeletingRepository:
+        """Репозиторий чатов."""
+        return self._chats
+
+    async def commit(self):
+        """Фиксация транзакции."""
+        self.cached_at_commit.append(self.metadata_cache.get(self.chat_id))
+
+    async def rollback(self):
+        """Откат транзакции."""
+
+
+def make_cache() -> ChatMetadataCache:
+    """Кэш с двумя чатами первого пользователя и чатом второго."""
+    cache = ChatMetadataCache(max_chats=10, ttl=60)
+    for chat_id, user_id in ((1, 1), (2, 1), (3, 2)):
+        cache.put(chat_id, ChatMetadata(type=CHAT_TYPE, user_id=user_id))
+    return cache
+
+
+def test_invalidate_user_drops_only_user_chats():
+    """Сброс пользователя удаляет только его чаты."""
+    cache = make_cache()
+
+    cache.invalidate_user(1)
+
+    assert cache.get(1) is None
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
+
+
+def test_delete_chat_invalidates_after_commit():
+    """Чат сбрасывается из кэша после фиксации удаления, а не до нее."""
+    for purge_deleted in (False, True):
+        cache = make_cache()
+        uow = RecordingUnitOfWork(cache, chat_id=1)
+        service = ChatService(
+            uow, purge_deleted=purge_deleted, metadata_cache=cache
+        )
+
+        asyncio.run(service.delete_chat(1, user_id=1))
+
+        assert uow.cached_at_commit[0] is not None
+        assert cache.get(1) is None
+        assert cache.get(2) is not None
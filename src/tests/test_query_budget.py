@@ -0,0 +1,129 @@
+"""Тесты бюджета SQL-запросов эндпойнтов чата."""
+
+import asyncio
+import os
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import insert
+
+from base.config import ChatTypeChoice, get_secret_key
+from base.data_structures import JWTPayloadDTO
+from base.entities import TransactionType
+from base.orm import Base
+from base.query_stats import instrument_engine
+from base.utils import JWTHandler
+from chats.adapters.indexes import SegmentedBM25Index
+from chats.adapters.metadata_cache import ChatMetadataCache
+from chats.adapters.orm import ChatORM
+from chats.domain.models import MessageData
+from tests.test_bm25_indexes import build_retriever, make_documents
+from users.adapters.orm import TransactionORM, UserORM
+
+USER_ID = 1
+CHAT_ID = 1
+# Пути индексов в конфигурации задаются относительно корня проекта.
+PROJECT_ROOT = Path(__file__).parents[2]
+
+
+class AnsweringLLMService:
+    """Сервис ответов без RAG-системы и модели."""
+
+    async def get_only_rag_answer(self, message: str) -> MessageData:
+        """Ответ на вопрос."""
+        return MessageData(role="assistant", content=f"ответ: {message}")
+
+
+async def make_database(make_session_factory):
+    """Фабрика сессий SQLite с учетом запросов, пользователем и чатом."""
+    session_factory = await make_session_factory(Base.metadata)
+    instrument_engine(session_factory.kw["bind"])
+    async with session_factory() as session:
+        await session.execute(
+            insert(UserORM),
+            [{"id": USER_ID, "email": "user@example.com", "password": ""}],
+        )
+        await session.execute(
+            insert(TransactionORM),
+            [
+                {
+                    "user_id": USER_ID,
+                    "amount": 100,
+                    "transaction_type": TransactionType.INCOME,
+                }
+            ],
+        )
+        await session.execute(
+            insert(ChatORM),
+            [
+                {
+                    "id": CHAT_ID,
+                    "user_id": USER_ID,
+                    "type": ChatTypeChoice.ONLY_RAG,
+                }
+            ],
+        )
+        await session.commit()
+    return session_factory
+
+
+@pytest.fixture
+def client(make_session_factory, tmp_path, monkeypatch):
+    """
+    Клиент приложения на SQLite с подмененным сервисом ответов.
+
+    Приложение при импорте загружает индекс BM25, поэтому ему задается
+    небольшой индекс во временном каталоге.
+    """
+    index_path = tmp_path / "bm25"
+    SegmentedBM25Index.from_retriever(
+        build_retriever(make_documents(20, seed=1))
+    ).save(index_path)
+    monkeypatch.setenv("RETRIEVER_TYPE", "bm25")
+    monkeypatch.setenv(
+        "BM25_MMAP_INDEX_PATH", os.path.relpath(index_path, PROJECT_ROOT)
+    )
+    from base.dependencies import get_metadata_cache, get_session_factory
+    from chats.entrypoints.api.dependencies import get_llm_service
+    from main import app
+
+    session_factory = asyncio.run(make_database(make_session_factory))
+    # Свой кэш метаданных, чтобы учет не зависел от предыдущих тестов.
+    metadata_cache = ChatMetadataCache(max_chats=10, ttl=60)
+    app.dependency_overrides = {
+        get_session_factory: lambda: session_factory,
+        get_metadata_cache: lambda: metadata_cache,
+        get_llm_service: AnsweringLLMService,
+    }
+    token = JWTHandler(get_secret_key(), 5, 5).create_token_pair(
+        JWTPayloadDTO(id=USER_ID)
+    )
+    yield TestClient(
+        app, headers={"Authorization": f"Bearer {token.access_token}"}
+    )
+    app.dependency_overrides = {}
+
+
+def test_chat_answer_and_messages_fit_budget(client, query_budget):
+    """Ответ в чате и чтение его сообщений укладываются в бюджет."""
+    with query_budget(statements=8, transactions=5, repeats=2):
+        response = client.post(
+            f"/api/v1/chats/chat/{CHAT_ID}/", json={"message": "вопрос"}
+        )
+    assert response.status_code == 200
+
+    with query_budget(statements=2, transactions=2, repeats=1):
+        response = client.get(f"/api/v1/chats/{CHAT_ID}/")
+    assert response.status_code == 200
+    assert [message["role"] for message in response.json()] == [
+        "user",
+        "assistant",
+    ]
+
+
+def test_exceeded_budget_fails(client, query_budget):
+    """Запрос сверх бюджета проваливает тест."""
+    with pytest.raises(pytest.fail.Exception, match="statements"):
+        with query_budget(statements=1):
+            client.get(f"/api/v1/chats/{CHAT_ID}/")
@@ -0,0 +1,60 @@
+"""Тесты передачи отметки записи между воркерами."""
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from base.database import (
+    LAST_WRITE_HEADER,
+    ReadYourWritesMiddleware,
+    ReadYourWritesTracker,
+)
+
+USER_ID = 1
+SECRET_KEY = "secret"
+
+
+def make_worker() -> TestClient:
+    """Клиент приложения со своим трекером, как у отдельного воркера."""
+    tracker = ReadYourWritesTracker(window=60, secret_key=SECRET_KEY)
+
+    async def write(request):
+        tracker.mark_write(USER_ID)
+        return JSONResponse(None)
+
+    async def read(request):
+        return JSONResponse(tracker.must_read_primary(USER_ID))
+
+    app = Starlette(
+        routes=[
+            Route("/write", write, methods=["POST"]),
+            Route("/read", read),
+        ]
+    )
+    app.add_middleware(ReadYourWritesMiddleware, tracker=tracker)
+    return TestClient(app)
+
+
+def test_marker_routes_reads_to_primary_in_other_worker():
+    """Чтение в другом воркере после записи идет в основную БД."""
+    writer, reader = make_worker(), make_worker()
+
+    response = writer.post("/write")
+    marker = response.headers[LAST_WRITE_HEADER]
+
+    assert reader.get("/read").json() is False
+    assert reader.get("/read", headers={LAST_WRITE_HEADER: marker}).json()
+    reader.cookies = response.cookies
+    assert reader.get("/read").json()
+
+
+def test_tampered_marker_is_ignored():
+    """Отметка с измененным временем не учитывается."""
+    writer, reader = make_worker(), make_worker()
+    marker = writer.post("/write").headers[LAST_WRITE_HEADER]
+    user_id, written_at, signature = marker.split(":")
+
+    forged = f"{user_id}:{float(written_at) + 30:.3f}:{signature}"
+
+    assert not reader.get("/read", headers={LAST_WRITE_HEADER: forged}).json()
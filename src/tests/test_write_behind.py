@@ -0,0 +1,165 @@
+"""Тесты буфера отложенной записи."""
+
+import asyncio
+
+import pytest
+from sqlalchemy import Integer, select, String
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from base.write_behind import WriteBehindBuffer
+
+
+class Base(DeclarativeBase):
+    """База моделей теста."""
+
+
+class NoteORM(Base):
+    """Строка тестовой таблицы."""
+
+    __tablename__ = "notes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    text: Mapped[str] = mapped_column(String)
+
+
+class FlakySessionFactory:
+    """Фабрика сессий, первые n_failures сессий которой теряют связь."""
+
+    def __init__(self, session_factory: async_sessionmaker, n_failures: int):
+        """Инициализация фабрики."""
+        self.session_factory = session_factory
+        self.n_failures = n_failures
+        self.n_sessions = 0
+
+    def __call__(self):
+        """Открытие сессии или отказ соединения."""
+        self.n_sessions += 1
+        if self.n_sessions <= self.n_failures:
+            raise OperationalError("INSERT", {}, ConnectionError("reset"))
+        return self.session_factory()
+
+
+async def read_ids(session_factory: async_sessionmaker) -> list[int]:
+    """Идентификаторы записанных строк."""
+    async with session_factory() as session:
+        return list(
+            await session.scalars(select(NoteORM.id).order_by(NoteORM.id))
+        )
+
+
+def rows(*ids: int) -> list[tuple]:
+    """Строки для add_many."""
+    return [(NoteORM, {"id": id_, "text": str(id_)}, False) for id_ in ids]
+
+
+def test_add_many_commits_rows_with_one_flush(make_session_factory):
+    """Строки одного запроса в режиме durable фиксируются одной пачкой."""
+
+    async def run():
+        session_factory = await make_session_factory(Base.metadata)
+        buffer = WriteBehindBuffer(
+            session_factory, max_rows=100, flush_interval=0.01, durable=True
+        )
+        buffer.start()
+        await buffer.add_many(rows(1, 2, 3, 4), user_id=1)
+        await buffer.close()
+        return buffer.get_stats(), await read_ids(session_factory)
+
+    stats, ids = asyncio.run(run())
+
+    assert ids == [1, 2, 3, 4]
+    assert stats["flushes"] == 1
+
+
+def test_transient_error_is_retried(make_session_factory):
+    """Строки не теряются при временной ошибке соединения."""
+
+    async def run():
+        session_factory = await make_session_factory(Base.metadata)
+        buffer = WriteBehindBuffer(
+            FlakySessionFactory(session_factory, n_failures=2),
+            max_rows=100,
+            flush_interval=0.01,
+            durable=True,
+        )
+        buffer.start()
+        await asyncio.wait_for(buffer.add_many(rows(1, 2), user_id=1), 5)
+        await buffer.close()
+        return buffer.get_stats(), await read_ids(session_factory)
+
+    stats, ids = asyncio.run(run())
+
+    assert ids == [1, 2]
+    assert stats["retries"] == 2
+    assert stats["dropped"] == 0
+
+
+def test_integrity_error_drops_only_bad_row(make_session_factory):
+    """Строка с ошибкой целостности не отменяет запись остальных."""
+
+    async def run():
+        session_factory = await make_session_factory(Base.metadata)
+        buffer = WriteBehindBuffer(
+            session_factory, max_rows=100, flush_interval=0.01, durable=True
+        )
+        buffer.start()
+        await buffer.add_many(rows(1), user_id=1)
+        results = await asyncio.gather(
+            buffer.add_many(rows(1), user_id=1),
+            buffer.add_many(rows(2), user_id=2),
+            return_exceptions=True,
+        )
+        await buffer.close()
+        return results, buffer.get_stats(), await read_ids(session_factory)
+
+    results, stats, ids = asyncio.run(run())
+
+    assert isinstance(results[0], IntegrityError)
+    assert results[1] is None
+    assert ids == [1, 2]
+    assert stats["dropped"] == 1
+
+
+def test_on_insert_runs_in_write_transaction(make_session_factory):
+    """Обработчик вставки получает строки пачки до ее фиксации."""
+
+    async def run():
+        session_factory = await make_session_factory(Base.metadata)
+        calls = []
+
+        async def on_insert(session, inserted):
+            calls.append(
+                (
+                    inserted,
+                    list(await session.scalars(select(NoteORM.id))),
+                )
+            )
+
+        buffer = WriteBehindBuffer(
+            session_factory,
+            max_rows=100,
+            flush_interval=0.01,
+            durable=True,
+            on_insert=on_insert,
+        )
+        buffer.start()
+        await buffer.add_many(rows(1, 2), user_id=1)
+        await buffer.close()
+        return calls
+
+    calls = asyncio.run(run())
+
+    assert calls == [
+        (
+            {NoteORM: [{"id": 1, "text": "1"}, {"id": 2, "text": "2"}]},
+            [1, 2],
+        )
+    ]
+
+
+@pytest.fixture(autouse=True)
+def quiet_write_behind_logs(caplog):
+    """Ожидаемые ошибки записи не засоряют вывод тестов."""
+    caplog.set_level("CRITICAL", logger="base.write_behind")
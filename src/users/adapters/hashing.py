@@ -0,0 +1,186 @@
+"""Модуль хеширования паролей в пуле процессов."""
+
+import asyncio
+import base64
+from concurrent.futures import Future, ProcessPoolExecutor
+import hashlib
+import hmac
+import multiprocessing
+import os
+
+from base.exceptions import ServiceOverloadedException
+
+HASHING_OVERLOADED_EXC_MESSAGE = (
+    "Слишком много одновременных входов, повторите запрос позже."
+)
+SCRYPT_PREFIX = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 64
+RETRY_AFTER_SECONDS = 1
+
+
+def _scrypt(password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """
+    Хеширование scrypt в процессе пула.
+
+    maxmem задается по формуле OpenSSL с запасом, иначе хеширование с n
+    от 2 ** 15 при r = 8 превышает ограничение памяти по умолчанию.
+    """
+    return hashlib.scrypt(
+        password,
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * r * (n + p + 2) + 2**20,
+        dklen=HASH_BYTES,
+    )
+
+
+def _b64encode(value: bytes) -> str:
+    """Кодирование байтов в base64 без выравнивания."""
+    return base64.b64encode(value).decode().rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    """Декодирование base64 без выравнивания."""
+    return base64.b64decode(value + "=" * (-len(value) % 4))
+
+
+class PasswordHasher:
+    """
+    Хеширование паролей scrypt в ограниченном пуле процессов.
+
+    Хеш хранится строкой scrypt$n$r$p$соль$хеш, поэтому смена параметров
+    стоимости не ломает проверку старых хешей. Хеширование занимает
+    десятки миллисекунд процессора и сотни килобайт памяти на каждый
+    вход, поэтому выполняется не в цикле событий, а в max_workers
+    процессах: остальные эндпойнты не ждут входов, а процессор остается
+    обработчикам запросов. Больше max_pending одновременных хеширований
+    не принимается, лишние входы сразу получают отказ с рекомендацией
+    повтора вместо ожидания в очереди пула.
+
+    Хеши SHA-512 прежнего формата проверяются в цикле событий: они
+    дешевы и заменяются хешем scrypt при следующем успешном входе.
+    """
+
+    def __init__(
+        self,
+        secret_key: str,
+        n: int,
+        r: int,
+        p: int,
+        max_workers: int,
+        max_pending: int,
+    ):
+        """Инициализация хеширования."""
+        self._secret_key = secret_key
+        self.n = n
+        self.r = r
+        self.p = p
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+        self._n_hashes = 0
+        self._n_rejected = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """
+        Пул процессов хеширования.
+
+        Процессы запускаются через spawn: fork процесса с потоками и
+        циклом событий может унаследовать захваченные блокировки.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _peppered(self, password: str) -> bytes:
+        """Пароль с секретным ключом приложения."""
+        return (password + self._secret_key).encode()
+
+    async def _scrypt(
+        self, password: str, salt: bytes, n: int, r: int, p: int
+    ) -> bytes:
+        """
+        Хеширование в пуле процессов с ограничением параллелизма.
+
+        Слот освобождается по завершении хеширования в процессе, а не при
+        отмене ожидающего запроса, чтобы отключившиеся клиенты не
+        позволяли превысить лимит.
+        """
+        if self._pending >= self.max_pending:
+            self._n_rejected += 1
+            raise ServiceOverloadedException(
+                HASHING_OVERLOADED_EXC_MESSAGE, RETRY_AFTER_SECONDS
+            )
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(
+            _scrypt, self._peppered(password), salt, n, r, p
+        )
+        self._pending += 1
+
+        def release(_: Future) -> None:
+            self._pending -= 1
+
+        future.add_done_callback(
+            lambda done: loop.call_soon_threadsafe(release, done)
+        )
+        self._n_hashes += 1
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        """Хеширование пароля с текущими параметрами."""
+        salt = os.urandom(SALT_BYTES)
+        digest = await self._scrypt(password, salt, self.n, self.r, self.p)
+        return "$".join(
+            (
+                SCRYPT_PREFIX,
+                str(self.n),
+                str(self.r),
+                str(self.p),
+                _b64encode(salt),
+                _b64encode(digest),
+            )
+        )
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """Проверка пароля по хешу scrypt или прежнего формата."""
+        if not password_hash.startswith(f"{SCRYPT_PREFIX}$"):
+            legacy_hash = hashlib.sha512(self._peppered(password)).hexdigest()
+            return hmac.compare_digest(legacy_hash, password_hash)
+        _, n, r, p, salt, digest = password_hash.split("$")
+        computed = await self._scrypt(
+            password, _b64decode(salt), int(n), int(r), int(p)
+        )
+        return hmac.compare_digest(computed, _b64decode(digest))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Нужно ли перехешировать пароль с текущими параметрами."""
+        if not password_hash.startswith(f"{SCRYPT_PREFIX}$"):
+            return True
+        _, n, r, p, _, _ = password_hash.split("$")
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+    async def close(self) -> None:
+        """Остановка процессов хеширования."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        """Статистика хеширования."""
+        return {
+            "n": self.n,
+            "r": self.r,
+            "p": self.p,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "hashes": self._n_hashes,
+            "rejected": self._n_rejected,
+        }
@@ -22,9 +22,11 @@ class UserORM(Base):
     password: Mapped[str]
     created_at: Mapped[created_at]
 
-    chats: Mapped[list["ChatORM"]] = relationship(back_populates="user")
+    chats: Mapped[list["ChatORM"]] = relationship(
+        back_populates="user", passive_deletes=True
+    )
     transactions: Mapped["TransactionORM"] = relationship(
-        back_populates="user", uselist=False
+        back_populates="user", uselist=False, passive_deletes=True
     )
 
 
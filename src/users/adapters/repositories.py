@@ -1,8 +1,9 @@
 """Модуль реализации паттерна репозиторий."""
 
 import abc
+from typing import AsyncIterator, Sequence
 
-from sqlalchemy import select, func
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from base.entities import TransactionType
@@ -12,6 +13,9 @@ from ..domain.models import User, UserCredentials, TransactionData
 
 ALREADY_EXISTS_EXC_MESSAGE = "Создаваемый пользователь уже существует."
 DOESNT_EXISTS_EXC_MESSAGE = "Пользователь не найден."
+TRANSACTION_EXPORT_FIELDS = ["id", "amount", "transaction_type"]
+# Поля строк в порядке полей модели ответа TransactionData.
+TRANSACTION_FIELDS = ["amount", "transaction_type"]
 
 
 class UserAbstractDatabaseRepository(abc.ABC):
@@ -34,8 +38,12 @@ class UserAbstractDatabaseRepository(abc.ABC):
         """Получение списка всех объектов-пользователей из БД."""
 
     @abc.abstractmethod
-    async def login(self, credentials: UserCredentials) -> User:
-        """Проверка учетных данных пользователя."""
+    async def get_by_email(self, email: str) -> User:
+        """Получение объекта-пользователя с хешем пароля по почте."""
+
+    @abc.abstractmethod
+    async def update_password(self, user_id: int, password: str) -> None:
+        """Замена хеша пароля пользователя."""
 
     @abc.abstractmethod
     async def get_user_balance(self, user_id: int) -> float:
@@ -49,6 +57,16 @@ class UserAbstractDatabaseRepository(abc.ABC):
     async def get_transactions(self, user_id: int) -> list[TransactionData]:
         """Получение истории транзакций."""
 
+    @abc.abstractmethod
+    async def get_transaction_rows(self, user_id: int) -> Sequence[Sequence]:
+        """Получение строк истории транзакций."""
+
+    @abc.abstractmethod
+    def stream_transactions(
+        self, user_id: int, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """Потоковое чтение истории транзакций пачками строк."""
+
 
 class UserSQLAlchemyRepository(UserAbstractDatabaseRepository):
     """Репозиторий базы данных SQLAlchemy."""
@@ -88,23 +106,40 @@ class UserSQLAlchemyRepository(UserAbstractDatabaseRepository):
         self.session.add(user)
 
     async def delete(self, user_id: int) -> None:
-        """Удаление объекта-пользователя из БД."""
-        user = await self._get(user_id=user_id)
-        await self.session.delete(user)
+        """
+        Удаление объекта-пользователя из БД.
+
+        Пользователь удаляется одним запросом без загрузки чатов и
+        транзакций, которые удаляют каскадные внешние ключи в БД.
+        """
+        result = await self.session.execute(
+            delete(UserORM).where(UserORM.id == user_id)
+        )
+        if not result.rowcount:
+            raise DoesntExistException(DOESNT_EXISTS_EXC_MESSAGE)
 
     async def get_users(self) -> list[User]:
         """Получение списка всех объектов-пользователей из БД."""
         users = await self.session.execute(select(UserORM))
         return [User(**user.__dict__) for user in users.scalars().all()]
 
-    async def login(self, credentials: UserCredentials) -> User:
-        """Проверка учетных данных пользователя."""
-        user = await self._get(
-            email=credentials.email,
-            password=credentials.password,
-        )
+    async def get_by_email(self, email: str) -> User:
+        """
+        Получение объекта-пользователя с хешем пароля по почте.
+
+        Пароль проверяется сервисом: хеш с солью нельзя найти фильтром.
+        """
+        user = await self._get(email=email)
         return User(**user.__dict__)
 
+    async def update_password(self, user_id: int, password: str) -> None:
+        """Замена хеша пароля пользователя."""
+        await self.session.execute(
+            update(UserORM)
+            .where(UserORM.id == user_id)
+            .values(password=password)
+        )
+
     async def get_user_balance(self, user_id: int) -> float:
         """Получение баланса личного счета."""
         income_query = select(func.sum(TransactionORM.amount)).where(
@@ -127,10 +162,49 @@ class UserSQLAlchemyRepository(UserAbstractDatabaseRepository):
         self, user_id: int, data: TransactionData
     ) -> None:
         """Добавление транзакции для пользователя."""
-        transaction = TransactionORM(**data.model_dump(), user_id=user_id)
-        self.session.add(transaction)
+        self.session.add(TransactionORM(**transaction_row(user_id, data)))
 
     async def get_transactions(self, user_id: int) -> list[TransactionData]:
         """Получение истории транзакций."""
         transactions = await self.session.execute(select(TransactionORM).filter_by(user_id=user_id))
         return [TransactionData(**transaction.__dict__) for transaction in transactions.scalars().all()]
+
+    async def get_transaction_rows(self, user_id: int) -> Sequence[Sequence]:
+        """
+        Получение строк истории транзакций.
+
+        Поля строк совпадают с TRANSACTION_FIELDS.
+        """
+        result = await self.session.execute(
+            select(TransactionORM.amount, TransactionORM.transaction_type)
+            .filter_by(user_id=user_id)
+            .order_by(TransactionORM.id)
+        )
+        return result.all()
+
+    async def stream_transactions(
+        self, user_id: int, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """
+        Потоковое чтение истории транзакций пачками строк.
+
+        Строки читаются курсором на стороне сервера по batch_size штук.
+        Поля строк совпадают с TRANSACTION_EXPORT_FIELDS.
+        """
+        result = await self.session.stream(
+            select(
+                TransactionORM.id,
+                TransactionORM.amount,
+                TransactionORM.transaction_type,
+            )
+            .filter_by(user_id=user_id)
+            .order_by(TransactionORM.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
+
+
+def transaction_row(user_id: int, data: TransactionData) -> dict:
+    """Значения столбцов таблицы транзакций для вставки транзакции."""
+    return {**data.model_dump(), "user_id": user_id}
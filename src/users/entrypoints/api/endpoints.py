@@ -1,8 +1,9 @@
 """Эндпойнты модуля пользователей."""
 
 from fastapi import APIRouter
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 
+from base.config import ExportFormatChoice, get_export_batch_size
 from base.data_structures import (
     AccessTokenDTO,
     JWTPayloadDTO,
@@ -10,10 +11,22 @@ from base.data_structures import (
 )
 from base.dependencies import (
     JWTHandlerDependency,
+    PasswordHasherDependency,
     TokenDependency,
     UserServiceDependency,
 )
 from base.entities import TransactionType
+from base.utils import (
+    dump_json_rows,
+    EXPORT_MEDIA_TYPES,
+    JSON_MEDIA_TYPE,
+    prefetch,
+    serialize_export,
+)
+from ...adapters.repositories import (
+    TRANSACTION_EXPORT_FIELDS,
+    TRANSACTION_FIELDS,
+)
 from ...domain.models import UserCredentials, TransactionData
 
 router = APIRouter()
@@ -94,10 +107,54 @@ async def balance(
     return await service.get_user_balance(user_id_from_token)
 
 
-@router.get("/transactions/")
+@router.get("/transactions/", response_model=list[TransactionData])
 async def get_transactions(
     data_from_token: TokenDependency,
     service: UserServiceDependency,
-):
-    """Получение истории транзакций."""
-    return await service.get_transactions_for_user(data_from_token.id)
+) -> Response:
+    """
+    Получение истории транзакций.
+
+    Строки БД сериализуются в JSON напрямую, без моделей ответа.
+    """
+    return Response(
+        dump_json_rows(
+            await service.get_transaction_rows_for_user(data_from_token.id),
+            TRANSACTION_FIELDS,
+        ),
+        media_type=JSON_MEDIA_TYPE,
+    )
+
+
+@router.get("/transactions/export/")
+async def export_transactions(
+    data_from_token: TokenDependency,
+    service: UserServiceDependency,
+    export_format: ExportFormatChoice = ExportFormatChoice.NDJSON,
+) -> StreamingResponse:
+    """Потоковая выгрузка истории транзакций."""
+    partitions = await prefetch(
+        service.stream_transactions_for_user(
+            data_from_token.id, get_export_batch_size()
+        )
+    )
+    return StreamingResponse(
+        serialize_export(
+            partitions, TRANSACTION_EXPORT_FIELDS, export_format
+        ),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=transactions.{export_format.value}"
+            )
+        },
+    )
+
+
+@router.get("/password-hashing/stats/", status_code=200)
+async def get_password_hashing_stats(
+    password_hasher: PasswordHasherDependency,
+    data_from_token: TokenDependency,
+) -> dict:
+    """Получение загрузки и параметров хеширования паролей."""
+    return password_hasher.get_stats()
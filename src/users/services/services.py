@@ -1,8 +1,13 @@
 """Бизнес-логика."""
 
-import hashlib
+from typing import AsyncIterator, Sequence
 
 from base.exceptions import DoesntExistException, UnauthorizedException
+from base.write_behind import WriteBehindBuffer
+from chats.adapters.metadata_cache import ChatMetadataCache
+from ..adapters.hashing import PasswordHasher
+from ..adapters.orm import TransactionORM
+from ..adapters.repositories import transaction_row
 from ..domain.models import User, UserCredentials, TransactionData
 from ..services.unit_of_work import UserAbstractUnitOfWork
 
@@ -10,59 +15,123 @@ from ..services.unit_of_work import UserAbstractUnitOfWork
 class UserService:
     """Сервис для работы с пользователями."""
 
-    def __init__(self, uow: UserAbstractUnitOfWork, secret_key: str):
-        """Инициализация сервиса."""
+    def __init__(
+        self,
+        uow: UserAbstractUnitOfWork,
+        password_hasher: PasswordHasher,
+        write_buffer: WriteBehindBuffer | None = None,
+        chat_metadata_cache: ChatMetadataCache | None = None,
+    ):
+        """
+        Инициализация сервиса.
+
+        С write_buffer транзакции записываются в БД пачками, а чтения
+        баланса и истории сначала записывают строки пользователя из
+        буфера. Из chat_metadata_cache после удаления пользователя
+        сбрасываются его чаты, удаленные каскадным внешним ключом.
+        """
         self._uow = uow
-        self._secret_key = secret_key
+        self._password_hasher = password_hasher
+        self._write_buffer = write_buffer
+        self._chat_metadata_cache = chat_metadata_cache
 
-    def _hash_password(self, password: str) -> str:
-        """Хеширование пароля."""
-        return hashlib.sha512(
-            (password + self._secret_key).encode()
-        ).hexdigest()
+    async def _sync_writes(self, user_id: int) -> None:
+        """Запись отложенных строк пользователя перед чтением."""
+        if self._write_buffer is not None:
+            await self._write_buffer.sync(user_id)
 
     async def get_user(self, user_id: int) -> User:
         """Получение пользователя."""
-        async with self._uow as uow:
+        async with self._uow.read_only(user_id) as uow:
             return await uow.users.get(user_id)
 
     async def delete_user(self, user_id: int) -> None:
         """Удаление пользователя."""
+        await self._sync_writes(user_id)
         async with self._uow as uow:
             await uow.users.delete(user_id)
             await uow.commit()
+        self._uow.mark_write(user_id)
+        if self._chat_metadata_cache is not None:
+            self._chat_metadata_cache.invalidate_user(user_id)
 
     async def add_user(self, user: UserCredentials) -> None:
         """Добавление пользователя."""
-        user.password = self._hash_password(user.password)
+        user.password = await self._password_hasher.hash(user.password)
         async with self._uow as uow:
             await uow.users.add(user)
             await uow.commit()
 
     async def login_user(self, credentials: UserCredentials) -> User:
-        """Аутентификация пользователя."""
-        credentials.password = self._hash_password(credentials.password)
+        """
+        Аутентификация пользователя.
+
+        Для несуществующей почты пароль все равно хешируется, чтобы по
+        времени ответа нельзя было узнать зарегистрированные адреса. Хеш
+        прежнего формата или с устаревшими параметрами после успешной
+        проверки заменяется хешем с текущими параметрами.
+        """
+        hasher = self._password_hasher
         async with self._uow as uow:
             try:
-                return await uow.users.login(credentials)
+                user = await uow.users.get_by_email(credentials.email)
             except DoesntExistException:
-                raise UnauthorizedException(
-                    "Пользователя с таким учетными данными не существует."
-                )
+                user = None
+        if user is None:
+            await hasher.hash(credentials.password)
+        if user is None or not await hasher.verify(
+            credentials.password, user.password
+        ):
+            raise UnauthorizedException(
+                "Пользователя с таким учетными данными не существует."
+            )
+        if hasher.needs_rehash(user.password):
+            user.password = await hasher.hash(credentials.password)
+            async with self._uow as uow:
+                await uow.users.update_password(user.id, user.password)
+                await uow.commit()
+        return user
 
     async def get_user_balance(self, user_id: int) -> float:
         """Получение баланса пользователя."""
-        async with self._uow as uow:
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
             return await uow.users.get_user_balance(user_id)
 
     async def add_transaction_for_user(
         self, user_id: int, data: TransactionData
     ) -> None:
         """Добавление транзакции."""
-        async with self._uow as uow:
-            await uow.users.add_transaction(user_id, data)
-            await uow.commit()
+        if self._write_buffer is not None:
+            await self._write_buffer.add(
+                TransactionORM, transaction_row(user_id, data), user_id
+            )
+        else:
+            async with self._uow as uow:
+                await uow.users.add_transaction(user_id, data)
+                await uow.commit()
+        self._uow.mark_write(user_id)
 
     async def get_transactions_for_user(self, user_id: int) -> list[TransactionData]:
-        async with self._uow as uow:
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
             return await uow.users.get_transactions(user_id)
+
+    async def get_transaction_rows_for_user(
+        self, user_id: int
+    ) -> Sequence[Sequence]:
+        """Получение строк истории транзакций для сериализации без моделей."""
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            return await uow.users.get_transaction_rows(user_id)
+
+    async def stream_transactions_for_user(
+        self, user_id: int, batch_size: int
+    ) -> AsyncIterator[Sequence[Sequence]]:
+        """Потоковое чтение истории транзакций пачками строк."""
+        await self._sync_writes(user_id)
+        async with self._uow.read_only(user_id) as uow:
+            async for rows in uow.users.stream_transactions(
+                user_id, batch_size
+            ):
+                yield rows
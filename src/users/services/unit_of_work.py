@@ -7,6 +7,7 @@ from sqlalchemy.ext.asyncio import (
     AsyncSession,
 )
 
+from base.database import ReadYourWritesTracker
 from ..adapters.repositories import (
     UserAbstractDatabaseRepository,
     UserSQLAlchemyRepository,
@@ -37,13 +38,34 @@ class UserAbstractUnitOfWork(abc.ABC):
     async def rollback(self):
         """Откат транзакции."""
 
+    def read_only(
+        self, user_id: int | None = None
+    ) -> "UserAbstractUnitOfWork":
+        """Единица работы для чтения данных пользователя без записи."""
+        return self
+
+    def mark_write(self, user_id: int) -> None:
+        """Учет зафиксированной записи данных пользователя."""
+
 
 class UserSqlAlchemyUnitOfWork(UserAbstractUnitOfWork):
     """UoW для SQLAlchemy."""
 
-    def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
-        """Инициализация UoW."""
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        read_session_factory: async_sessionmaker[AsyncSession] | None = None,
+        write_tracker: ReadYourWritesTracker | None = None,
+    ):
+        """
+        Инициализация UoW.
+
+        read_session_factory задает сессии реплики для чтения. Чтения
+        пользователя, недавно записавшего данные, остаются в основной БД.
+        """
         self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._write_tracker = write_tracker
 
     async def __aenter__(self):
         """Инициализация UoW через менеджер контекста."""
@@ -68,3 +90,19 @@ class UserSqlAlchemyUnitOfWork(UserAbstractUnitOfWork):
     async def rollback(self):
         """Откат транзакции."""
         await self.session.rollback()
+
+    def read_only(
+        self, user_id: int | None = None
+    ) -> "UserSqlAlchemyUnitOfWork":
+        """Единица работы на сессиях реплики, если она задана и актуальна."""
+        if self._read_session_factory is None or (
+            self._write_tracker is not None
+            and self._write_tracker.must_read_primary(user_id)
+        ):
+            return self
+        return UserSqlAlchemyUnitOfWork(self._read_session_factory)
+
+    def mark_write(self, user_id: int) -> None:
+        """Учет записи для чтения пользователем своих изменений."""
+        if self._write_tracker is not None:
+            self._write_tracker.mark_write(user_id)